@@ -0,0 +1,436 @@
+"""
+End-to-end book generation benchmark.
+
+Runs the app against the offline OpenAI stand-in (fake_openai.py) and drives it
+the way the browser does: POST /generate-story, follow /stream_progress/<task_id>
+for page events, poll /progress/<task_id> until the book is done, then fetch the
+PDF from /download/<task_id>. For each story and concurrency level, N clients
+generate books back to back. The results are:
+
+    books_per_minute     completed books per minute of wall time at that level
+    time_to_first_page   p50 / p95 seconds from submitting to the first page_complete event
+    time_to_pdf          p50 / p95 seconds from submitting to status 'complete'
+
+The red path exercises face compositing (replace_face_in_image) and PDF assembly.
+The Jack path exercises the DALL-E task graph, the rate governor and the vision
+calls. Results are written as JSON. --compare checks one results file against a
+baseline and exits with status 1 if any metric regressed by more than
+--threshold.
+
+The stand-in has no rate limits, so the app under test runs without the
+client-side limits of OPENAI_RATE_LIMITS unless --rate-limits sets them. The
+value used is recorded in the results (meta.openai_rate_limits). --api-rate-limits
+makes the stand-in enforce budgets of its own and report them in x-ratelimit-*
+headers, to exercise the governor's header-driven re-rating and 429 handling.
+
+The app's database, vision cache and log go in a temporary work directory that
+is deleted afterwards, unless the run fails or --keep-work-dir is given.
+
+Usage:
+    python benchmarks/bench_e2e.py --stories red,jack --concurrency 1,2,4 --books 2 --output results.json
+    python benchmarks/bench_e2e.py --latency chat=0.8:0.3,images=6:2 --errors 429=0.02 --output results.json
+    python benchmarks/bench_e2e.py --rate-limits gpt-4o=500:30000,gpt-4=500:10000 ...   # with client-side limits
+    python benchmarks/bench_e2e.py --url http://localhost:5000 ...    # an app already pointed at a stand-in
+    python benchmarks/bench_e2e.py --compare baseline.json results.json --threshold 0.15
+"""
+
+import argparse
+import io
+import json
+import math
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+import httpx
+from PIL import Image
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from fake_openai import FakeOpenAIServer, parse_errors, parse_latency
+from rate_governor import parse_rate_limits
+
+STORY_GENDERS = {'red': 'girl', 'jack': 'boy'}
+TERMINAL_STATUSES = ('complete', 'error')
+
+# Metrics compared by --compare: (path in a result entry, True if higher is better)
+COMPARED_METRICS = [
+    ('books_per_minute', True),
+    ('time_to_first_page.p50', False),
+    ('time_to_first_page.p95', False),
+    ('time_to_pdf.p50', False),
+    ('time_to_pdf.p95', False),
+]
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a list of numbers (None if empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return round(ordered[index], 3)
+
+
+def distribution(values):
+    values = [v for v in values if v is not None]
+    return {
+        'p50': percentile(values, 0.50),
+        'p95': percentile(values, 0.95),
+        'max': round(max(values), 3) if values else None,
+        'count': len(values)
+    }
+
+
+def make_photo():
+    """A synthetic upload: skin-toned face shape on a plain background."""
+    image = Image.new('RGB', (512, 512), (120, 160, 200))
+    face = Image.new('RGB', (220, 280), (224, 180, 150))
+    image.paste(face, (146, 100))
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return None
+
+
+class AppProcess:
+    """The app started with `python project.py`, pointed at the stand-in."""
+    
+    def __init__(self, port, env, log_path):
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.env = env
+        self.log_path = log_path
+        self._process = None
+    
+    def start(self, timeout=120):
+        # Seed the storylines the red path reads its page text from
+        with open(self.log_path, 'ab') as log:
+            subprocess.run([sys.executable, 'load_stories.py'], cwd=REPO_ROOT, env=self.env,
+                           stdout=log, stderr=subprocess.STDOUT, timeout=timeout)
+            self._process = subprocess.Popen([sys.executable, 'project.py'], cwd=REPO_ROOT, env=self.env,
+                                             stdout=log, stderr=subprocess.STDOUT)
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self._process.poll() is not None:
+                raise RuntimeError(f"App exited with status {self._process.returncode}; see {self.log_path}")
+            try:
+                httpx.get(f"{self.url}/progress/ping", timeout=2)
+                return
+            except httpx.HTTPError:
+                time.sleep(0.5)
+        raise RuntimeError(f"App did not start within {timeout}s; see {self.log_path}")
+    
+    def stop(self):
+        if self._process is not None and self._process.poll() is None:
+            self._process.terminate()
+            try:
+                self._process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self._process.kill()
+
+
+def follow_events(client, base_url, task_id, events, done):
+    """Record (seconds, type) for every SSE event of a task until generation_complete."""
+    try:
+        with client.stream('GET', f"{base_url}/stream_progress/{task_id}",
+                           timeout=httpx.Timeout(35.0, connect=5.0)) as response:
+            for line in response.iter_lines():
+                if done.is_set():
+                    break
+                if not line.startswith('data: '):
+                    continue
+                event = json.loads(line[len('data: '):])
+                events.append((time.time(), event.get('type')))
+                if event.get('type') == 'generation_complete':
+                    break
+    except (httpx.HTTPError, ValueError):
+        pass
+
+
+def run_book(client, base_url, story, photo, name, poll_interval, book_timeout):
+    """
+    Generate one book through the HTTP API.
+    
+    Returns:
+        dict: One sample (story, task_id, status, submit_seconds, time_to_first_page,
+              time_to_pdf, page_events, pdf_bytes, error)
+    """
+    sample = {'story': story, 'task_id': None, 'status': None, 'submit_seconds': None,
+              'time_to_first_page': None, 'time_to_pdf': None, 'page_events': 0, 'pdf_bytes': None, 'error': None}
+    started = time.time()
+    try:
+        response = client.post(f"{base_url}/generate-story", data={
+            'gender': STORY_GENDERS.get(story, 'girl'),
+            'story': story,
+            'character_name': 'Alex'
+        }, files={'image': (f'{name}.png', photo, 'image/png')}, timeout=60)
+        body = response.json()
+    except (httpx.HTTPError, ValueError) as e:
+        sample['error'] = f"submit failed: {e}"
+        return sample
+    sample['submit_seconds'] = round(time.time() - started, 3)
+    if not body.get('success'):
+        sample['error'] = body.get('error') or f"HTTP {response.status_code}"
+        return sample
+    task_id = sample['task_id'] = body['task_id']
+    
+    events = []
+    done = threading.Event()
+    follower = threading.Thread(target=follow_events, args=(client, base_url, task_id, events, done), daemon=True)
+    follower.start()
+    
+    # /progress decides when the book is finished; the event stream only gives page timings
+    first_progress = None
+    deadline = started + book_timeout
+    progress = {}
+    while time.time() < deadline:
+        try:
+            progress = client.get(f"{base_url}/progress/{task_id}", timeout=10).json()
+        except (httpx.HTTPError, ValueError):
+            progress = {}
+        if first_progress is None and (progress.get('progress') or 0) >= 1:
+            first_progress = time.time()
+        if progress.get('status') in TERMINAL_STATUSES:
+            break
+        time.sleep(poll_interval)
+    finished = time.time()
+    done.set()
+    follower.join(timeout=5)
+    
+    sample['status'] = progress.get('status') or 'timeout'
+    sample['error'] = progress.get('error')
+    page_events = [t for t, kind in events if kind == 'page_complete']
+    sample['page_events'] = len(page_events)
+    first_page = page_events[0] if page_events else first_progress
+    if first_page is not None:
+        sample['time_to_first_page'] = round(first_page - started, 3)
+    if sample['status'] == 'complete':
+        sample['time_to_pdf'] = round(finished - started, 3)
+        try:
+            pdf = client.get(f"{base_url}/download/{task_id}", timeout=60)
+            sample['pdf_bytes'] = len(pdf.content) if pdf.status_code == 200 else None
+        except httpx.HTTPError as e:
+            sample['error'] = f"download failed: {e}"
+    return sample
+
+
+def run_level(base_url, story, concurrency, books_per_client, photo, poll_interval, book_timeout):
+    """Run `concurrency` clients that each generate `books_per_client` books back to back."""
+    samples = []
+    lock = threading.Lock()
+    
+    def client_loop(client_index):
+        with httpx.Client() as client:
+            for book_index in range(books_per_client):
+                sample = run_book(client, base_url, story, photo, f"bench_{story}_{concurrency}_{client_index}_{book_index}",
+                                  poll_interval, book_timeout)
+                sample['concurrency'] = concurrency
+                with lock:
+                    samples.append(sample)
+                status = sample['status'] or 'failed'
+                print(f"  [{story} x{concurrency}] client {client_index} book {book_index + 1}: {status}, "
+                      f"first page {sample['time_to_first_page']}s, PDF {sample['time_to_pdf']}s")
+    
+    started = time.time()
+    threads = [threading.Thread(target=client_loop, args=(i,)) for i in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.time() - started
+    
+    completed = [s for s in samples if s['status'] == 'complete']
+    return {
+        'story': story,
+        'concurrency': concurrency,
+        'books': len(samples),
+        'completed': len(completed),
+        'failed': len(samples) - len(completed),
+        'wall_seconds': round(wall_seconds, 3),
+        'books_per_minute': round(len(completed) * 60.0 / wall_seconds, 3) if wall_seconds else 0.0,
+        'time_to_first_page': distribution([s['time_to_first_page'] for s in samples]),
+        'time_to_pdf': distribution([s['time_to_pdf'] for s in completed]),
+        'submit_seconds': distribution([s['submit_seconds'] for s in samples])
+    }, samples
+
+
+def _metric(entry, path):
+    value = entry
+    for key in path.split('.'):
+        value = value.get(key) if isinstance(value, dict) else None
+    return value
+
+
+def compare_results(baseline, current, threshold):
+    """
+    Compare two results files level by level.
+    
+    Returns:
+        list: Regression descriptions (empty if nothing regressed by more than threshold)
+    """
+    base_levels = {(r['story'], r['concurrency']): r for r in baseline['results']}
+    regressions = []
+    print(f"{'story':<6} {'conc':>4}  {'metric':<24} {'baseline':>10} {'current':>10} {'change':>8}")
+    for entry in current['results']:
+        base = base_levels.get((entry['story'], entry['concurrency']))
+        if base is None:
+            continue
+        for path, higher_is_better in COMPARED_METRICS:
+            old, new = _metric(base, path), _metric(entry, path)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            flag = ' ✗' if worse > threshold else ''
+            print(f"{entry['story']:<6} {entry['concurrency']:>4}  {path:<24} {old:>10} {new:>10} {change:>+8.1%}{flag}")
+            if worse > threshold:
+                regressions.append(f"{entry['story']} x{entry['concurrency']} {path}: {old} -> {new} ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end book generation benchmark")
+    parser.add_argument('--stories', default='red,jack', help='Comma-separated stories to run (red, jack)')
+    parser.add_argument('--concurrency', default='1,2,4', help='Comma-separated numbers of concurrent clients')
+    parser.add_argument('--books', type=int, default=1, help='Books each client generates per level')
+    parser.add_argument('--latency', default='chat=1.0:0.3,images=4:1,embeddings=0.1',
+                        help='Stand-in latency, endpoint=mean[:stddev] seconds')
+    parser.add_argument('--errors', default='', help='Stand-in error rates, status=probability')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for the stand-in latency and error draws')
+    parser.add_argument('--api-rate-limits', default='',
+                        help='Budgets the stand-in enforces and reports in x-ratelimit-* headers, model=rpm:tpm,...')
+    parser.add_argument('--rate-limits', default='',
+                        help="OPENAI_RATE_LIMITS for the app under test, model=rpm:tpm,... "
+                             "(default: none, so results measure the pipeline rather than the client-side limiter)")
+    parser.add_argument('--port', type=int, default=5077, help='Port for the app under test')
+    parser.add_argument('--url', help='Use an already running app instead of starting one')
+    parser.add_argument('--app-env', action='append', default=[], metavar='KEY=VALUE',
+                        help='Extra environment for the app under test (repeatable)')
+    parser.add_argument('--poll-interval', type=float, default=0.5, help='Seconds between /progress polls')
+    parser.add_argument('--book-timeout', type=float, default=900, help='Seconds before a book counts as timed out')
+    parser.add_argument('--keep-work-dir', action='store_true',
+                        help="Keep the app's database, vision cache and log instead of deleting them")
+    parser.add_argument('--output', help='Write JSON results to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='Compare two results files')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Relative change counted as a regression')
+    args = parser.parse_args()
+    
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        regressions = compare_results(baseline, current, args.threshold)
+        if regressions:
+            print(f"\n✗ {len(regressions)} regression(s) above {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\n✓ No regressions above {args.threshold:.0%}")
+        return
+    
+    stories = [s.strip() for s in args.stories.split(',') if s.strip()]
+    levels = [int(c) for c in args.concurrency.split(',') if c.strip()]
+    photo = make_photo()
+    
+    fake = None
+    app = None
+    work_dir = None
+    base_url = args.url
+    # Client-side limits of the app under test (unknown for an app started elsewhere)
+    rate_limits = None
+    keep_work_dir = args.keep_work_dir
+    results = []
+    samples = []
+    try:
+        if base_url is None:
+            work_dir = tempfile.mkdtemp(prefix='bench_e2e_')
+            fake = FakeOpenAIServer(port=0, latency=parse_latency(args.latency), errors=parse_errors(args.errors), seed=args.seed,
+                                    rate_limits=parse_rate_limits(args.api_rate_limits))
+            fake.start()
+            env = dict(os.environ)
+            env.update({
+                'OPENAI_API_KEY': 'fake',
+                'OPENAI_BASE_URL': fake.base_url,
+                'OPENAI_RATE_LIMITS': args.rate_limits,
+                'PORT': str(args.port),
+                'DATABASE_URL': f"sqlite:///{os.path.join(work_dir, 'bench.db')}",
+                'VISION_CACHE_DIR': os.path.join(work_dir, 'vision_cache'),
+                # Stand-in images repeat across books; don't let the vision cache hide the calls
+                'VISION_CACHE_BYPASS': '1'
+            })
+            for item in args.app_env:
+                key, _, value = item.partition('=')
+                env[key] = value
+            rate_limits = env['OPENAI_RATE_LIMITS']
+            app = AppProcess(args.port, env, os.path.join(work_dir, 'app.log'))
+            print(f"Starting app on port {args.port} against {fake.base_url} (log: {app.log_path}, "
+                  f"rate limits: {rate_limits or 'none'})")
+            app.start()
+            base_url = app.url
+        
+        for story in stories:
+            for concurrency in levels:
+                print(f"\n▶ {story}: {concurrency} concurrent client(s), {args.books} book(s) each")
+                summary, level_samples = run_level(base_url, story, concurrency, args.books, photo,
+                                                   args.poll_interval, args.book_timeout)
+                results.append(summary)
+                samples.extend(level_samples)
+                print(f"✓ {story} x{concurrency}: {summary['completed']}/{summary['books']} books, "
+                      f"{summary['books_per_minute']} books/min, "
+                      f"first page p50 {summary['time_to_first_page']['p50']}s / p95 {summary['time_to_first_page']['p95']}s, "
+                      f"PDF p50 {summary['time_to_pdf']['p50']}s / p95 {summary['time_to_pdf']['p95']}s")
+    except Exception:
+        # Keep the app log that the error points at
+        keep_work_dir = True
+        raise
+    finally:
+        if app is not None:
+            app.stop()
+        if fake is not None:
+            fake.stop()
+        if work_dir is not None:
+            if keep_work_dir:
+                print(f"Work directory kept: {work_dir}")
+            else:
+                shutil.rmtree(work_dir, ignore_errors=True)
+    
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'openai_rate_limits': rate_limits,
+            'args': vars(args)
+        },
+        'results': results,
+        'samples': samples,
+        'fake_openai': fake.stats() if fake is not None else None
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✓ Results written to {args.output}")
+    else:
+        print(json.dumps(report['results'], indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,255 @@
+"""
+Cold-start benchmark: how long a fresh worker process takes to import the app.
+
+Every run is a new interpreter, like a gunicorn worker booting, so nothing is
+shared between runs. A run reports:
+
+    import_ms            wall time of `import project`
+    process_ms           from spawning the interpreter until the import finished
+                         (what a new worker costs before it can accept requests)
+    first_request_ms     the first GET /api/stories_by_gender/girl through the test client,
+                         which pays for whatever the import deferred (story catalogue load)
+    ready_ms             process_ms + first_request_ms: until a new worker has served a request
+    modules              modules in sys.modules after the import
+    heavy_modules        optional heavy dependencies already imported after the import
+    peak_rss_mb          peak resident set size after the first request
+
+One more run under `python -X importtime` gives the import time of every
+top-level package (self time summed over its submodules); the slowest are listed.
+
+The runs share a temporary SQLite database that is initialised once beforehand
+(init_db(): tables, indexes and the initial stories), so no run pays for schema setup.
+The database is deleted afterwards unless --keep-work-dir is given.
+
+Usage:
+    python benchmarks/bench_import.py --output import.json
+    python benchmarks/bench_import.py --runs 10 --top 20
+    python benchmarks/bench_import.py --compare baseline.json import.json --threshold 0.10
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT_PREFIX = 'BENCH_RESULT '
+FIRST_REQUEST = '/api/stories_by_gender/girl'
+
+# Optional dependencies that a worker should only import when it first needs them
+HEAVY_MODULES = ['openai', 'authlib', 'cv2', 'numpy', 'reportlab.pdfgen.canvas', 'pypdf', 'better_profanity']
+
+
+def _rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def _environment(db_path):
+    env = dict(os.environ)
+    # The app needs an API key at import time; the benchmark never calls OpenAI
+    env.setdefault('OPENAI_API_KEY', 'benchmark')
+    env['DATABASE_URL'] = f'sqlite:///{db_path}'
+    env['JOB_SWEEP_INTERVAL_SECONDS'] = '0'
+    env['STORY_CATALOG_CHECK_SECONDS'] = '0'
+    return env
+
+
+def run_one(started):
+    """Import the app in this process and return the timings."""
+    sys.path.insert(0, REPO_ROOT)
+    import_started = time.perf_counter()
+    import project
+    import_ms = (time.perf_counter() - import_started) * 1000
+    process_ms = (time.time() - started) * 1000
+    modules = len(sys.modules)
+    heavy_modules = [name for name in HEAVY_MODULES if name in sys.modules]
+    
+    request_started = time.perf_counter()
+    response = project.app.test_client().get(FIRST_REQUEST)
+    first_request_ms = (time.perf_counter() - request_started) * 1000
+    if response.status_code != 200:
+        raise RuntimeError(f"{FIRST_REQUEST} returned {response.status_code}: {response.get_data(as_text=True)[:500]}")
+    
+    return {
+        'import_ms': round(import_ms, 1),
+        'process_ms': round(process_ms, 1),
+        'first_request_ms': round(first_request_ms, 1),
+        'ready_ms': round(process_ms + first_request_ms, 1),
+        'modules': modules,
+        'heavy_modules': heavy_modules,
+        'peak_rss_mb': _rss_mb()
+    }
+
+
+def run_isolated(env):
+    """Run one cold start in a fresh interpreter and return its result."""
+    command = [sys.executable, os.path.abspath(__file__), '--run-one', repr(time.time())]
+    completed = subprocess.run(command, cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    for line in reversed(completed.stdout.splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"Cold start failed (exit {completed.returncode}):\n{completed.stderr[-2000:]}")
+
+
+def import_profile(env, top):
+    """
+    Import the app under -X importtime.
+    
+    Returns:
+        list: [package, self_ms] for the top packages by import time, slowest first
+    """
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import project'],
+                               cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        raise RuntimeError(f"Import failed (exit {completed.returncode}):\n{completed.stderr[-2000:]}")
+    packages = {}
+    for line in completed.stderr.splitlines():
+        # "import time:  self [us] | cumulative | imported package"
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        fields = line[len('import time:'):].split('|')
+        try:
+            self_us = int(fields[0])
+        except ValueError:
+            continue
+        package = fields[2].strip().split('.')[0]
+        packages[package] = packages.get(package, 0) + self_us
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]
+    return [[package, round(self_us / 1000, 1)] for package, self_us in ranked]
+
+
+def summarise(runs):
+    """Median, min and max of each timing over the runs."""
+    summary = {}
+    for metric in ('import_ms', 'process_ms', 'first_request_ms', 'ready_ms'):
+        values = [run[metric] for run in runs]
+        summary[metric] = round(statistics.median(values), 1)
+        summary[f'{metric}_min'] = min(values)
+        summary[f'{metric}_max'] = max(values)
+    summary['modules'] = runs[-1]['modules']
+    summary['heavy_modules'] = runs[-1]['heavy_modules']
+    summary['peak_rss_mb'] = statistics.median(run['peak_rss_mb'] for run in runs) if runs[-1]['peak_rss_mb'] else None
+    return summary
+
+
+def compare_results(baseline, current, threshold):
+    """
+    Compare the cold start timings and peak RSS of two results files.
+    
+    Returns:
+        list: Regression descriptions (empty if nothing regressed by more than threshold)
+    """
+    regressions = []
+    print(f"{'metric':<18} {'baseline':>10} {'current':>10} {'change':>8}")
+    for metric in ('import_ms', 'process_ms', 'first_request_ms', 'ready_ms', 'peak_rss_mb'):
+        old, new = baseline['summary'].get(metric), current['summary'].get(metric)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        flag = ' ✗' if change > threshold else ''
+        print(f"{metric:<18} {old:>10} {new:>10} {change:>+8.1%}{flag}")
+        if change > threshold:
+            regressions.append(f"{metric}: {old} -> {new} ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start import benchmark for project.py")
+    parser.add_argument('--runs', type=int, default=5, help='Cold starts to time')
+    parser.add_argument('--top', type=int, default=15, help='Packages listed from the import time profile')
+    parser.add_argument('--keep-work-dir', action='store_true', help='Keep the temporary SQLite database')
+    parser.add_argument('--output', help='Write JSON results to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='Compare two results files')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Relative change counted as a regression')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.run_one:
+        print(RESULT_PREFIX + json.dumps(run_one(float(args.run_one))))
+        return
+    
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        regressions = compare_results(baseline, current, args.threshold)
+        if regressions:
+            print(f"\n✗ {len(regressions)} regression(s) above {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\n✓ No regressions above {args.threshold:.0%}")
+        return
+    
+    work_dir = tempfile.mkdtemp(prefix='bench_import_')
+    try:
+        env = _environment(os.path.join(work_dir, 'bench.db'))
+        setup = subprocess.run([sys.executable, '-c', 'import project; project.init_db()'],
+                               cwd=REPO_ROOT, env=env, capture_output=True, text=True)
+        if setup.returncode != 0:
+            raise RuntimeError(f"Database setup failed (exit {setup.returncode}):\n{setup.stderr[-2000:]}")
+        
+        runs = []
+        print(f"{'run':<5} {'import':>9} {'process':>9} {'1st req':>9} {'modules':>8} {'peak RSS':>9}")
+        for number in range(1, args.runs + 1):
+            result = run_isolated(env)
+            runs.append(result)
+            print(f"{number:<5} {result['import_ms']:>7}ms {result['process_ms']:>7}ms {result['first_request_ms']:>7}ms "
+                  f"{result['modules']:>8} {result['peak_rss_mb']:>7}MB")
+        summary = summarise(runs)
+        print(f"\nmedian import {summary['import_ms']}ms, process {summary['process_ms']}ms, "
+              f"first request {summary['first_request_ms']}ms, ready {summary['ready_ms']}ms")
+        print(f"heavy modules imported at startup: {', '.join(summary['heavy_modules']) or 'none'}")
+        
+        profile = import_profile(env, args.top)
+        print(f"\n{'package':<28} {'import ms':>10}")
+        for package, self_ms in profile:
+            print(f"{package:<28} {self_ms:>10}")
+    finally:
+        if args.keep_work_dir:
+            print(f"\nWork directory kept: {work_dir}")
+        else:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': {k: v for k, v in vars(args).items() if k != 'run_one'}
+        },
+        'summary': summary,
+        'runs': runs,
+        'import_profile': profile
+    }
+    try:
+        report['meta']['commit'] = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                                           stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        report['meta']['commit'] = None
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✓ Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,355 @@
+"""
+Micro-benchmarks for the CPU-bound image and PDF primitives.
+
+Each benchmark runs in its own subprocess, so peak RSS is per benchmark and one
+benchmark's caches or memory growth cannot affect the next. A benchmark is
+warmed up, then timed for --repeat rounds of at least --min-time seconds each.
+Files it writes go in a temporary directory that is deleted when it finishes,
+unless --keep-work-dir is given. It reports:
+
+    ops_per_sec          median over the rounds (min / max are reported too)
+    peak_rss_mb          peak resident set size of the benchmark process
+    children_rss_mb      peak RSS of its child processes (compositing workers)
+    traced_peak_mb       peak Python / NumPy heap during one operation (tracemalloc;
+                         PIL pixel buffers are allocated outside it)
+    allocations          memory blocks allocated by one operation and still alive when it returns
+
+Benchmarks (inputs are the bundled LittleRedRidingHoodImages):
+
+    load_story_image         decode a template page (cycling through the 13 pages)
+    replace_face_cascade     replace_face_in_image with live Haar cascade detection on the page
+    replace_face_indexed     replace_face_in_image with the precomputed template face (production path)
+    simple_face_blend        _simple_face_blend fallback
+    replace_text_in_image    character name overlay
+    process_story_image      full page: compositing engine round trip and PNG write
+    create_storybook_pdf     13-page PDF in one pass (--pdf-profile)
+
+Usage:
+    python benchmarks/bench_primitives.py --output primitives.json
+    python benchmarks/bench_primitives.py --only replace_face_cascade,simple_face_blend --repeat 7
+    python benchmarks/bench_primitives.py --compare baseline.json primitives.json --threshold 0.10
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+STORY_ID = 'red'
+PAGES = list(range(1, 14))
+# Page whose template has a detectable face, and the face box the user photo is cut from
+FACE_PAGE = 3
+CHARACTER_NAME = 'Alexandra'
+RESULT_PREFIX = 'BENCH_RESULT '
+
+
+def _rss_mb(who):
+    if resource is None:
+        return None
+    peak = resource.getrusage(who).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+    return round(peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+def _user_photo(work_dir):
+    """
+    A user photo with a face the cascade detects: the face from a template page,
+    cut out with a margin and scaled up like a phone photo.
+    """
+    from PIL import Image
+    from image_processing import find_story_image_path
+    from face_index import get_template_face
+    
+    path = find_story_image_path(STORY_ID, FACE_PAGE)
+    with Image.open(path) as page:
+        page = page.convert('RGB')
+    template_face = get_template_face(path)
+    if template_face is not None:
+        x, y, w, h = template_face.rect
+    else:
+        x, y, w, h = page.width // 3, page.height // 3, page.width // 3, page.height // 3
+    margin = w // 2
+    box = (max(0, x - margin), max(0, y - margin), min(page.width, x + w + margin), min(page.height, y + h + margin))
+    photo = page.crop(box).resize((900, 900), Image.Resampling.LANCZOS)
+    photo_path = os.path.join(work_dir, 'user_photo.jpg')
+    photo.save(photo_path, 'JPEG', quality=90)
+    return photo_path
+
+
+def setup_load_story_image(args, work_dir):
+    from image_processing import load_story_image
+    pages = iter(PAGES * 1000000)
+    return lambda: load_story_image(STORY_ID, next(pages))
+
+
+def _face_inputs(work_dir):
+    from image_processing import BookSubject, find_story_image_path, load_story_image
+    from face_index import get_template_face
+    subject = BookSubject.from_path(_user_photo(work_dir))
+    if subject.face is None:
+        print("⚠️  Warning: No face detected in the benchmark photo; face replacement falls back to simple blending")
+    story_image = load_story_image(STORY_ID, FACE_PAGE)
+    template_face = get_template_face(find_story_image_path(STORY_ID, FACE_PAGE))
+    return subject, story_image, template_face
+
+
+def setup_replace_face_cascade(args, work_dir):
+    from image_processing import replace_face_in_image
+    subject, story_image, _ = _face_inputs(work_dir)
+    return lambda: replace_face_in_image(story_image, subject.image, CHARACTER_NAME, None, subject)
+
+
+def setup_replace_face_indexed(args, work_dir):
+    from image_processing import replace_face_in_image
+    subject, story_image, template_face = _face_inputs(work_dir)
+    if template_face is None:
+        print("⚠️  Warning: Template page has no face index entry; this measures live detection")
+    return lambda: replace_face_in_image(story_image, subject.image, CHARACTER_NAME, template_face, subject)
+
+
+def setup_simple_face_blend(args, work_dir):
+    from image_processing import _simple_face_blend
+    subject, story_image, _ = _face_inputs(work_dir)
+    return lambda: _simple_face_blend(story_image, subject.image)
+
+
+def setup_replace_text_in_image(args, work_dir):
+    from image_processing import STORY_TEXT_PATTERNS, load_story_image, replace_text_in_image
+    story_image = load_story_image(STORY_ID, FACE_PAGE)
+    return lambda: replace_text_in_image(story_image, STORY_TEXT_PATTERNS, CHARACTER_NAME, CHARACTER_NAME)
+
+
+def _import_project():
+    # The app needs an API key at import time; benchmarks never call OpenAI
+    os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+    os.environ.setdefault('JOB_SWEEP_INTERVAL_SECONDS', '0')
+    import project
+    return project
+
+
+def setup_process_story_image(args, work_dir):
+    project = _import_project()
+    subject = project.prepare_book_subject(_user_photo(work_dir), work_dir)
+    pages = iter(PAGES * 1000000)
+    output_path = os.path.join(work_dir, 'page.png')
+    # Start the worker processes before timing
+    project.process_story_image(STORY_ID, 1, subject.path, CHARACTER_NAME, output_path, subject)
+    return lambda: project.process_story_image(STORY_ID, next(pages), subject.path, CHARACTER_NAME, output_path, subject)
+
+
+def setup_create_storybook_pdf(args, work_dir):
+    project = _import_project()
+    from image_processing import find_story_image_path
+    image_paths = [find_story_image_path(STORY_ID, page) for page in PAGES]
+    text_data_list = [None] + [
+        {'narrative': [f"{CHARACTER_NAME} walked through the forest.", "The birds sang all around."]}
+        for _ in PAGES[1:]
+    ]
+    output_path = os.path.join(work_dir, 'book.pdf')
+    return lambda: project.create_storybook_pdf(image_paths, text_data_list, output_path,
+                                                'Little Red Riding Hood', CHARACTER_NAME, profile=args.pdf_profile)
+
+
+BENCHMARKS = {
+    'load_story_image': setup_load_story_image,
+    'replace_face_cascade': setup_replace_face_cascade,
+    'replace_face_indexed': setup_replace_face_indexed,
+    'simple_face_blend': setup_simple_face_blend,
+    'replace_text_in_image': setup_replace_text_in_image,
+    'process_story_image': setup_process_story_image,
+    'create_storybook_pdf': setup_create_storybook_pdf,
+}
+
+
+def run_one(name, args):
+    """Run one benchmark in this process and return its result."""
+    work_dir = tempfile.mkdtemp(prefix=f'bench_{name}_')
+    try:
+        result = _measure(name, args, work_dir)
+    finally:
+        if not args.keep_work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    if args.keep_work_dir:
+        result['work_dir'] = work_dir
+    return result
+
+
+def _measure(name, args, work_dir):
+    op = BENCHMARKS[name](args, work_dir)
+    setup_rss = _rss_mb(resource.RUSAGE_SELF) if resource else None
+    
+    for _ in range(args.warmup):
+        op()
+    
+    # One traced operation for the allocation figures (tracing slows it down, so it is not timed)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    result = op()
+    traced_peak = tracemalloc.get_traced_memory()[1]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    allocations = sum(stat.count_diff for stat in after.compare_to(before, 'filename') if stat.count_diff > 0)
+    del result
+    
+    rounds = []
+    for _ in range(args.repeat):
+        ops = 0
+        started = time.perf_counter()
+        while True:
+            op()
+            ops += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= args.min_time:
+                break
+        rounds.append(ops / elapsed)
+    
+    peak_rss = _rss_mb(resource.RUSAGE_SELF) if resource else None
+    # Compositing workers only count towards RUSAGE_CHILDREN once they have been reaped
+    if 'project' in sys.modules:
+        sys.modules['project'].compositing_engine.shutdown()
+    
+    return {
+        'name': name,
+        'ops_per_sec': round(statistics.median(rounds), 3),
+        'ops_per_sec_min': round(min(rounds), 3),
+        'ops_per_sec_max': round(max(rounds), 3),
+        'ms_per_op': round(1000.0 / statistics.median(rounds), 3),
+        'rounds': args.repeat,
+        'setup_rss_mb': setup_rss,
+        'peak_rss_mb': peak_rss,
+        'children_rss_mb': _rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+        'traced_peak_mb': round(traced_peak / (1024 * 1024), 2),
+        'allocations': allocations
+    }
+
+
+def run_isolated(name, args):
+    """Run one benchmark in a fresh interpreter and return its result."""
+    command = [sys.executable, os.path.abspath(__file__), '--run-one', name,
+               '--repeat', str(args.repeat), '--min-time', str(args.min_time),
+               '--warmup', str(args.warmup), '--pdf-profile', args.pdf_profile]
+    if args.keep_work_dir:
+        command.append('--keep-work-dir')
+    completed = subprocess.run(command, cwd=REPO_ROOT, capture_output=True, text=True)
+    for line in reversed(completed.stdout.splitlines()):
+        if line.startswith(RESULT_PREFIX):
+            return json.loads(line[len(RESULT_PREFIX):])
+    raise RuntimeError(f"Benchmark {name} failed (exit {completed.returncode}):\n{completed.stderr[-2000:]}")
+
+
+def compare_results(baseline, current, threshold):
+    """
+    Compare ops/sec and peak RSS of two results files.
+    
+    Returns:
+        list: Regression descriptions (empty if nothing regressed by more than threshold)
+    """
+    base = {r['name']: r for r in baseline['results']}
+    regressions = []
+    print(f"{'benchmark':<24} {'metric':<12} {'baseline':>10} {'current':>10} {'change':>8}")
+    for entry in current['results']:
+        old_entry = base.get(entry['name'])
+        if old_entry is None:
+            continue
+        for metric, higher_is_better in (('ops_per_sec', True), ('peak_rss_mb', False)):
+            old, new = old_entry.get(metric), entry.get(metric)
+            if not old or new is None:
+                continue
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            flag = ' ✗' if worse > threshold else ''
+            print(f"{entry['name']:<24} {metric:<12} {old:>10} {new:>10} {change:>+8.1%}{flag}")
+            if worse > threshold:
+                regressions.append(f"{entry['name']} {metric}: {old} -> {new} ({change:+.1%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks for image and PDF primitives")
+    parser.add_argument('--only', help='Comma-separated benchmarks to run (default: all)')
+    parser.add_argument('--repeat', type=int, default=5, help='Timed rounds per benchmark')
+    parser.add_argument('--min-time', type=float, default=1.0, help='Minimum seconds per round')
+    parser.add_argument('--warmup', type=int, default=1, help='Untimed operations before measuring')
+    parser.add_argument('--pdf-profile', default='screen', help='PDF profile for create_storybook_pdf')
+    parser.add_argument('--keep-work-dir', action='store_true',
+                        help="Keep each benchmark's generated photo, page and PDF instead of deleting them")
+    parser.add_argument('--output', help='Write JSON results to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CURRENT'), help='Compare two results files')
+    parser.add_argument('--threshold', type=float, default=0.10, help='Relative change counted as a regression')
+    parser.add_argument('--run-one', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    
+    if args.run_one:
+        print(RESULT_PREFIX + json.dumps(run_one(args.run_one, args)))
+        return
+    
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        regressions = compare_results(baseline, current, args.threshold)
+        if regressions:
+            print(f"\n✗ {len(regressions)} regression(s) above {args.threshold:.0%}:")
+            for line in regressions:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"\n✓ No regressions above {args.threshold:.0%}")
+        return
+    
+    names = [n.strip() for n in args.only.split(',')] if args.only else list(BENCHMARKS)
+    unknown = [n for n in names if n not in BENCHMARKS]
+    if unknown:
+        parser.error(f"Unknown benchmark(s): {', '.join(unknown)} (choose from {', '.join(BENCHMARKS)})")
+    
+    results = []
+    print(f"{'benchmark':<24} {'ops/sec':>9} {'ms/op':>9} {'peak RSS':>9} {'traced':>8} {'allocs':>8}")
+    for name in names:
+        result = run_isolated(name, args)
+        work_dir = result.pop('work_dir', None)
+        results.append(result)
+        print(f"{name:<24} {result['ops_per_sec']:>9} {result['ms_per_op']:>9} "
+              f"{result['peak_rss_mb']:>7}MB {result['traced_peak_mb']:>6}MB {result['allocations']:>8}")
+        if work_dir:
+            print(f"  work directory kept: {work_dir}")
+    
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': {k: v for k, v in vars(args).items() if k != 'run_one'}
+        },
+        'results': results
+    }
+    try:
+        report['meta']['commit'] = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                                           stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        report['meta']['commit'] = None
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\n✓ Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+"""
+Benchmark of DALL-E page prompt assembly per book.
+
+Compares the two ways the 12 story page prompts of a DALL-E book are assembled:
+
+    legacy     the previous per-page f-string: character and style rules, consistency
+               notes and RAG text rebuilt for every page, then truncate_prompt_for_dalle
+    template   DALLE_PAGE_PROMPT (prompt_builder.py): per-book sections bound once, then
+               one render per page with the length budget applied while composing
+
+Scenarios:
+
+    typical       story prompts and model descriptions of the usual length (without the
+                  RAG context, which legacy built but never sent, both approaches must
+                  produce identical prompts; checked before timing)
+    over_budget   page prompts long enough that every page exceeds the 4000 character
+                  limit, so legacy pays for truncate_prompt_for_dalle
+
+Each scenario is timed for --repeat rounds of at least --min-time seconds; the
+median microseconds per book (bind + 12 pages) are reported.
+
+Usage:
+    python benchmarks/bench_prompt_assembly.py
+    python benchmarks/bench_prompt_assembly.py --repeat 7 --output prompt_assembly.json
+"""
+
+import argparse
+import contextlib
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+STORY_ID = 'jack'
+
+# Stand-ins for the vision model output that fills the per-page slots
+CHILD_APPEARANCE = ("A young child of about six years old with light brown skin, dark brown curly hair cut to "
+                    "chin length, large round brown eyes, a small button nose, full cheeks and a wide gap-toothed "
+                    "smile. Slim build. Wearing a yellow t-shirt with a small star print. ") * 2
+MASTER_REFERENCE = ("Face: round with soft jawline, full cheeks, small rounded chin. Eyes: large, round, warm dark "
+                    "brown, slightly upturned outer corners. Nose: small button nose. Hair: dark brown tight curls, "
+                    "chin length, side part on the left. Skin: warm light brown. Clothing: green tunic with brown "
+                    "belt, brown trousers, leather boots. Art style: soft watercolor with visible paper texture. ") * 2
+STYLE_DESCRIPTION = ("Soft watercolor with gentle gradients, warm golden lighting, muted greens and browns, "
+                     "loose brushwork at the edges and fine ink outlines on the characters. ") * 2
+FACE_DESCRIPTION = ("Same round face and full cheeks, dark brown curls to the chin, large brown eyes, button nose, "
+                    "light brown skin, cheerful open-mouthed smile, slightly three-quarter view. ") * 2
+RAG_CONSISTENCY = ("Character (match exactly): dark brown curls, round face, brown eyes, green tunic. "
+                   "Objects (match exactly): colorful glowing magic beans in a small cloth pouch")
+LONG_SCENE = (" The scene is full of detail: tall grass swaying in the wind, a crooked wooden fence, chickens "
+              "pecking at the ground, a thatched cottage with smoke curling from the chimney, and rolling hills "
+              "fading into a misty morning sky.") * 14
+
+
+def _import_project():
+    # The app needs an API key at import time; the benchmark never calls OpenAI
+    os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+    os.environ.setdefault('JOB_SWEEP_INTERVAL_SECONDS', '0')
+    import project
+    return project
+
+
+def _book_inputs(project, scenario):
+    """The per-book values the generation loop has when it builds page prompts."""
+    prompts = project.get_all_prompts_for_story(STORY_ID, 'boy')[1:]
+    if scenario == 'over_budget':
+        prompts = [dict(prompt_info, prompt=prompt_info['prompt'] + LONG_SCENE) for prompt_info in prompts]
+    return {
+        'story_choice': STORY_ID,
+        'prompts': prompts,
+        'story_objects': {
+            'magic_beans': 'colorful, glowing magic beans',
+            'treasure': 'golden egg or bag of gold coins',
+            'beanstalk': 'enormous, magical green beanstalk'
+        },
+        'outfit_consistency_lock': "SAME clothing, SAME magic beans and treasure items",
+        'outfit_rules': "- Same clothing style every page.\n- Same magic beans appearance every page.\n- Same treasure items (golden egg/coins) appearance every page.",
+        'child_appearance': CHILD_APPEARANCE,
+        'master_reference': MASTER_REFERENCE,
+        'style_description': STYLE_DESCRIPTION,
+        'face_description': FACE_DESCRIPTION,
+        'rag_consistency_info': RAG_CONSISTENCY
+    }
+
+
+def _base_prompt(prompt_info):
+    base_prompt = prompt_info['prompt']
+    if 'watercolor' not in base_prompt.lower() and 'painterly' not in base_prompt.lower():
+        base_prompt = f"Create a children's book illustration page in a watercolor/painterly style with a soft, artistic feel that is gentle and emotional. {base_prompt}"
+    return base_prompt
+
+
+def _previous_page(page_index, book):
+    if page_index == 1:
+        return ""
+    return f"\nPREVIOUS PAGE REFERENCE: Also match the style and facial identity from the previous page. {book['face_description'][:200]}"
+
+
+def _rag_context(page_index, book):
+    if page_index == 1:
+        return ""
+    return f"\n\nRAG-RETRIEVED CONSISTENCY (from previous pages):\n{book['rag_consistency_info'][:300]}"
+
+
+def legacy_character_rules(child_appearance, story_choice, is_cover=False):
+    """The per-page character rules legacy built (the former project.generate_character_consistency_rules)."""
+    # Truncate child appearance to fit within prompt limits
+    child_appearance_short = child_appearance[:250] if len(child_appearance) > 250 else child_appearance
+    
+    if story_choice == 'red':
+        rules = f"""CORE CHARACTER CONSISTENCY RULES - MANDATORY:
+- The child character MUST look EXACTLY like the reference photo in every single image
+- Based on photo: {child_appearance_short}
+- ALWAYS maintain: same age, ethnicity, hair color & hairstyle, face shape, skin tone, eye color & shape
+- The child must ALWAYS look like the same real child across all pages - NO variations
+
+LITTLE RED RIDING HOOD SPECIFIC:
+- Red cloak/cape: Keep the EXACT same shade of red, style, length, and details in every page
+- Basket: Must contain the EXACT same items (bread, cakes, wine bottle) with same appearance
+- The child's face must be identical to the photo in every illustration"""
+
+    elif story_choice == 'jack':
+        rules = f"""CORE CHARACTER CONSISTENCY RULES - MANDATORY:
+- The child character MUST look EXACTLY like the reference photo in every single image
+- Based on photo: {child_appearance_short}
+- ALWAYS maintain: same age, ethnicity, hair color & hairstyle, face shape, skin tone, eye color & shape
+- The child must ALWAYS look like the same real child across all pages - NO variations
+
+JACK AND THE BEANSTALK SPECIFIC:
+- Magic beans: Keep EXACT same color, size, and glow effect when shown
+- Treasure: Maintain EXACT same appearance (golden egg or coins) with same details
+- Beanstalk: Keep EXACT same green shade, leaf size, and sparkle details
+- The child's face must be identical to the photo in every illustration"""
+
+    else:
+        rules = f"""CORE CHARACTER CONSISTENCY RULES - MANDATORY:
+- The child character MUST look EXACTLY like the reference photo in every single image
+- Based on photo: {child_appearance_short}
+- ALWAYS maintain: same age, ethnicity, hair color & hairstyle, face shape, skin tone, eye color & shape
+- The child must ALWAYS look like the same real child across all pages - NO variations"""
+
+    return rules
+
+
+def legacy_style_rules(is_cover=False, style_description=None):
+    """The per-page style rules legacy built (the former project.generate_style_consistency_rules)."""
+    if is_cover:
+        return """STYLE RULES - APPLY TO ALL PAGES:
+- Soft illustrated children's book style
+- Warm lighting, gentle colors, magical fairy-tale tone
+- Watercolor/painterly technique with soft brushstrokes
+- No anime style, no hyper-realism, no style changes between pages
+- Consistent art style for the entire book - gentle, emotional, dreamy atmosphere"""
+    else:
+        if style_description:
+            style_short = style_description[:200] if len(style_description) > 200 else style_description
+            return f"""STYLE RULES - MATCH COVER EXACTLY:
+- Use the EXACT same style as the cover page: {style_short}
+- Same color palette, brushwork, lighting, edge quality, and aesthetic
+- No style changes - must be visually identical to cover page"""
+        else:
+            return """STYLE RULES:
+- Soft illustrated children's book style
+- Warm lighting, gentle colors, magical fairy-tale tone
+- Consistent art style - gentle, emotional, dreamy atmosphere"""
+
+
+def legacy_page_prompt(project, page_index, prompt_info, book):
+    """The per-page assembly the generation loop used before DALLE_PAGE_PROMPT."""
+    story_choice = book['story_choice']
+    story_objects = book['story_objects']
+    outfit_consistency_lock = book['outfit_consistency_lock']
+    outfit_rules = book['outfit_rules']
+    master_reference_description = book['master_reference']
+    rag_consistency_info = book['rag_consistency_info'] if page_index > 1 else ""
+    
+    consistency_notes = []
+    if story_choice == 'red':
+        if 'basket' in prompt_info['prompt'].lower():
+            consistency_notes.append(f"The basket must contain: {', '.join(story_objects['basket_contents'])}. This is consistent across all pages.")
+        if 'red' in prompt_info['prompt'].lower() or 'cape' in prompt_info['prompt'].lower():
+            consistency_notes.append(f"The child wears a {story_objects['red_cape']} in every scene where they appear.")
+    elif story_choice == 'jack':
+        if 'beanstalk' in prompt_info['prompt'].lower():
+            consistency_notes.append(f"The beanstalk is an {story_objects['beanstalk']} with giant green leaves and magical sparkles.")
+        if 'treasure' in prompt_info['prompt'].lower() or 'gold' in prompt_info['prompt'].lower():
+            consistency_notes.append(f"The treasure is a {story_objects['treasure']} - maintain this exact appearance.")
+        if 'beans' in prompt_info['prompt'].lower():
+            consistency_notes.append(f"The magic beans are {story_objects['magic_beans']} - keep them consistent.")
+    consistency_text = " ".join(consistency_notes)
+    if rag_consistency_info:
+        consistency_text = f"{consistency_text} {rag_consistency_info}" if consistency_text else rag_consistency_info
+    
+    base_prompt = _base_prompt(prompt_info)
+    
+    character_rules = legacy_character_rules(book['child_appearance'], story_choice, is_cover=False)
+    if master_reference_description:
+        master_ref_short = master_reference_description[:400] if len(master_reference_description) > 400 else master_reference_description
+        character_rules += f"\n\n{'='*80}\nMASTER REFERENCE CHARACTER DETAILS (MUST MATCH EXACTLY):\n{master_ref_short}\n{'='*80}"
+    style_rules = legacy_style_rules(is_cover=False, style_description=book['style_description'])
+    rag_consistency_text = ""
+    if rag_consistency_info:
+        rag_consistency_text = f"\n\nRAG-RETRIEVED CONSISTENCY (from previous pages):\n{rag_consistency_info[:300]}" if len(rag_consistency_info) > 300 else f"\n\nRAG-RETRIEVED CONSISTENCY (from previous pages):\n{rag_consistency_info}"
+    story_consistency_text = consistency_text[:150] if consistency_text and len(consistency_text) > 150 else (consistency_text if consistency_text else "")
+    
+    previous_page_continuity = _previous_page(page_index, book)
+    
+    enhanced_prompt = f"""{base_prompt}
+
+================================================================================
+CONSISTENCY LOCK - MANDATORY FOR ALL PAGES AFTER THE FIRST:
+================================================================================
+
+Use the FIRST illustration as the face reference. Also match the style and facial identity from the previous page. Match the reference child's face EXACTLY — identical facial features, proportions, eyes, nose, mouth, cheeks, skin tone, hair color and length, and age. Do NOT alter, stylize, or reinterpret the child's face or age. SAME hairstyle, {outfit_consistency_lock}, SAME art style, SAME brush texture, SAME lighting and color palette. If the face does not match, regenerate.
+
+================================================================================
+MASTER REFERENCE (FIRST ILLUSTRATION) CHARACTER DETAILS:
+================================================================================
+
+{master_reference_description[:400] if master_reference_description else "Match the FIRST generated illustration character exactly."}
+{previous_page_continuity}
+
+================================================================================
+OUTFIT & STYLE RULES:
+================================================================================
+
+{outfit_rules}
+- Soft watercolor storybook style.
+- No realism, no anime, no style changes.
+- SAME illustration style, SAME brush style, SAME lighting, SAME fairy-tale tone as the first image.
+
+================================================================================
+CHARACTER RULES:
+================================================================================
+
+{f"- Wolf is always a wolf (not human)." if story_choice == 'red' else ""}
+- Hunter is always a human adult male (not a wolf or animal).
+- No animal-human hybrids.
+
+================================================================================
+QUALITY CHECK:
+================================================================================
+
+If the child does not match the reference identity or the style changes:
+- Prioritize facial identity match before style variation
+- Regenerate up to 3 times if needed
+- The child MUST look EXACTLY like the FIRST illustration in EVERY image.
+================================================================================"""
+    # generate_image_with_dalle truncated every prompt before sending it
+    return project.truncate_prompt_for_dalle(enhanced_prompt, max_length=4000)
+
+
+def legacy_book(project, book):
+    return [legacy_page_prompt(project, index, prompt_info, book)
+            for index, prompt_info in enumerate(book['prompts'], start=1)]
+
+
+def template_book(project, book, with_rag=True):
+    page_prompt_template = project.DALLE_PAGE_PROMPT.bind(
+        outfit_consistency_lock=book['outfit_consistency_lock'],
+        outfit_rules=book['outfit_rules'],
+        wolf_rule="- Wolf is always a wolf (not human)." if book['story_choice'] == 'red' else ""
+    )
+    return [page_prompt_template.render(page_prompt=_base_prompt(prompt_info),
+                                        master_reference=book['master_reference'],
+                                        previous_page=_previous_page(index, book),
+                                        rag_context=_rag_context(index, book) if with_rag else "")
+            for index, prompt_info in enumerate(book['prompts'], start=1)]
+
+
+def time_book(fn, repeat, min_time):
+    """
+    Time fn() for repeat rounds of at least min_time seconds.
+    
+    Returns:
+        list: Microseconds per call for each round
+    """
+    rounds = []
+    for _ in range(repeat):
+        calls = 0
+        started = time.perf_counter()
+        while True:
+            fn()
+            calls += 1
+            elapsed = time.perf_counter() - started
+            if elapsed >= min_time:
+                break
+        rounds.append(elapsed / calls * 1e6)
+    return rounds
+
+
+def run_scenario(project, scenario, args):
+    book = _book_inputs(project, scenario)
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        legacy_prompts = legacy_book(project, book)
+    template_prompts = template_book(project, book)
+    if scenario == 'typical' and legacy_prompts != template_book(project, book, with_rag=False):
+        raise AssertionError("Template prompts differ from the legacy prompts")
+    over_limit = [len(p) for p in template_prompts if len(p) > project.DALLE_PROMPT_MAX_LENGTH]
+    if over_limit:
+        raise AssertionError(f"Template prompts over the limit: {over_limit}")
+    
+    result = {'scenario': scenario, 'pages': len(book['prompts'])}
+    for name, fn in (('legacy', legacy_book), ('template', template_book)):
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            fn(project, book)  # warm up
+            rounds = time_book(lambda: fn(project, book), args.repeat, args.min_time)
+        prompts = legacy_prompts if name == 'legacy' else template_prompts
+        result[name] = {
+            'us_per_book': round(statistics.median(rounds), 1),
+            'us_per_book_min': round(min(rounds), 1),
+            'us_per_book_max': round(max(rounds), 1),
+            'mean_prompt_chars': round(statistics.mean(len(p) for p in prompts))
+        }
+    result['speedup'] = round(result['legacy']['us_per_book'] / result['template']['us_per_book'], 2)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark DALL-E page prompt assembly per book")
+    parser.add_argument('--repeat', type=int, default=5, help='Timed rounds per measurement')
+    parser.add_argument('--min-time', type=float, default=0.5, help='Minimum seconds per round')
+    parser.add_argument('--output', help='Write JSON results to this file')
+    args = parser.parse_args()
+    
+    project = _import_project()
+    
+    results = []
+    print(f"\n{'scenario':<12} {'legacy us/book':>15} {'template us/book':>17} {'speedup':>8} {'prompt chars':>13}")
+    for scenario in ('typical', 'over_budget'):
+        result = run_scenario(project, scenario, args)
+        results.append(result)
+        print(f"{scenario:<12} {result['legacy']['us_per_book']:>15} {result['template']['us_per_book']:>17} "
+              f"{result['speedup']:>7}x {result['template']['mean_prompt_chars']:>13}")
+    print("\n✓ Typical prompts (without the RAG context) are identical to the legacy assembly")
+    
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'args': vars(args)
+        },
+        'results': results
+    }
+    try:
+        report['meta']['commit'] = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT,
+                                                           stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        report['meta']['commit'] = None
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✓ Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,204 @@
+"""
+Process-pool compositing engine for the pre-illustrated story path.
+
+Blending the child's face into the story templates and encoding the pages is
+CPU-bound OpenCV/PIL work. Run inside the web process it blocks the eventlet hub
+(and every other request on the worker) for the length of each page, and threads
+are serialised by the GIL. The engine runs page jobs in a pool of separate
+processes instead and hands back the encoded page bytes, so books render on all
+cores while the hub stays free to serve requests.
+
+A page job is a small dict, so submitting it never blocks the hub on a large pipe
+write:
+
+    {
+        'story_id': 'red',
+        'page_number': 3,
+        'subject_path': '/tmp/storybook_abc/subject.png',   # written by BookSubject.save()
+        'character_name': 'Maya'
+    }
+
+Each worker keeps the last few decoded subjects in memory, so the child's photo is
+decoded and face-detected once per worker per book.
+
+Other CPU-bound per-page work can run on the same workers by passing a different
+module-level task function, e.g. re-encoding page images for the PDF:
+
+    engine.submit(profile.job(path), task=pdf_profiles.encode_pdf_image)
+
+Worker processes are started with the 'spawn' method: forking a process that has
+been monkey-patched by eventlet and is running threads is not safe. A spawned
+worker imports the parent's main module again, so that module must not start its
+background services there (project.py checks multiprocessing.parent_process());
+each worker warns at startup if it finds threads besides its main thread.
+
+Usage:
+    engine = CompositingEngine(max_workers=4)
+    future = engine.submit(job)
+    result = future.result()   # {'png': bytes, 'cpu_seconds': float, 'pid': int}
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from image_processing import BookSubject, compose_story_page, encode_png
+
+# Decoded subjects held by each worker process, keyed by subject path
+_worker_subjects = {}
+_WORKER_SUBJECT_CACHE_SIZE = 4
+
+
+def _check_worker_threads():
+    """Warn if a new worker process is already running background threads (pool initializer)."""
+    # By ident: under eventlet's monkey-patching the main thread can appear as two Thread objects
+    main = {threading.main_thread().ident, threading.get_ident()}
+    threads = [thread.name for thread in threading.enumerate() if thread.ident not in main]
+    if threads:
+        print(f"⚠️  Warning: Compositing worker {os.getpid()} started with background threads: {', '.join(threads)}")
+
+
+def _load_subject(path):
+    subject = _worker_subjects.get(path)
+    if subject is None:
+        if len(_worker_subjects) >= _WORKER_SUBJECT_CACHE_SIZE:
+            # Dicts keep insertion order, so the first key is the oldest subject
+            _worker_subjects.pop(next(iter(_worker_subjects)))
+        subject = BookSubject.load(path)
+        _worker_subjects[path] = subject
+    return subject
+
+
+def render_page(job):
+    """
+    Composite and encode one story page (runs in a worker process).
+    
+    Args:
+        job: Page job dict (story_id, page_number, subject_path, character_name)
+    
+    Returns:
+        dict: {'png': encoded page bytes, 'cpu_seconds': CPU time spent, 'pid': worker process ID}
+    """
+    cpu_start = time.thread_time()
+    subject = _load_subject(job['subject_path'])
+    image = compose_story_page(job['story_id'], job['page_number'], subject, job['character_name'])
+    if image is None:
+        raise FileNotFoundError(f"Story image not found for story {job['story_id']}, page {job['page_number']}")
+    png = encode_png(image)
+    return {
+        'png': png,
+        'cpu_seconds': time.thread_time() - cpu_start,
+        'pid': os.getpid()
+    }
+
+
+class CompositingEngine:
+    """
+    Runs page jobs on a lazily started process pool.
+    
+    With max_workers=0 (or if the pool cannot be started) jobs run inline in the
+    calling thread, which is what the app did before the engine existed.
+    """
+    
+    def __init__(self, max_workers=None):
+        """
+        Args:
+            max_workers: Number of worker processes (defaults to the CPU count; 0 runs jobs inline)
+        """
+        self.max_workers = (os.cpu_count() or 1) if max_workers is None else max(0, int(max_workers))
+        self._executor = None
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.in_flight = 0
+    
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None and self.max_workers > 0:
+                try:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.max_workers,
+                        mp_context=multiprocessing.get_context('spawn'),
+                        initializer=_check_worker_threads
+                    )
+                    print(f"✓ Compositing engine started with {self.max_workers} worker processes")
+                except Exception as e:
+                    print(f"⚠️  Warning: Could not start compositing workers ({str(e)}); compositing inline")
+                    self.max_workers = 0
+            return self._executor
+    
+    def _reset_executor(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False)
+    
+    def submit(self, job, task=render_page):
+        """
+        Submit a page job.
+        
+        Args:
+            job: Job dict passed to the task
+            task: Module-level function run on the job (render_page by default)
+        
+        Returns:
+            concurrent.futures.Future resolving to the task's result
+        """
+        with self._lock:
+            self.submitted += 1
+            self.in_flight += 1
+        try:
+            future = self._submit(job, task)
+        except BaseException:
+            self._job_done(None)
+            raise
+        future.add_done_callback(self._job_done)
+        return future
+    
+    def _submit(self, job, task):
+        executor = self._get_executor()
+        if executor is not None:
+            try:
+                return executor.submit(task, job)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); start a fresh pool once
+                print("⚠️  Warning: Compositing pool broken, restarting workers")
+                self._reset_executor(executor)
+                executor = self._get_executor()
+                if executor is not None:
+                    return executor.submit(task, job)
+        
+        future = Future()
+        try:
+            future.set_result(task(job))
+        except Exception as e:
+            future.set_exception(e)
+        return future
+    
+    def _job_done(self, future):
+        with self._lock:
+            self.in_flight -= 1
+    
+    def stats(self):
+        """
+        Return pool counters for monitoring.
+        
+        Returns:
+            dict: workers (0 when compositing inline), submitted jobs and jobs in_flight (queued or running)
+        """
+        with self._lock:
+            return {'workers': self.max_workers, 'submitted': self.submitted, 'in_flight': self.in_flight}
+    
+    def shutdown(self):
+        """
+        Stop the worker processes, cancelling jobs that have not started.
+        
+        Waits for the pool's manager thread to exit: under eventlet, leaving it
+        running at interpreter exit hangs the process.
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,273 @@
+"""
+Embeddings for the RAG consistency context: a persistent store for static texts
+and request batching for dynamic ones.
+
+The RAG query for a page is built from the page's description and prompt, which
+are the same for every book of a story. Those texts are embedded once, by
+precompute(), and kept on disk as a float16 (or float32) matrix that is
+memory-mapped on first use, so looking up a query vector is a dictionary lookup
+and a row read instead of a network round trip:
+
+    <store_dir>/<model>.npy    rows x dimensions matrix
+    <store_dir>/<model>.json   {"dimensions", "dtype", "keys": [sha256 of each row's text]}
+
+Texts that are not in the store (the consistency information extracted from a
+generated page) are embedded through a short batching window: calls from every
+thread that arrive within batch_window seconds of each other share one
+multi-input request.
+
+Usage:
+    service = EmbeddingService(lambda **request: client.embeddings.create(**request), 'cache/embeddings')
+    service.precompute(static_query_texts)      # one batched request for the missing texts
+    vector = service.embed(text)                # store hit, or a batched request
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+from vector_index import NUMPY_AVAILABLE, decode_embedding, np
+
+
+class _Batch:
+    """Texts waiting to be sent in one embeddings request."""
+    
+    def __init__(self):
+        self.texts = []
+        self.vectors = None
+        self.error = None
+        self.done = threading.Event()
+
+
+class EmbeddingService:
+    """
+    Embeds texts for RAG, serving static texts from a memory-mapped store.
+    
+    Without NumPy nothing is persisted: precomputed vectors are kept in memory
+    for the life of the process.
+    """
+    
+    def __init__(self, create, store_dir, model='text-embedding-3-small', dtype='float16',
+                 batch_window=0.02, max_batch=64):
+        """
+        Args:
+            create: Callable taking the embeddings request as keyword arguments
+                    (model, input, encoding_format), e.g. client.embeddings.create
+            store_dir: Directory of the persisted store
+            model: Embedding model
+            dtype: 'float16' or 'float32' for stored vectors
+            batch_window: Seconds a request waits for other texts to join it (0 sends at once)
+            max_batch: Most texts sent in one request
+        """
+        self.create = create
+        self.store_dir = store_dir
+        self.model = model
+        self.dtype = dtype if dtype in ('float16', 'float32') else 'float16'
+        self.batch_window = max(0.0, batch_window)
+        self.max_batch = max(1, int(max_batch))
+        self._lock = threading.Lock()
+        self._batch_lock = threading.Lock()
+        self._open_batch = None
+        self._rows = {}
+        self._matrix = None
+        self._memory = {}
+        self.store_hits = 0
+        self.requests = 0
+        self.texts_requested = 0
+        # The store is opened on first use, not when the service is created at import
+        self._loaded = False
+    
+    @staticmethod
+    def text_key(text):
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+    
+    def _paths(self):
+        name = self.model.replace('/', '_')
+        return os.path.join(self.store_dir, f'{name}.npy'), os.path.join(self.store_dir, f'{name}.json')
+    
+    def _ensure_loaded(self):
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._load()
+                    self._loaded = True
+    
+    def _load(self):
+        if not NUMPY_AVAILABLE:
+            return
+        matrix_path, index_path = self._paths()
+        if not (os.path.exists(matrix_path) and os.path.exists(index_path)):
+            return
+        try:
+            with open(index_path, 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            matrix = np.load(matrix_path, mmap_mode='r')
+            if matrix.shape[0] != len(index['keys']):
+                raise ValueError(f"store has {matrix.shape[0]} rows for {len(index['keys'])} keys")
+            self._matrix = matrix
+            self._rows = {key: row for row, key in enumerate(index['keys'])}
+            print(f"✓ Embedding store loaded: {len(self._rows)} vectors ({matrix.dtype}, {matrix.shape[1]} dimensions)")
+        except Exception as e:
+            print(f"⚠️  Warning: Could not load embedding store {matrix_path}: {str(e)}")
+            self._matrix = None
+            self._rows = {}
+    
+    def _persist(self, texts, vectors):
+        """Append vectors to the store and swap in the new memory map."""
+        keys = [self.text_key(text) for text in texts]
+        if not NUMPY_AVAILABLE:
+            with self._lock:
+                self._memory.update(zip(keys, vectors))
+            return
+        matrix_path, index_path = self._paths()
+        os.makedirs(self.store_dir, exist_ok=True)
+        with self._lock:
+            new_rows = np.asarray(vectors, dtype=self.dtype)
+            if self._matrix is not None:
+                if self._matrix.shape[1] != new_rows.shape[1]:
+                    raise ValueError(f"Store has {self._matrix.shape[1]} dimensions, got {new_rows.shape[1]}")
+                new_rows = np.concatenate([np.asarray(self._matrix, dtype=self.dtype), new_rows])
+            all_keys = [None] * len(self._rows)
+            for key, row in self._rows.items():
+                all_keys[row] = key
+            all_keys += keys
+            # Write both files next to the store and swap them in, so a reader never sees half a store
+            fd, tmp_matrix = tempfile.mkstemp(dir=self.store_dir, suffix='.npy.part')
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, new_rows)
+            fd, tmp_index = tempfile.mkstemp(dir=self.store_dir, suffix='.json.part')
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'model': self.model, 'dimensions': int(new_rows.shape[1]), 'dtype': self.dtype,
+                           'keys': all_keys}, f)
+            for path in (tmp_matrix, tmp_index):
+                os.chmod(path, 0o644)
+            os.replace(tmp_matrix, matrix_path)
+            os.replace(tmp_index, index_path)
+            self._matrix = np.load(matrix_path, mmap_mode='r')
+            self._rows = {key: row for row, key in enumerate(all_keys)}
+    
+    def lookup(self, text):
+        """
+        Return the stored vector for a text without any network call.
+        
+        Returns:
+            Vector (float16/float32 row of the store), or None if the text is not stored
+        """
+        self._ensure_loaded()
+        key = self.text_key(text)
+        with self._lock:
+            if NUMPY_AVAILABLE:
+                row = self._rows.get(key)
+                vector = self._matrix[row] if row is not None else None
+            else:
+                vector = self._memory.get(key)
+            if vector is not None:
+                self.store_hits += 1
+            return vector
+    
+    def _request(self, texts):
+        """Embed texts with as few requests as max_batch allows."""
+        vectors = []
+        for start in range(0, len(texts), self.max_batch):
+            chunk = texts[start:start + self.max_batch]
+            request = {'model': self.model, 'input': chunk}
+            if NUMPY_AVAILABLE:
+                # Raw float32 bytes instead of a JSON list of floats
+                request['encoding_format'] = 'base64'
+            response = self.create(**request)
+            data = sorted(response.data, key=lambda item: getattr(item, 'index', 0))
+            if len(data) != len(chunk):
+                raise ValueError(f"Embeddings response had {len(data)} vectors for {len(chunk)} inputs")
+            vectors.extend(decode_embedding(item.embedding) for item in data)
+            with self._lock:
+                self.requests += 1
+                self.texts_requested += len(chunk)
+        return vectors
+    
+    def precompute(self, texts):
+        """
+        Embed and store every text that is not stored yet.
+        
+        Args:
+            texts: Static texts (duplicates are embedded once)
+        
+        Returns:
+            int: Number of texts added to the store
+        """
+        self._ensure_loaded()
+        missing = []
+        seen = set()
+        for text in texts:
+            key = self.text_key(text)
+            if key in seen:
+                continue
+            seen.add(key)
+            with self._lock:
+                stored = key in self._rows or key in self._memory
+            if not stored:
+                missing.append(text)
+        if missing:
+            self._persist(missing, self._request(missing))
+        return len(missing)
+    
+    def embed(self, text):
+        """
+        Embed one text: from the store if it is there, otherwise in a shared batch request.
+        
+        Returns:
+            Vector
+        """
+        vector = self.lookup(text)
+        if vector is not None:
+            return vector
+        if self.batch_window <= 0:
+            return self._request([text])[0]
+        
+        with self._batch_lock:
+            batch = self._open_batch
+            leader = batch is None
+            if leader:
+                batch = self._open_batch = _Batch()
+            position = len(batch.texts)
+            batch.texts.append(text)
+            if len(batch.texts) >= self.max_batch:
+                # Full: later texts start a new batch
+                self._open_batch = None
+        
+        if leader:
+            # Give concurrent callers the window to join, then send the batch for all of them
+            time.sleep(self.batch_window)
+            with self._batch_lock:
+                if self._open_batch is batch:
+                    self._open_batch = None
+            try:
+                batch.vectors = self._request(batch.texts)
+            except Exception as e:
+                batch.error = e
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+        
+        if batch.error is not None:
+            raise batch.error
+        return batch.vectors[position]
+    
+    def stats(self):
+        """
+        Return counters for monitoring.
+        
+        Returns:
+            dict: stored vectors, store_hits, requests and texts_requested
+        """
+        self._ensure_loaded()
+        with self._lock:
+            return {
+                'stored': len(self._rows) + len(self._memory),
+                'store_hits': self.store_hits,
+                'requests': self.requests,
+                'texts_requested': self.texts_requested
+            }
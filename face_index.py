@@ -0,0 +1,282 @@
+"""
+Precomputed face boxes and blend masks for the pre-existing story images.
+
+The story template images (e.g. LittleRedRidingHoodImages/Image1.jpg ...) never
+change, so detecting the character's face in them and building the feathered
+elliptical blend mask on every request is wasted work. This module runs that
+step offline and stores the results next to the images:
+
+    <folder>/face_index.json   - image dimensions, face rectangles and mask offsets
+    <folder>/face_masks.npy    - every blend mask, flattened into one float16 array
+
+At runtime the masks are memory-mapped, so only the user's face has to be
+detected per book. Entries are matched to images by content hash; if an image
+changed since indexing (or no index exists) callers fall back to live detection.
+
+Build the index (run again whenever the template images change):
+    python face_index.py                      # all folders in STORY_IMAGE_FOLDERS
+    python face_index.py LittleRedRidingHoodImages
+"""
+
+import hashlib
+import json
+import os
+import sys
+import threading
+
+from lazy_import import lazy_module
+
+# Imported on first use (see lazy_import.py)
+cv2 = lazy_module('cv2')
+OPENCV_AVAILABLE = cv2 is not None
+
+np = lazy_module('numpy')
+HAS_NUMPY = np is not None
+
+# Folder of pre-existing template images for each story ID
+STORY_IMAGE_FOLDERS = {
+    'red': 'LittleRedRidingHoodImages'
+}
+
+INDEX_FILENAME = 'face_index.json'
+MASKS_FILENAME = 'face_masks.npy'
+INDEX_VERSION = 1
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+# Haar cascade parameters shared by offline indexing and live detection
+CASCADE_PARAMS = {
+    'scaleFactor': 1.1,
+    'minNeighbors': 5,
+    'minSize': (30, 30)
+}
+
+_thread_state = threading.local()
+
+
+def get_face_cascade():
+    """
+    Return the Haar cascade face detector for the current thread.
+    
+    Loading the cascade XML is slow and CascadeClassifier is not safe to share
+    between threads, so each thread loads it once and reuses it.
+    """
+    cascade = getattr(_thread_state, 'face_cascade', None)
+    if cascade is None:
+        cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+        _thread_state.face_cascade = cascade
+    return cascade
+
+
+def detect_largest_face(gray):
+    """
+    Detect faces in a grayscale image and return the largest one.
+    
+    Args:
+        gray: Grayscale numpy image
+    
+    Returns:
+        tuple: (x, y, w, h) of the largest face, or None if no face was found
+    """
+    faces = get_face_cascade().detectMultiScale(gray, **CASCADE_PARAMS)
+    if len(faces) == 0:
+        return None
+    x, y, w, h = max(faces, key=lambda rect: rect[2] * rect[3])
+    return int(x), int(y), int(w), int(h)
+
+
+def build_blend_mask(width, height):
+    """
+    Build the feathered elliptical mask used to blend a face into a w x h region.
+    
+    Returns:
+        numpy.ndarray: float32 array of shape (height, width) with values in [0, 1]
+    """
+    mask = np.zeros((height, width), dtype=np.float32)
+    center = (width // 2, height // 2)
+    axes = (width // 2 - 10, height // 2 - 10)
+    cv2.ellipse(mask, center, axes, 0, 0, 360, 1.0, -1)
+    
+    # Apply Gaussian blur to mask edges for smoother blending
+    mask = cv2.GaussianBlur(mask, (15, 15), 0)
+    return mask
+
+
+def _file_sha256(path):
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+class TemplateFace:
+    """Precomputed face rectangle and blend mask for one template image."""
+    
+    def __init__(self, rect, mask, width, height):
+        self.rect = rect
+        self.mask = mask
+        self.width = width
+        self.height = height
+
+
+class FolderFaceIndex:
+    """Loaded sidecar index for one story image folder."""
+    
+    def __init__(self, folder_path, entries, masks):
+        self.folder_path = folder_path
+        self.entries = entries
+        self.masks = masks
+        self._verified = {}
+        self._lock = threading.Lock()
+    
+    def _is_current(self, filename, entry):
+        """Check (once per file) that the image has not changed since it was indexed."""
+        with self._lock:
+            if filename not in self._verified:
+                path = os.path.join(self.folder_path, filename)
+                try:
+                    self._verified[filename] = _file_sha256(path) == entry['sha256']
+                except OSError:
+                    self._verified[filename] = False
+                if not self._verified[filename]:
+                    print(f"⚠️  Warning: {filename} changed since it was indexed; using live face detection")
+            return self._verified[filename]
+    
+    def lookup(self, image_path):
+        """
+        Return the TemplateFace for an image in this folder.
+        
+        Returns:
+            TemplateFace (with rect None if indexing found no face), or None if the
+            image is not indexed or changed since indexing
+        """
+        filename = os.path.basename(image_path)
+        entry = self.entries.get(filename)
+        if entry is None or not self._is_current(filename, entry):
+            return None
+        if entry.get('face') is None:
+            return TemplateFace(None, None, entry['width'], entry['height'])
+        x, y, w, h = entry['face']
+        offset = entry['mask_offset']
+        mask = self.masks[offset:offset + w * h].reshape(h, w)
+        return TemplateFace((x, y, w, h), mask, entry['width'], entry['height'])
+
+
+_loaded_indexes = {}
+_loaded_indexes_lock = threading.Lock()
+
+
+def load_folder_index(folder_path):
+    """
+    Load (and memoize) the sidecar index for a folder.
+    
+    Returns:
+        FolderFaceIndex or None if the folder has no usable index
+    """
+    folder_path = os.path.abspath(folder_path)
+    with _loaded_indexes_lock:
+        if folder_path in _loaded_indexes:
+            return _loaded_indexes[folder_path]
+        
+        index = None
+        index_path = os.path.join(folder_path, INDEX_FILENAME)
+        masks_path = os.path.join(folder_path, MASKS_FILENAME)
+        if HAS_NUMPY and os.path.exists(index_path) and os.path.exists(masks_path):
+            try:
+                with open(index_path, 'r') as f:
+                    data = json.load(f)
+                if data.get('version') == INDEX_VERSION:
+                    masks = np.load(masks_path, mmap_mode='r')
+                    index = FolderFaceIndex(folder_path, data['images'], masks)
+                    print(f"✓ Loaded face index for {os.path.basename(folder_path)} ({len(data['images'])} images)")
+                else:
+                    print(f"⚠️  Warning: Face index in {folder_path} has an old version; rebuild it with face_index.py")
+            except Exception as e:
+                print(f"Warning: Could not load face index for {folder_path}: {str(e)}")
+        
+        _loaded_indexes[folder_path] = index
+        return index
+
+
+def get_template_face(image_path):
+    """
+    Return precomputed face data for a template image, if its folder has been indexed.
+    
+    Returns:
+        TemplateFace or None
+    """
+    index = load_folder_index(os.path.dirname(image_path))
+    if index is None:
+        return None
+    return index.lookup(image_path)
+
+
+def build_folder_index(folder_path):
+    """
+    Detect the main face in every image of a folder and write the sidecar files.
+    
+    Args:
+        folder_path: Folder containing the template images
+    
+    Returns:
+        int: Number of images in which a face was found
+    """
+    from PIL import Image
+    
+    if not OPENCV_AVAILABLE or not HAS_NUMPY:
+        raise RuntimeError("OpenCV and NumPy are required to build the face index")
+    
+    entries = {}
+    masks = []
+    offset = 0
+    found = 0
+    for filename in sorted(os.listdir(folder_path)):
+        if not filename.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        path = os.path.join(folder_path, filename)
+        
+        # Detect on exactly what the runtime sees: the image converted to RGB
+        image = Image.open(path).convert('RGB')
+        bgr = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+        gray = cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
+        face = detect_largest_face(gray)
+        
+        entry = {
+            'sha256': _file_sha256(path),
+            'width': image.width,
+            'height': image.height,
+            'face': list(face) if face else None,
+            'mask_offset': None
+        }
+        if face:
+            _, _, w, h = face
+            masks.append(build_blend_mask(w, h).astype(np.float16).ravel())
+            entry['mask_offset'] = offset
+            offset += w * h
+            found += 1
+            print(f"  {filename}: face at {face}")
+        else:
+            print(f"  {filename}: no face detected")
+        entries[filename] = entry
+    
+    mask_array = np.concatenate(masks) if masks else np.zeros(0, dtype=np.float16)
+    np.save(os.path.join(folder_path, MASKS_FILENAME), mask_array)
+    with open(os.path.join(folder_path, INDEX_FILENAME), 'w') as f:
+        json.dump({'version': INDEX_VERSION, 'images': entries}, f, indent=2)
+    return found
+
+
+def main(argv):
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    folders = argv or list(STORY_IMAGE_FOLDERS.values())
+    for folder in folders:
+        folder_path = folder if os.path.isabs(folder) else os.path.join(base_dir, folder)
+        if not os.path.isdir(folder_path):
+            print(f"✗ Folder not found: {folder_path}")
+            return 1
+        print(f"Indexing {folder_path}...")
+        found = build_folder_index(folder_path)
+        print(f"✓ Wrote {INDEX_FILENAME} and {MASKS_FILENAME} ({found} faces)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
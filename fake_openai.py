@@ -0,0 +1,563 @@
+"""
+Offline stand-in for the OpenAI API, for load testing the generation pipeline.
+
+Implements the endpoints the app uses - chat completions, image generation and
+embeddings - with deterministic fixtures, so whole books can be generated
+without spending money or waiting on the real API:
+
+    chat        face verification JSON ({"matches": true, ...}), page narrative JSON
+                (single page and batched "pages"), consistency JSON, and plain
+                descriptions for the vision prompts
+    images      1024x1024 PNGs drawn from the prompt (b64_json or a URL served here)
+    embeddings  unit vectors seeded from the input text (float lists or base64)
+
+The same request always gets the same response body. Latency and errors are drawn
+from configurable distributions (seeded with --seed), so throughput runs are
+reproducible:
+
+    --latency chat=0.8:0.3,images=6:2,embeddings=0.1   mean[:stddev] seconds per endpoint
+    --errors 429=0.02,500=0.01                           probability of each error status
+
+With --rate-limits the stand-in also enforces per-model budgets the way the API
+reports them, so the app's rate governor can be exercised offline. Budgets are
+counted in fixed one-minute windows (tokens estimated like rate_governor does:
+prompt plus max_tokens). Every response carries x-ratelimit-limit-*,
+x-ratelimit-remaining-* and x-ratelimit-reset-* headers for its model, and a
+request over budget gets a 429 with Retry-After / retry-after-ms until the
+window resets:
+
+    --rate-limits gpt-4o=500:30000,dall-e-3=7            model=requests_per_minute[:tokens_per_minute]
+    --retry-after 0.5                                    Retry-After of the simulated --errors 429s
+
+Point the app at it with OPENAI_BASE_URL:
+
+    python fake_openai.py --port 8089 --latency chat=0.8:0.3,images=6:2
+    OPENAI_BASE_URL=http://127.0.0.1:8089/v1 OPENAI_API_KEY=fake python project.py
+
+Benchmarks can also run it in-process:
+
+    server = FakeOpenAIServer(port=0, latency={'images': (6, 2)})
+    server.start()
+    ... OpenAI(base_url=server.base_url, api_key='fake') ...
+    server.stats()   # {'requests': {...}, 'errors': {...}}
+    server.stop()
+"""
+
+import argparse
+import array
+import base64
+import hashlib
+import io
+import json
+import math
+import random
+import re
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from PIL import Image, ImageDraw
+
+from rate_governor import estimate_tokens, parse_rate_limits
+
+ENDPOINTS = ('chat', 'images', 'embeddings')
+# Model assumed when a request does not name one
+DEFAULT_MODELS = {'chat': 'gpt-4o', 'images': 'dall-e-2', 'embeddings': 'text-embedding-3-small'}
+RATE_LIMIT_WINDOW = 60.0
+EMBEDDING_DIMENSIONS = 1536
+IMAGE_CACHE_SIZE = 64
+
+DESCRIPTION_FIXTURES = [
+    "A cheerful child of about six with short wavy dark brown hair, round warm brown eyes, "
+    "a round face with soft cheeks, light olive skin, a small button nose and a wide smile with dimples.",
+    "Soft watercolor storybook style: warm golden and leafy green palette, gentle blended edges, "
+    "loose painterly brushwork, soft morning light and a light paper texture.",
+    "A young child with shoulder-length straight black hair, almond-shaped dark eyes, an oval face, "
+    "warm tan skin, a small nose, a gentle smile and a few freckles across the nose.",
+]
+
+NARRATIVE_FIXTURES = [
+    "{name} stepped onto the winding path with a brave smile.",
+    "The tall trees whispered secrets as {name} walked along.",
+    "A little bird fluttered down to greet {name} by the stream.",
+    "{name} laughed and waved at the friendly bird.",
+    "Golden light sparkled through the leaves all around {name}.",
+    "{name} took a deep breath and kept on going.",
+]
+
+
+def parse_latency(spec):
+    """
+    Parse a latency specification such as "chat=0.8:0.3,images=6:2,embeddings=0.1".
+    
+    Args:
+        spec: Comma-separated endpoint=mean[:stddev] pairs in seconds (may be None or empty)
+    
+    Returns:
+        dict: Mapping of endpoint to (mean, stddev)
+    """
+    latency = {}
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part or '=' not in part:
+            continue
+        endpoint, value = part.split('=', 1)
+        mean, _, stddev = value.partition(':')
+        try:
+            latency[endpoint.strip()] = (float(mean), float(stddev or 0))
+        except ValueError:
+            print(f"⚠️  Warning: Ignoring invalid latency '{part}'")
+    return latency
+
+
+def parse_errors(spec):
+    """
+    Parse an error specification such as "429=0.02,500=0.01".
+    
+    Args:
+        spec: Comma-separated status=probability pairs (may be None or empty)
+    
+    Returns:
+        dict: Mapping of HTTP status to probability
+    """
+    errors = {}
+    for part in (spec or '').split(','):
+        part = part.strip()
+        if not part or '=' not in part:
+            continue
+        status, value = part.split('=', 1)
+        try:
+            errors[int(status)] = float(value)
+        except ValueError:
+            print(f"⚠️  Warning: Ignoring invalid error rate '{part}'")
+    return errors
+
+
+def format_reset_duration(seconds):
+    """
+    Format seconds like the API's x-ratelimit-reset-* headers ("120ms", "12.5s", "1m0s").
+    
+    Returns:
+        str: Duration
+    """
+    if seconds < 1:
+        return f"{max(0, int(seconds * 1000))}ms"
+    minutes, rest = divmod(seconds, 60)
+    rest = f"{rest:.3f}".rstrip('0').rstrip('.')
+    return f"{int(minutes)}m{rest}s" if minutes else f"{rest}s"
+
+
+def _retry_after_headers(seconds):
+    """Retry-After (whole seconds, as HTTP requires) and the API's retry-after-ms."""
+    return {'retry-after': str(max(1, math.ceil(seconds))), 'retry-after-ms': str(max(1, int(seconds * 1000)))}
+
+
+class _Window:
+    """A model's requests and tokens used in the current rate limit window."""
+    
+    def __init__(self, started):
+        self.started = started
+        self.requests = 0
+        self.tokens = 0
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+def _pick(options, text):
+    return options[_digest(text)[0] % len(options)]
+
+
+def _estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _character_name(prompt):
+    match = re.search(r'main character\'s name is "([^"]+)"', prompt)
+    return match.group(1) if match else "The child"
+
+
+def _narrative(name, seed_text):
+    start = _digest(seed_text)[1] % len(NARRATIVE_FIXTURES)
+    return [NARRATIVE_FIXTURES[(start + k) % len(NARRATIVE_FIXTURES)].format(name=name) for k in range(3)]
+
+
+def _prompt_text(messages):
+    """Return the text parts of a chat request and the number of images in it."""
+    prompt = ""
+    images = 0
+    for message in messages or []:
+        content = message.get('content')
+        if isinstance(content, str):
+            prompt += content + "\n"
+        elif isinstance(content, list):
+            prompt += "\n".join(part.get('text', '') for part in content if part.get('type') == 'text') + "\n"
+            images += sum(1 for part in content if part.get('type') == 'image_url')
+    return prompt, images
+
+
+def chat_fixture(messages):
+    """
+    Return the assistant message content for a chat request.
+    
+    Args:
+        messages: The request's messages list
+    
+    Returns:
+        str: Response content (JSON text for the prompts that ask for JSON)
+    """
+    prompt, _ = _prompt_text(messages)
+    
+    if '"matches"' in prompt:
+        return json.dumps({"matches": True, "feedback": "Face shape, hair and eyes match the first illustration."})
+    if '"pages"' in prompt:
+        name = _character_name(prompt)
+        page_numbers = re.findall(r'^PAGE (\d+):', prompt, re.MULTILINE)
+        return json.dumps({"pages": {number: {"narrative": _narrative(name, number)} for number in page_numbers}})
+    if '"narrative"' in prompt:
+        match = re.search(r'text for page (\d+)', prompt)
+        return json.dumps({"narrative": _narrative(_character_name(prompt), match.group(1) if match else prompt)})
+    if 'character_features' in prompt:
+        return json.dumps({
+            "character_features": _pick(DESCRIPTION_FIXTURES, prompt),
+            "objects": "a red hooded cape, a wicker basket with bread and cakes",
+            "style": "soft watercolor, warm palette, gentle light"
+        })
+    return _pick(DESCRIPTION_FIXTURES, prompt)
+
+
+_image_cache = OrderedDict()
+_image_cache_lock = threading.Lock()
+
+
+def image_fixture(prompt, size="1024x1024"):
+    """
+    Return PNG bytes for an image prompt: a gradient and shapes derived from the prompt.
+    
+    Args:
+        prompt: Image prompt
+        size: "WIDTHxHEIGHT"
+    
+    Returns:
+        bytes: PNG data
+    """
+    key = (hashlib.sha256(prompt.encode('utf-8')).hexdigest(), size)
+    with _image_cache_lock:
+        if key in _image_cache:
+            _image_cache.move_to_end(key)
+            return _image_cache[key]
+    
+    width, height = (int(v) for v in size.split('x'))
+    seed = _digest(prompt)
+    top = seed[0:3]
+    bottom = seed[3:6]
+    # Vertical gradient between two colours, then a few shapes
+    gradient = Image.linear_gradient('L').resize((width, height))
+    image = Image.composite(Image.new('RGB', (width, height), tuple(bottom)),
+                            Image.new('RGB', (width, height), tuple(top)), gradient)
+    draw = ImageDraw.Draw(image)
+    for k in range(6):
+        x, y, r = seed[6 + k * 3] * width // 256, seed[7 + k * 3] * height // 256, 40 + seed[8 + k * 3] // 2
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=tuple(seed[(k * 5) % 29:(k * 5) % 29 + 3]))
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG', compress_level=1)
+    data = buffer.getvalue()
+    
+    with _image_cache_lock:
+        _image_cache[key] = data
+        while len(_image_cache) > IMAGE_CACHE_SIZE:
+            _image_cache.popitem(last=False)
+    return data
+
+
+def embedding_fixture(text, dimensions=EMBEDDING_DIMENSIONS):
+    """Return a unit vector seeded from the text, so equal texts get equal embeddings."""
+    rng = random.Random(_digest(text))
+    vector = [rng.gauss(0, 1) for _ in range(dimensions)]
+    norm = sum(v * v for v in vector) ** 0.5
+    return [v / norm for v in vector]
+
+
+class FakeOpenAIServer:
+    """HTTP server answering OpenAI API requests with fixtures."""
+    
+    def __init__(self, host='127.0.0.1', port=8089, latency=None, errors=None, seed=0, rate_limits=None,
+                 retry_after=0.5):
+        """
+        Args:
+            host: Interface to listen on
+            port: Port (0 picks a free port)
+            latency: Dict of endpoint ('chat', 'images', 'embeddings') -> (mean, stddev) seconds
+            errors: Dict of HTTP status -> probability of answering with that error
+            seed: Seed for the latency and error draws
+            rate_limits: Dict of model -> (requests_per_minute, tokens_per_minute) enforced per
+                         one-minute window (0: no limit; models not listed are unlimited)
+            retry_after: Seconds sent as Retry-After with the simulated 429 errors
+        """
+        self.latency = dict(latency or {})
+        self.errors = dict(errors or {})
+        self.rate_limits = dict(rate_limits or {})
+        self.retry_after = retry_after
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._images = OrderedDict()  # image id -> PNG bytes served under /files/
+        self._windows = {}  # model -> _Window
+        self.requests = {endpoint: 0 for endpoint in ENDPOINTS}
+        self.error_counts = {}
+        self.rate_limited = {}
+        self._httpd = ThreadingHTTPServer((host, port), self._handler_class())
+        self._httpd.daemon_threads = True
+        self._thread = None
+    
+    @property
+    def base_url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}/v1"
+    
+    def _handler_class(self):
+        server = self
+        
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            
+            def do_POST(self):
+                server._handle_post(self)
+            
+            def do_GET(self):
+                server._handle_get(self)
+            
+            def log_message(self, *args):
+                pass
+        
+        return Handler
+    
+    def _draw(self, endpoint):
+        """Draw this request's delay and error status."""
+        with self._lock:
+            self.requests[endpoint] += 1
+            mean, stddev = self.latency.get(endpoint, (0.0, 0.0))
+            delay = max(0.0, self._rng.gauss(mean, stddev)) if stddev else mean
+            status = None
+            roll = self._rng.random()
+            for error_status, probability in sorted(self.errors.items()):
+                if roll < probability:
+                    status = error_status
+                    self.error_counts[status] = self.error_counts.get(status, 0) + 1
+                    break
+                roll -= probability
+        return delay, status
+    
+    def _admit(self, model, endpoint, body):
+        """
+        Count a request against its model's rate limit window.
+        
+        Returns:
+            tuple: (x-ratelimit-* headers, None if the model has no limits;
+                    seconds until the window resets if the request is over budget, else None)
+        """
+        limits = self.rate_limits.get(model)
+        if not limits or not any(limits):
+            return None, None
+        requests_per_minute, tokens_per_minute = limits
+        tokens = estimate_tokens(endpoint, body)
+        with self._lock:
+            now = time.monotonic()
+            window = self._windows.get(model)
+            if window is None or now - window.started >= RATE_LIMIT_WINDOW:
+                window = self._windows[model] = _Window(now)
+            reset = window.started + RATE_LIMIT_WINDOW - now
+            over = ((requests_per_minute and window.requests + 1 > requests_per_minute) or
+                    (tokens_per_minute and window.tokens + tokens > tokens_per_minute))
+            if over:
+                self.rate_limited[model] = self.rate_limited.get(model, 0) + 1
+            else:
+                window.requests += 1
+                window.tokens += tokens
+            headers = {}
+            for kind, limit, used in (('requests', requests_per_minute, window.requests),
+                                      ('tokens', tokens_per_minute, window.tokens)):
+                if limit:
+                    headers[f'x-ratelimit-limit-{kind}'] = str(limit)
+                    headers[f'x-ratelimit-remaining-{kind}'] = str(max(0, limit - used))
+                    headers[f'x-ratelimit-reset-{kind}'] = format_reset_duration(reset)
+        return headers, (reset if over else None)
+    
+    def _send_json(self, handler, status, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        handler.send_response(status)
+        handler.send_header('Content-Type', 'application/json')
+        handler.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            handler.send_header(name, value)
+        handler.end_headers()
+        handler.wfile.write(data)
+    
+    def _handle_post(self, handler):
+        length = int(handler.headers.get('Content-Length') or 0)
+        try:
+            body = json.loads(handler.rfile.read(length) or b'{}')
+        except json.JSONDecodeError:
+            self._send_json(handler, 400, {"error": {"message": "Invalid JSON body", "type": "invalid_request_error"}})
+            return
+        
+        path = handler.path.split('?', 1)[0].rstrip('/')
+        routes = {
+            '/v1/chat/completions': ('chat', self._chat),
+            '/v1/images/generations': ('images', self._images_generate),
+            '/v1/embeddings': ('embeddings', self._embeddings)
+        }
+        if path not in routes:
+            self._send_json(handler, 404, {"error": {"message": f"Unknown endpoint {path}", "type": "invalid_request_error"}})
+            return
+        
+        endpoint, respond = routes[path]
+        delay, error_status = self._draw(endpoint)
+        model = body.get('model') or DEFAULT_MODELS[endpoint]
+        rate_headers, reset = self._admit(model, endpoint, body)
+        if reset is not None:
+            # Over budget: rejected straight away, like the API
+            headers = dict(rate_headers, **_retry_after_headers(reset))
+            self._send_json(handler, 429, {
+                "error": {"message": f"Rate limit reached for {model}", "type": "requests", "code": "rate_limit_exceeded"}
+            }, headers)
+            return
+        if delay:
+            time.sleep(delay)
+        if error_status is not None:
+            headers = dict(rate_headers or {})
+            if error_status == 429:
+                headers.update(_retry_after_headers(self.retry_after))
+            self._send_json(handler, error_status, {
+                "error": {"message": f"Simulated {error_status} error", "type": "fake_openai_error", "code": str(error_status)}
+            }, headers)
+            return
+        self._send_json(handler, 200, respond(body, handler), rate_headers)
+    
+    def _handle_get(self, handler):
+        path = handler.path.split('?', 1)[0]
+        if path.startswith('/files/'):
+            with self._lock:
+                data = self._images.get(path[len('/files/'):])
+            if data is not None:
+                handler.send_response(200)
+                handler.send_header('Content-Type', 'image/png')
+                handler.send_header('Content-Length', str(len(data)))
+                handler.end_headers()
+                handler.wfile.write(data)
+                return
+        self._send_json(handler, 404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+    
+    def _chat(self, body, handler):
+        content = chat_fixture(body.get('messages'))
+        prompt, images = _prompt_text(body.get('messages'))
+        # Images are billed per tile, not by their base64 size; 765 tokens is a 1024x1024 image
+        prompt_tokens = _estimate_tokens(prompt) + 765 * images
+        completion_tokens = _estimate_tokens(content)
+        return {
+            "id": f"chatcmpl-fake-{hashlib.sha1(content.encode('utf-8')).hexdigest()[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get('model') or DEFAULT_MODELS['chat'],
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens
+            }
+        }
+    
+    def _images_generate(self, body, handler):
+        prompt = body.get('prompt', '')
+        data = image_fixture(prompt, body.get('size') or "1024x1024")
+        if body.get('response_format') == 'b64_json':
+            item = {"b64_json": base64.b64encode(data).decode('ascii')}
+        else:
+            image_id = hashlib.sha256(data).hexdigest()[:24] + '.png'
+            with self._lock:
+                self._images[image_id] = data
+                while len(self._images) > IMAGE_CACHE_SIZE:
+                    self._images.popitem(last=False)
+            host = handler.headers.get('Host') or '%s:%s' % self._httpd.server_address[:2]
+            item = {"url": f"http://{host}/files/{image_id}"}
+        item["revised_prompt"] = prompt
+        return {"created": int(time.time()), "data": [item]}
+    
+    def _embeddings(self, body, handler):
+        inputs = body.get('input')
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        dimensions = body.get('dimensions') or EMBEDDING_DIMENSIONS
+        data = []
+        for index, text in enumerate(inputs or []):
+            vector = embedding_fixture(str(text), dimensions)
+            if body.get('encoding_format') == 'base64':
+                vector = base64.b64encode(array.array('f', vector).tobytes()).decode('ascii')
+            data.append({"object": "embedding", "index": index, "embedding": vector})
+        tokens = sum(_estimate_tokens(str(text)) for text in inputs or [])
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get('model') or DEFAULT_MODELS['embeddings'],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        }
+    
+    def start(self):
+        """Serve requests on a background thread."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._httpd.serve_forever, name='fake-openai', daemon=True)
+            self._thread.start()
+        return self
+    
+    def serve_forever(self):
+        self._httpd.serve_forever()
+    
+    def stop(self):
+        """Stop serving and close the socket."""
+        self._httpd.shutdown()
+        self._httpd.server_close()
+    
+    def stats(self):
+        """
+        Return request counters.
+        
+        Returns:
+            dict: {'requests': endpoint -> count, 'errors': status -> count (simulated errors),
+                   'rate_limited': model -> requests rejected by --rate-limits}
+        """
+        with self._lock:
+            return {'requests': dict(self.requests), 'errors': dict(self.error_counts),
+                    'rate_limited': dict(self.rate_limited)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline OpenAI API stand-in for load testing")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', default='', help='endpoint=mean[:stddev] seconds, e.g. "chat=0.8:0.3,images=6:2"')
+    parser.add_argument('--errors', default='', help='status=probability, e.g. "429=0.02,500=0.01"')
+    parser.add_argument('--seed', type=int, default=0, help='Seed for latency and error draws')
+    parser.add_argument('--rate-limits', default='',
+                        help='model=requests_per_minute[:tokens_per_minute] budgets to enforce, e.g. "gpt-4o=500:30000"')
+    parser.add_argument('--retry-after', type=float, default=0.5, help='Retry-After seconds of the simulated 429 errors')
+    args = parser.parse_args()
+    
+    server = FakeOpenAIServer(args.host, args.port, parse_latency(args.latency), parse_errors(args.errors), args.seed,
+                              parse_rate_limits(args.rate_limits), args.retry_after)
+    print(f"✓ Fake OpenAI API listening on {server.base_url}")
+    print(f"  Set OPENAI_BASE_URL={server.base_url} to use it")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(f"Requests: {server.stats()}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,185 @@
+"""
+Shared, pooled HTTP transport for outbound API and download traffic.
+
+The OpenAI client and the DALL-E image downloader used to open connections
+independently: every image download was a bare requests.get() (a new TCP + TLS
+handshake for each of a book's 13 result URLs), and the OpenAI client ran with
+default pool limits while up to 12 threads used it. HttpTransport owns a single
+httpx.Client with keep-alive connection pools sized to our concurrency, explicit
+connect / read timeouts and HTTP/2 when the optional h2 package is installed.
+
+Requests wait for a free connection on our own semaphore before they reach the
+httpx pool, so the pool itself never has to queue them: under eventlet, httpcore
+handing a connection to a queued request can end up with two green threads
+reading the same socket ("Second simultaneous read on fileno ...").
+
+It also counts how the pool is used:
+- connection reuse: requests served on an already open connection
+- saturation: requests that had to wait because every connection was busy, and
+  the peak number of requests in flight
+
+Usage:
+    transport = HttpTransport(max_connections=32, connect_timeout=5, read_timeout=120)
+    client = OpenAI(api_key=key, http_client=transport.client, timeout=transport.timeout)
+    response = transport.client.get(url, timeout=30)
+    transport.stats()   # {'requests': ..., 'reuse_rate': ..., 'saturated_requests': ..., ...}
+"""
+
+import threading
+import weakref
+
+import httpx
+
+# HTTP/2 needs the optional h2 package (pip install h2)
+try:
+    import h2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+
+class _TrackedStream(httpx.SyncByteStream):
+    """Response body stream that reports when the response is closed."""
+    
+    def __init__(self, stream, on_close):
+        self._stream = stream
+        self._on_close = on_close
+        self._closed = False
+    
+    def __iter__(self):
+        for chunk in self._stream:
+            yield chunk
+    
+    def close(self):
+        try:
+            self._stream.close()
+        finally:
+            if not self._closed:
+                self._closed = True
+                self._on_close()
+
+
+class _InstrumentedTransport(httpx.HTTPTransport):
+    """httpx transport that records connection reuse and requests in flight."""
+    
+    def __init__(self, owner, **kwargs):
+        super().__init__(**kwargs)
+        self._owner = owner
+    
+    def handle_request(self, request):
+        self._owner._request_started()
+        try:
+            response = super().handle_request(request)
+        except BaseException:
+            self._owner._request_finished()
+            raise
+        self._owner._connection_used(response.extensions.get('network_stream'))
+        # The connection stays busy until the body has been read and the response closed
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_TrackedStream(response.stream, self._owner._request_finished),
+            extensions=response.extensions
+        )
+    
+    @property
+    def open_connections(self):
+        pool = getattr(self, '_pool', None)
+        return len(getattr(pool, 'connections', ()))
+
+
+class HttpTransport:
+    """A configured httpx.Client plus pool usage counters."""
+    
+    def __init__(self, max_connections=32, max_keepalive_connections=16, keepalive_expiry=30.0,
+                 connect_timeout=5.0, read_timeout=120.0, http2=True):
+        """
+        Args:
+            max_connections: Maximum open connections across all hosts
+            max_keepalive_connections: Idle connections kept open for reuse
+            keepalive_expiry: Seconds an idle connection is kept
+            connect_timeout: Seconds to establish a connection
+            read_timeout: Seconds to wait for response data (also used for writes and pool waits)
+            http2: Use HTTP/2 when the h2 package is installed
+        """
+        self.max_connections = max_connections
+        self.http2 = bool(http2 and HTTP2_AVAILABLE)
+        self.timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_connections)
+        self._seen_streams = weakref.WeakSet()
+        self.requests = 0
+        self.reused = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.saturated_requests = 0
+        self._limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry
+        )
+        # The pool (and its TLS context, which takes tens of milliseconds to load) is created on first use
+        self._transport = None
+        self._client = None
+        self._client_lock = threading.Lock()
+    
+    @property
+    def client(self):
+        """The shared httpx.Client, created on first use."""
+        if self._client is None:
+            with self._client_lock:
+                if self._client is None:
+                    self._transport = _InstrumentedTransport(self, http2=self.http2, limits=self._limits)
+                    self._client = httpx.Client(transport=self._transport, timeout=self.timeout, follow_redirects=True)
+        return self._client
+    
+    def _request_started(self):
+        # Wait here for a free connection rather than in the httpx pool
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.saturated_requests += 1
+            self._slots.acquire()
+        with self._lock:
+            self.requests += 1
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+    
+    def _request_finished(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+    
+    def _connection_used(self, network_stream):
+        if network_stream is None:
+            return
+        with self._lock:
+            if network_stream in self._seen_streams:
+                self.reused += 1
+            else:
+                self._seen_streams.add(network_stream)
+    
+    def stats(self):
+        """
+        Return pool counters for monitoring.
+        
+        Returns:
+            dict: requests, reused, reuse_rate, in_flight, peak_in_flight, saturated_requests,
+                  open_connections, max_connections and http2
+        """
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'reused': self.reused,
+                'reuse_rate': round(self.reused / self.requests, 3) if self.requests else 0.0,
+                'in_flight': self.in_flight,
+                'peak_in_flight': self.peak_in_flight,
+                'saturated_requests': self.saturated_requests,
+                'open_connections': self._transport.open_connections if self._transport is not None else 0,
+                'max_connections': self.max_connections,
+                'http2': self.http2
+            }
+    
+    def close(self):
+        """Close every pooled connection."""
+        if self._client is not None:
+            self._client.close()
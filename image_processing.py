@@ -0,0 +1,424 @@
+"""
+Image compositing primitives for the pre-illustrated story path.
+
+Loading the story template images, decoding the child's photo once per book
+(BookSubject), blending the child's face into a template and overlaying the
+character's name. This module has no Flask, database or OpenAI dependencies, so
+it can be imported by compositing worker processes (see compositing.py) without
+loading the web application.
+"""
+
+import io
+import os
+
+from PIL import Image, ImageDraw, ImageFont, ImageOps
+
+from lazy_import import lazy_module
+
+# OpenCV for face detection, imported on first use (see lazy_import.py)
+cv2 = lazy_module('cv2')
+OPENCV_AVAILABLE = cv2 is not None
+
+# numpy is optional - the simple blend fallback works without it
+np = lazy_module('numpy')
+HAS_NUMPY = np is not None
+
+from face_index import STORY_IMAGE_FOLDERS, get_template_face, detect_largest_face, build_blend_mask
+
+# User photos are decoded and downscaled once per book (see BookSubject) to at most this many pixels per side
+BOOK_SUBJECT_MAX_SIDE = int(os.environ.get('BOOK_SUBJECT_MAX_SIDE', 1024))
+
+# Common text patterns in Little Red Riding Hood images
+STORY_TEXT_PATTERNS = ["Little Red Riding Hood", "Red Riding Hood", "Little Red", "Red"]
+
+
+def find_story_image_path(story_id, page_number):
+    """
+    Find the file of a pre-existing story image.
+    
+    Args:
+        story_id: The story identifier (e.g., 'red' for Little Red Riding Hood)
+        page_number: Page number (1-13, where 1 is cover, 13 is last page)
+    
+    Returns:
+        str: Path to the image file, or None if not found
+    """
+    if story_id not in STORY_IMAGE_FOLDERS:
+        return None
+    
+    folder_name = STORY_IMAGE_FOLDERS[story_id]
+    folder_path = os.path.join(os.path.dirname(__file__), folder_name)
+    
+    # Try different image formats and naming conventions
+    image_extensions = ['.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG']
+    image_names = [
+        f'Image{page_number}.jpg',
+        f'Image{page_number}.png',
+        f'image{page_number}.jpg',
+        f'image{page_number}.png',
+        f'Image{page_number:02d}.jpg',
+        f'Image{page_number:02d}.png'
+    ]
+    
+    for img_name in image_names:
+        img_path = os.path.join(folder_path, img_name)
+        if os.path.exists(img_path):
+            return img_path
+    
+    # If exact match not found, try with extensions
+    for ext in image_extensions:
+        img_path = os.path.join(folder_path, f'Image{page_number}{ext}')
+        if os.path.exists(img_path):
+            return img_path
+    
+    return None
+
+
+def load_story_image(story_id, page_number):
+    """
+    Load a pre-existing story image from the story images folder.
+    
+    Args:
+        story_id: The story identifier (e.g., 'red' for Little Red Riding Hood)
+        page_number: Page number (1-13, where 1 is cover, 13 is last page)
+    
+    Returns:
+        PIL Image object or None if not found
+    """
+    try:
+        img_path = find_story_image_path(story_id, page_number)
+        if img_path is not None:
+            return Image.open(img_path).convert('RGB')
+        
+        print(f"Warning: Could not find image for story {story_id}, page {page_number}")
+        return None
+    
+    except Exception as e:
+        print(f"Error loading story image: {str(e)}")
+        return None
+
+
+class BookSubject:
+    """
+    The user's uploaded photo, decoded and analysed once per book.
+    
+    Every page of a book composites the same child into a different template, so
+    the photo is decoded, EXIF-oriented, downscaled and face-detected a single time
+    and this object is handed to every page worker instead of the file path.
+    
+    Attributes:
+        image: PIL RGB image (EXIF-oriented, longest side at most max_side)
+        rgb: numpy RGB array of image (None without NumPy)
+        gray: numpy grayscale array used for face detection (None without OpenCV)
+        face: (x, y, w, h) of the largest face in image, or None if no face was found
+        face_crop: numpy RGB array of the face region, or None
+    """
+    
+    def __init__(self, image):
+        self.image = image
+        self.path = None
+        self.rgb = None
+        self.gray = None
+        self.face = None
+        self.face_crop = None
+        self._bgr = None
+        
+        if HAS_NUMPY:
+            self.rgb = np.array(image)
+        if OPENCV_AVAILABLE and HAS_NUMPY:
+            self.gray = cv2.cvtColor(self.rgb, cv2.COLOR_RGB2GRAY)
+            self.face = detect_largest_face(self.gray)
+            if self.face:
+                x, y, w, h = self.face
+                self.face_crop = self.rgb[y:y+h, x:x+w]
+    
+    @property
+    def bgr(self):
+        """BGR variant of the image for OpenCV routines that expect it (built on first use)."""
+        if self._bgr is None and self.rgb is not None and OPENCV_AVAILABLE:
+            self._bgr = cv2.cvtColor(self.rgb, cv2.COLOR_RGB2BGR)
+        return self._bgr
+    
+    @classmethod
+    def from_path(cls, image_path, max_side=None):
+        """
+        Decode and analyse the user's photo.
+        
+        Args:
+            image_path: Path to the uploaded photo
+            max_side: Longest side after downscaling (defaults to BOOK_SUBJECT_MAX_SIDE)
+        
+        Returns:
+            BookSubject
+        """
+        max_side = max_side or BOOK_SUBJECT_MAX_SIDE
+        with Image.open(image_path) as img:
+            # Let the JPEG decoder scale down while decoding instead of decoding the full upload
+            img.draft('RGB', (max_side, max_side))
+            img = ImageOps.exif_transpose(img)
+            image = img.convert('RGB')
+        if max(image.size) > max_side:
+            image.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+        return cls(image)
+    
+    def save(self, path):
+        """
+        Write the decoded photo to disk so compositing workers can load it by path.
+        
+        Args:
+            path: Destination PNG path (also stored as self.path)
+        """
+        self.image.save(path, 'PNG', compress_level=1)
+        self.path = path
+    
+    @classmethod
+    def load(cls, path):
+        """Load a subject previously written with save()."""
+        with Image.open(path) as img:
+            subject = cls(img.convert('RGB'))
+        subject.path = path
+        return subject
+
+
+def replace_face_in_image(story_image, user_image, character_name=None, template_face=None, subject=None):
+    """
+    Replace the main character's face in the story image with the user's face.
+    
+    This function:
+    1. Detects faces in both images using OpenCV's face detection
+    2. Extracts facial features from user image
+    3. Replaces/overlays the face in the story image
+    
+    Args:
+        story_image: PIL Image of the story page
+        user_image: PIL Image of the user's uploaded photo
+        character_name: Optional character name for text replacement
+        template_face: Optional precomputed TemplateFace for the story image (see face_index.py);
+                       skips face detection and mask building on the story image
+        subject: Optional BookSubject for the user's photo; when given, user_image is
+                 ignored and the subject's decoded image and detected face are reused
+    
+    Returns:
+        PIL Image with replaced face
+    """
+    try:
+        if subject is not None:
+            user_image = subject.image
+        
+        if not OPENCV_AVAILABLE or not HAS_NUMPY:
+            # Fallback: Simple blending if OpenCV or NumPy not available
+            print("OpenCV or NumPy not available, using simple image blending")
+            return _simple_face_blend(story_image, user_image)
+        
+        # Convert PIL images to numpy arrays for OpenCV
+        story_array = np.array(story_image)
+        
+        # Find the main character's face in the story image (precomputed when indexed)
+        if template_face is not None and template_face.width == story_image.width and template_face.height == story_image.height:
+            story_face = template_face.rect
+        else:
+            template_face = None
+            story_gray = cv2.cvtColor(story_array, cv2.COLOR_RGB2GRAY)
+            story_face = detect_largest_face(story_gray)
+        
+        # Find the user's face (detected once per book when a subject is passed in)
+        if subject is not None:
+            user_array = subject.rgb
+            user_face = subject.face
+        else:
+            user_array = np.array(user_image)
+            user_face = detect_largest_face(cv2.cvtColor(user_array, cv2.COLOR_RGB2GRAY))
+        
+        if not story_face or not user_face:
+            print("Could not detect faces, using simple blending")
+            return _simple_face_blend(story_image, user_image)
+        
+        user_x, user_y, user_w, user_h = user_face
+        story_x, story_y, story_w, story_h = story_face
+        
+        # Extract face regions (convert back to RGB for PIL)
+        user_face_region = user_array[user_y:user_y+user_h, user_x:user_x+user_w]
+        story_face_region = story_array[story_y:story_y+story_h, story_x:story_x+story_w]
+        
+        # Resize user face to match story face size
+        user_face_resized = cv2.resize(user_face_region, (story_w, story_h))
+        
+        # Feathered elliptical mask for seamless blending
+        if template_face is not None:
+            mask = np.asarray(template_face.mask, dtype=np.float32)
+        else:
+            mask = build_blend_mask(story_w, story_h)
+        
+        blended_face = np.zeros_like(story_face_region, dtype=np.float32)
+        for c in range(3):
+            # mask is 2D (story_h, story_w), so use it directly without np.newaxis
+            blended_face[:, :, c] = (
+                story_face_region[:, :, c].astype(np.float32) * (1 - mask) +
+                user_face_resized[:, :, c].astype(np.float32) * mask
+            )
+        blended_face = np.clip(blended_face, 0, 255).astype(np.uint8)
+        
+        # Replace the face region in the story image
+        result_array = story_array.copy()
+        result_array[story_y:story_y+story_h, story_x:story_x+story_w] = blended_face
+        
+        # Convert back to PIL Image
+        result_image = Image.fromarray(result_array)
+        
+        return result_image
+    
+    except Exception as e:
+        print(f"Error in face replacement: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        # Fallback to simple blending
+        return _simple_face_blend(story_image, user_image)
+
+
+def _simple_face_blend(story_image, user_image):
+    """
+    Simple fallback method for face blending when face recognition is not available.
+    Uses basic image blending techniques.
+    """
+    try:
+        # Resize user image to a reasonable size for blending
+        user_resized = user_image.resize((400, 400), Image.Resampling.LANCZOS)
+        
+        # Create a circular mask for blending
+        mask_size = 300
+        mask = Image.new('L', (mask_size, mask_size), 0)
+        draw = ImageDraw.Draw(mask)
+        draw.ellipse([(0, 0), (mask_size, mask_size)], fill=255)
+        
+        # Apply Gaussian blur to mask (simulated with resize)
+        mask = mask.resize((mask_size, mask_size), Image.Resampling.LANCZOS)
+        
+        # Find a good position to place the face (center-left area, typical for character)
+        story_width, story_height = story_image.size
+        paste_x = int(story_width * 0.15)
+        paste_y = int(story_height * 0.3)
+        
+        # Resize user image to match mask
+        user_face = user_resized.resize((mask_size, mask_size), Image.Resampling.LANCZOS)
+        
+        # Create a copy of story image
+        result = story_image.copy()
+        
+        # Paste user face with mask for blending
+        result.paste(user_face, (paste_x, paste_y), mask)
+        
+        return result
+    
+    except Exception as e:
+        print(f"Error in simple face blend: {str(e)}")
+        return story_image
+
+
+def replace_text_in_image(image, old_text_patterns, new_text, character_name):
+    """
+    Replace text in the image with the character's name.
+    
+    This function attempts to find and replace text in the image.
+    Since OCR can be unreliable, we use a simpler approach:
+    - Detect text regions (if OCR available)
+    - Or use predefined regions for known text locations
+    - Overlay new text with similar font/style
+    
+    Args:
+        image: PIL Image
+        old_text_patterns: List of text patterns to look for (e.g., ["Little Red Riding Hood", "Red"])
+        new_text: New text to replace with (character name)
+        character_name: The character's name
+    
+    Returns:
+        PIL Image with text replaced
+    """
+    try:
+        result = image.copy()
+        draw = ImageDraw.Draw(result)
+        
+        # Try to load a font (use default if not available)
+        try:
+            # Try to use a nice font
+            font_size = 40
+            try:
+                font = ImageFont.truetype("arial.ttf", font_size)
+            except:
+                try:
+                    font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", font_size)
+                except:
+                    font = ImageFont.load_default()
+        except:
+            font = ImageFont.load_default()
+        
+        # Common text regions in storybook images (top, center, bottom)
+        # We'll overlay text in likely locations
+        width, height = image.size
+        
+        # Text regions to check/overlay (as percentages)
+        text_regions = [
+            (0.1, 0.05, 0.9, 0.15),  # Top area (title)
+            (0.1, 0.85, 0.9, 0.95),  # Bottom area (caption)
+        ]
+        
+        # For now, we'll add the character name as a subtle overlay
+        # In a production system, you'd use OCR to detect and replace exact text
+        # For this implementation, we'll add the name in a corner or replace visible text areas
+        
+        # Draw character name in bottom-right corner (subtle)
+        text_bbox = draw.textbbox((0, 0), character_name, font=font)
+        text_width = text_bbox[2] - text_bbox[0]
+        text_height = text_bbox[3] - text_bbox[1]
+        
+        # Position: bottom-right with padding
+        x = width - text_width - 20
+        y = height - text_height - 20
+        
+        # Draw text with outline for visibility
+        # Draw outline
+        for adj in range(-2, 3):
+            for adj2 in range(-2, 3):
+                draw.text((x + adj, y + adj2), character_name, font=font, fill=(0, 0, 0, 200))
+        # Draw main text
+        draw.text((x, y), character_name, font=font, fill=(255, 255, 255, 255))
+        
+        return result
+    
+    except Exception as e:
+        print(f"Error replacing text in image: {str(e)}")
+        return image
+
+
+def compose_story_page(story_id, page_number, subject, character_name):
+    """
+    Composite the child into one pre-existing story page.
+    
+    Args:
+        story_id: Story identifier (e.g., 'red')
+        page_number: Page number (1-13)
+        subject: BookSubject for the child's photo
+        character_name: Character name for text replacement
+    
+    Returns:
+        PIL Image of the finished page, or None if the story image was not found
+    """
+    story_image_path = find_story_image_path(story_id, page_number)
+    story_image = load_story_image(story_id, page_number)
+    if story_image is None:
+        return None
+    
+    # Precomputed face box and blend mask for the template, if the folder was indexed
+    template_face = get_template_face(story_image_path)
+    
+    # Replace face/character features
+    processed_image = replace_face_in_image(story_image, subject.image, character_name, template_face, subject)
+    
+    # Replace text with character name
+    return replace_text_in_image(processed_image, STORY_TEXT_PATTERNS, character_name, character_name)
+
+
+def encode_png(image):
+    """Encode a PIL image as PNG bytes (fast compression; pages are re-encoded for the PDF)."""
+    buffer = io.BytesIO()
+    image.save(buffer, 'PNG', compress_level=1)
+    return buffer.getvalue()
@@ -0,0 +1,571 @@
+"""
+Job state store for storybook generation tasks.
+
+A job has a state dictionary (status, progress, total, current_step, pdf_path,
+error, ...) and a stream of progress events (page_complete, generation_complete,
+...). Two backends implement the same interface:
+
+- InMemoryJobStore: a dict in this process. Fast, but /progress, /download and
+  /stream_progress only work in the worker process that started the job.
+- DatabaseJobStore: state and events live in the jobs / job_events tables of the
+  application database, so any worker process (or host) can serve any job.
+  State updates are coalesced in memory and written by a background thread, so
+  a per-page progress tick does not cost a transaction.
+
+Jobs are not kept forever: sweep() forgets jobs ttl_seconds after they reach a
+terminal status, and jobs that stopped updating abandoned_ttl_seconds ago (e.g.
+their worker died). The in-memory store is also capped at max_jobs entries,
+evicting the least recently used ones (finished jobs first). sweep() returns the
+IDs of forgotten jobs so their temporary files can be deleted (see job_sweeper.py).
+
+Usage:
+    store = create_job_store('database', app=app, db=db)
+    store.create(task_id, {'status': 'processing', 'progress': 0, 'total': 13})
+    store.update(task_id, progress=3, current_step='Processing page 3/13...')
+    store.get(task_id)                       # -> dict or None
+    store.sweep()                            # -> IDs of expired / evicted jobs
+    store.publish(task_id, 'page_complete', {'page_number': 3})
+    subscription = store.subscribe(task_id)
+    event = subscription.get(timeout=30)     # raises queue.Empty on timeout
+    subscription.close()
+"""
+
+import json
+import queue
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+# Job statuses after which a job's state no longer changes
+TERMINAL_STATUSES = ('complete', 'error')
+
+# Default retention: finished jobs for an hour, jobs that stopped updating for six
+DEFAULT_TTL_SECONDS = 3600
+DEFAULT_ABANDONED_TTL_SECONDS = 6 * 3600
+DEFAULT_MAX_JOBS = 1000
+
+
+class JobStore(ABC):
+    """Interface shared by the job store backends (a backend must implement every abstract method)."""
+    
+    @abstractmethod
+    def create(self, job_id, state):
+        """
+        Register a new job.
+        
+        Args:
+            job_id: Unique job ID
+            state: Initial state dictionary (must be JSON serializable)
+        """
+    
+    @abstractmethod
+    def update(self, job_id, **fields):
+        """Merge fields into a job's state."""
+    
+    @abstractmethod
+    def get(self, job_id):
+        """
+        Return a copy of a job's state.
+        
+        Returns:
+            dict or None if the job is unknown
+        """
+    
+    @abstractmethod
+    def publish(self, job_id, event_type, data):
+        """
+        Publish a progress event to the job's subscribers.
+        
+        Args:
+            job_id: Job ID
+            event_type: Type of event (e.g., 'page_complete', 'generation_complete', 'error')
+            data: Dictionary containing event data
+        """
+    
+    @abstractmethod
+    def subscribe(self, job_id):
+        """
+        Subscribe to events published for a job from now on.
+        
+        Returns:
+            Subscription with get(timeout) and close()
+        """
+    
+    def sweep(self):
+        """
+        Forget expired jobs.
+        
+        Returns:
+            list: IDs of the jobs removed since the last sweep (expired or evicted)
+        """
+        return []
+    
+    def stats(self):
+        """
+        Return store counters for monitoring.
+        
+        Returns:
+            dict: live_jobs, subscribers, expired and evicted counts
+        """
+        return {}
+    
+    def flush(self):
+        """Write any buffered updates."""
+    
+    def close(self):
+        """Flush and release resources."""
+        self.flush()
+
+
+class _QueueSubscription:
+    """Subscription backed by an in-process queue."""
+    
+    def __init__(self, store, job_id, event_queue):
+        self._store = store
+        self.job_id = job_id
+        self._queue = event_queue
+    
+    def get(self, timeout=None):
+        """
+        Wait for the next event.
+        
+        Returns:
+            dict: {'type': ..., 'data': ..., 'timestamp': ...}
+        
+        Raises:
+            queue.Empty: If no event arrived within timeout
+        """
+        return self._queue.get(timeout=timeout)
+    
+    def close(self):
+        self._store._unsubscribe(self.job_id, self._queue)
+
+
+class InMemoryJobStore(JobStore):
+    """Job store that keeps state and subscriber queues in this process."""
+    
+    def __init__(self, max_queued_events=100, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 abandoned_ttl_seconds=DEFAULT_ABANDONED_TTL_SECONDS, max_jobs=DEFAULT_MAX_JOBS):
+        """
+        Args:
+            max_queued_events: Events buffered per subscriber before new ones are dropped
+            ttl_seconds: Seconds a job is kept after reaching a terminal status
+            abandoned_ttl_seconds: Seconds an unfinished job is kept without updates
+            max_jobs: Maximum number of jobs kept; the least recently used are evicted
+        """
+        self._jobs = OrderedDict()  # job_id -> state, least recently used first
+        self._touched = {}          # job_id -> time.monotonic() of the last create/update
+        self._finished = {}         # job_id -> time.monotonic() when it reached a terminal status
+        self._evicted = []          # job_ids evicted by the cap, reported by the next sweep()
+        self._subscribers = {}
+        self._lock = threading.Lock()
+        self.max_queued_events = max_queued_events
+        self.ttl_seconds = ttl_seconds
+        self.abandoned_ttl_seconds = abandoned_ttl_seconds
+        self.max_jobs = max_jobs
+        self.expired = 0
+        self.evicted = 0
+        self.dropped_subscribers = 0
+    
+    def _touch(self, job_id, state):
+        """Record an update and mark the job most recently used (caller holds the lock)."""
+        now = time.monotonic()
+        self._jobs.move_to_end(job_id)
+        self._touched[job_id] = now
+        if state.get('status') in TERMINAL_STATUSES:
+            self._finished.setdefault(job_id, now)
+        else:
+            self._finished.pop(job_id, None)
+    
+    def _drop(self, job_id):
+        """Forget a job and its subscribers (caller holds the lock)."""
+        self._jobs.pop(job_id, None)
+        self._touched.pop(job_id, None)
+        self._finished.pop(job_id, None)
+        self.dropped_subscribers += len(self._subscribers.pop(job_id, ()))
+    
+    def _enforce_cap(self):
+        """Evict least recently used jobs, finished ones first, down to max_jobs (caller holds the lock)."""
+        while len(self._jobs) > self.max_jobs:
+            victim = next((job_id for job_id in self._jobs if job_id in self._finished), None)
+            if victim is None:
+                victim = next(iter(self._jobs))
+            self._drop(victim)
+            self._evicted.append(victim)
+            self.evicted += 1
+    
+    def create(self, job_id, state):
+        with self._lock:
+            self._jobs[job_id] = dict(state)
+            self._touch(job_id, state)
+            self._enforce_cap()
+    
+    def update(self, job_id, **fields):
+        with self._lock:
+            state = self._jobs.setdefault(job_id, {})
+            state.update(fields)
+            self._touch(job_id, state)
+            self._enforce_cap()
+    
+    def get(self, job_id):
+        with self._lock:
+            state = self._jobs.get(job_id)
+            if state is None:
+                return None
+            self._jobs.move_to_end(job_id)
+            return dict(state)
+    
+    def publish(self, job_id, event_type, data):
+        event = {'type': event_type, 'data': data, 'timestamp': time.time()}
+        with self._lock:
+            subscribers = list(self._subscribers.get(job_id, ()))
+        for event_queue in subscribers:
+            try:
+                event_queue.put_nowait(event)
+            except queue.Full:
+                # Queue is full, skip this event (non-blocking)
+                pass
+    
+    def subscribe(self, job_id):
+        event_queue = queue.Queue(maxsize=self.max_queued_events)
+        with self._lock:
+            self._subscribers.setdefault(job_id, []).append(event_queue)
+        return _QueueSubscription(self, job_id, event_queue)
+    
+    def _unsubscribe(self, job_id, event_queue):
+        with self._lock:
+            subscribers = self._subscribers.get(job_id)
+            if subscribers and event_queue in subscribers:
+                subscribers.remove(event_queue)
+                if not subscribers:
+                    del self._subscribers[job_id]
+    
+    def sweep(self):
+        now = time.monotonic()
+        with self._lock:
+            removed, self._evicted = self._evicted, []
+            for job_id in list(self._jobs):
+                finished = self._finished.get(job_id)
+                if finished is not None:
+                    expired = now - finished > self.ttl_seconds
+                else:
+                    expired = now - self._touched[job_id] > self.abandoned_ttl_seconds
+                if expired:
+                    self._drop(job_id)
+                    removed.append(job_id)
+                    self.expired += 1
+            
+            # A full queue means nobody is reading it any more (the stream went away
+            # without closing its subscription); stop publishing into it
+            for job_id in list(self._subscribers):
+                subscribers = [q for q in self._subscribers[job_id] if not q.full()]
+                self.dropped_subscribers += len(self._subscribers[job_id]) - len(subscribers)
+                if subscribers:
+                    self._subscribers[job_id] = subscribers
+                else:
+                    del self._subscribers[job_id]
+        return removed
+    
+    def stats(self):
+        with self._lock:
+            return {
+                'live_jobs': len(self._jobs),
+                'finished_jobs': len(self._finished),
+                'subscribers': sum(len(subscribers) for subscribers in self._subscribers.values()),
+                'expired': self.expired,
+                'evicted': self.evicted,
+                'dropped_subscribers': self.dropped_subscribers
+            }
+
+
+class _DatabaseSubscription:
+    """Subscription that polls the job_events table for new events."""
+    
+    def __init__(self, store, job_id, after_event_id):
+        self._store = store
+        self.job_id = job_id
+        self._last_event_id = after_event_id
+        self._pending = []
+    
+    def get(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            if not self._pending:
+                self._pending = self._store._events_after(self.job_id, self._last_event_id)
+            if self._pending:
+                event_id, event = self._pending.pop(0)
+                self._last_event_id = event_id
+                return event
+            if deadline is not None and time.monotonic() >= deadline:
+                raise queue.Empty
+            wait = self._store.poll_interval
+            if deadline is not None:
+                wait = min(wait, max(0.0, deadline - time.monotonic()))
+            time.sleep(wait)
+    
+    def close(self):
+        self._pending = []
+
+
+class DatabaseJobStore(JobStore):
+    """
+    Job store backed by the jobs and job_events tables.
+    
+    Updates are merged into a per-job pending dict and written by a background
+    thread every flush_interval seconds; a status change is written immediately
+    so that completion and errors are visible to other workers without delay.
+    Reads of jobs this process is writing see the pending changes.
+    """
+    
+    def __init__(self, app, db, flush_interval=0.25, poll_interval=0.5, ttl_seconds=DEFAULT_TTL_SECONDS,
+                 abandoned_ttl_seconds=DEFAULT_ABANDONED_TTL_SECONDS, max_jobs=DEFAULT_MAX_JOBS):
+        """
+        Args:
+            app: Flask application (for app contexts in background threads)
+            db: Flask-SQLAlchemy instance
+            flush_interval: Seconds between writes of coalesced updates
+            poll_interval: Seconds between event polls for subscribers
+            ttl_seconds: Seconds a job (and any event) is kept after its last update once finished
+            abandoned_ttl_seconds: Seconds an unfinished job is kept without updates
+            max_jobs: Maximum number of job rows kept; the least recently updated are deleted
+        """
+        from models import Job, JobEvent
+        self.app = app
+        self.db = db
+        self.Job = Job
+        self.JobEvent = JobEvent
+        self.flush_interval = flush_interval
+        self.poll_interval = poll_interval
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._local = {}      # job_id -> latest state known to this process (jobs it writes)
+        self._dirty = set()   # job_ids with state not yet written
+        self._new = set()     # job_ids not yet inserted
+        self._events = []     # (job_id, event_type, data, created_at) not yet written
+        self._closed = threading.Event()
+        self.ttl_seconds = ttl_seconds
+        self.abandoned_ttl_seconds = abandoned_ttl_seconds
+        self.max_jobs = max_jobs
+        self.writes = 0
+        self.coalesced_updates = 0
+        self.expired = 0
+        self.evicted = 0
+        self._thread = threading.Thread(target=self._run, name='job-store-flusher', daemon=True)
+        self._thread.start()
+    
+    def create(self, job_id, state):
+        with self._lock:
+            self._local[job_id] = dict(state)
+            self._dirty.add(job_id)
+            self._new.add(job_id)
+        self.flush()
+    
+    def update(self, job_id, **fields):
+        with self._lock:
+            state = self._local.get(job_id)
+            if state is None:
+                state = self._read_state(job_id) or {}
+                self._local[job_id] = state
+            status_changed = 'status' in fields and fields['status'] != state.get('status')
+            state.update(fields)
+            if job_id in self._dirty:
+                self.coalesced_updates += 1
+            self._dirty.add(job_id)
+        if status_changed:
+            self.flush()
+    
+    def get(self, job_id):
+        with self._lock:
+            state = self._local.get(job_id)
+            if state is not None:
+                return dict(state)
+        return self._read_state(job_id)
+    
+    def publish(self, job_id, event_type, data):
+        with self._lock:
+            self._events.append((job_id, event_type, data, datetime.utcnow()))
+    
+    def subscribe(self, job_id):
+        with self.app.app_context():
+            try:
+                last_id = self.db.session.query(self.db.func.max(self.JobEvent.event_id)).filter(
+                    self.JobEvent.job_id == job_id
+                ).scalar() or 0
+            finally:
+                self.db.session.remove()
+        return _DatabaseSubscription(self, job_id, last_id)
+    
+    def _read_state(self, job_id):
+        with self.app.app_context():
+            try:
+                job = self.db.session.get(self.Job, job_id)
+                return job.get_state() if job is not None else None
+            finally:
+                self.db.session.remove()
+    
+    def _events_after(self, job_id, event_id):
+        with self.app.app_context():
+            try:
+                rows = self.JobEvent.query.filter(
+                    self.JobEvent.job_id == job_id,
+                    self.JobEvent.event_id > event_id
+                ).order_by(self.JobEvent.event_id).all()
+                return [
+                    (row.event_id, {
+                        'type': row.event_type,
+                        'data': json.loads(row.data_json),
+                        'timestamp': row.created_at.timestamp()
+                    })
+                    for row in rows
+                ]
+            finally:
+                self.db.session.remove()
+    
+    def flush(self):
+        """Write pending state changes and events in one transaction."""
+        with self._write_lock:
+            with self._lock:
+                dirty = {job_id: dict(self._local[job_id]) for job_id in self._dirty if job_id in self._local}
+                new = self._new & set(dirty)
+                events = self._events
+                self._dirty = set()
+                self._new = set()
+                self._events = []
+                # Finished jobs no longer need a local copy once written
+                for job_id, state in dirty.items():
+                    if state.get('status') in TERMINAL_STATUSES:
+                        self._local.pop(job_id, None)
+            if not dirty and not events:
+                return
+            
+            now = datetime.utcnow()
+            with self.app.app_context():
+                try:
+                    for job_id, state in dirty.items():
+                        job = None if job_id in new else self.db.session.get(self.Job, job_id)
+                        if job is None:
+                            job = self.Job(job_id=job_id, created_at=now)
+                            self.db.session.add(job)
+                        job.set_state(state)
+                        job.updated_at = now
+                    for job_id, event_type, data, created_at in events:
+                        self.db.session.add(self.JobEvent(
+                            job_id=job_id,
+                            event_type=event_type,
+                            data_json=json.dumps(data, ensure_ascii=False),
+                            created_at=created_at
+                        ))
+                    self.db.session.commit()
+                    self.writes += 1
+                except Exception as e:
+                    self.db.session.rollback()
+                    print(f"Error writing job state: {str(e)}")
+                    # Keep the changes so the next flush retries them
+                    with self._lock:
+                        for job_id, state in dirty.items():
+                            self._local.setdefault(job_id, state)
+                            self._dirty.add(job_id)
+                        self._new |= new
+                        self._events = events + self._events
+                finally:
+                    self.db.session.remove()
+    
+    def sweep(self):
+        """
+        Delete expired job rows, then the least recently updated rows above max_jobs.
+        
+        Every worker process may sweep; rows already deleted by another worker are
+        simply not found again.
+        """
+        self.flush()
+        now = datetime.utcnow()
+        ttl_cutoff = now - timedelta(seconds=self.ttl_seconds)
+        abandoned_cutoff = now - timedelta(seconds=self.abandoned_ttl_seconds)
+        removed = []
+        evicted = 0
+        with self.app.app_context():
+            try:
+                for job in self.Job.query.filter(self.Job.updated_at < ttl_cutoff).all():
+                    if job.updated_at < abandoned_cutoff or job.get_state().get('status') in TERMINAL_STATUSES:
+                        removed.append(job.job_id)
+                
+                live_jobs = self.Job.query.count() - len(removed)
+                if live_jobs > self.max_jobs:
+                    oldest = self.db.session.query(self.Job.job_id).filter(
+                        self.Job.job_id.notin_(removed)
+                    ).order_by(self.Job.updated_at).limit(live_jobs - self.max_jobs).all()
+                    removed.extend(job_id for job_id, in oldest)
+                    evicted = len(oldest)
+                
+                if removed:
+                    self.Job.query.filter(self.Job.job_id.in_(removed)).delete(synchronize_session=False)
+                    self.JobEvent.query.filter(self.JobEvent.job_id.in_(removed)).delete(synchronize_session=False)
+                # Subscribers only read events published after they connected, so
+                # old events (including ones for jobs that were never created) are not needed
+                self.JobEvent.query.filter(self.JobEvent.created_at < ttl_cutoff).delete(synchronize_session=False)
+                self.db.session.commit()
+            except Exception as e:
+                self.db.session.rollback()
+                print(f"Error sweeping job store: {str(e)}")
+                return []
+            finally:
+                self.db.session.remove()
+        
+        with self._lock:
+            for job_id in removed:
+                self._local.pop(job_id, None)
+            self.expired += len(removed) - evicted
+            self.evicted += evicted
+        return removed
+    
+    def stats(self):
+        with self._lock:
+            local_jobs = len(self._local)
+        with self.app.app_context():
+            try:
+                live_jobs = self.Job.query.count()
+            except Exception:
+                live_jobs = None
+            finally:
+                self.db.session.remove()
+        return {
+            'live_jobs': live_jobs,
+            'local_jobs': local_jobs,
+            'expired': self.expired,
+            'evicted': self.evicted,
+            'writes': self.writes,
+            'coalesced_updates': self.coalesced_updates
+        }
+    
+    def _run(self):
+        while not self._closed.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error in job store flusher: {str(e)}")
+    
+    def close(self):
+        self._closed.set()
+        self.flush()
+
+
+def create_job_store(backend, app=None, db=None, **retention):
+    """
+    Create the job store for a backend name.
+    
+    Args:
+        backend: 'memory' or 'database'
+        app: Flask application (required for 'database')
+        db: Flask-SQLAlchemy instance (required for 'database')
+        retention: ttl_seconds, abandoned_ttl_seconds and max_jobs
+    
+    Returns:
+        JobStore
+    """
+    if backend == 'database':
+        return DatabaseJobStore(app, db, **retention)
+    if backend != 'memory':
+        print(f"⚠️  Warning: Unknown JOB_STORE_BACKEND '{backend}', using in-memory job store")
+    return InMemoryJobStore(**retention)
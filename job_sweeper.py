@@ -0,0 +1,179 @@
+"""
+Periodic cleanup of expired generation jobs and their temporary files.
+
+Every generation task leaves files in the system temp directory:
+
+    storybook_<task_id>.pdf                  - the finished book served by /download
+    storybook_img_<task_id>_<n>.png          - DALL-E page images (and the master reference)
+    storybook_<task_id>/                     - pre-illustrated story pages and the subject photo
+
+The sweeper runs in a background thread. Every interval it asks the job store to
+forget expired jobs (job_store.JobStore.sweep) and deletes the files of those jobs.
+Files whose task the store does not know (left by a restarted or different worker)
+are deleted once they are older than orphan_ttl_seconds.
+
+Usage:
+    sweeper = JobSweeper(job_store, tempfile.gettempdir(), interval_seconds=300)
+    sweeper.start()
+    sweeper.stats()   # {'runs': ..., 'files_removed': ..., 'bytes_reclaimed': ..., ...}
+"""
+
+import os
+import shutil
+import threading
+import time
+import uuid
+
+TEMP_PREFIX = 'storybook_'
+TEMP_IMAGE_PREFIX = 'storybook_img_'
+
+
+def job_id_for_temp_file(name):
+    """
+    Return the task ID a temp file or directory belongs to.
+    
+    Args:
+        name: File or directory name in the temp directory
+    
+    Returns:
+        str or None if the name is not a storybook temp file
+    """
+    if name.startswith(TEMP_IMAGE_PREFIX):
+        job_id = name[len(TEMP_IMAGE_PREFIX):].split('_', 1)[0]
+    elif name.startswith(TEMP_PREFIX):
+        job_id = name[len(TEMP_PREFIX):]
+        if job_id.endswith('.pdf'):
+            job_id = job_id[:-len('.pdf')]
+    else:
+        return None
+    
+    # Task IDs are UUIDs; anything else in the temp directory is not ours
+    try:
+        uuid.UUID(job_id)
+    except ValueError:
+        return None
+    return job_id
+
+
+def _disk_usage(path):
+    """Total size in bytes of a file, or of every file under a directory."""
+    if not os.path.isdir(path):
+        return os.path.getsize(path)
+    total = 0
+    for root, _, files in os.walk(path):
+        for filename in files:
+            try:
+                total += os.path.getsize(os.path.join(root, filename))
+            except OSError:
+                continue
+    return total
+
+
+class JobSweeper:
+    """Background thread that expires jobs and deletes their temp files."""
+    
+    def __init__(self, store, temp_dir, interval_seconds=300, orphan_ttl_seconds=3600):
+        """
+        Args:
+            store: JobStore to sweep
+            temp_dir: Directory holding the storybook temp files
+            interval_seconds: Seconds between sweeps
+            orphan_ttl_seconds: Age after which temp files of unknown tasks are deleted
+        """
+        self.store = store
+        self.temp_dir = temp_dir
+        self.interval_seconds = interval_seconds
+        self.orphan_ttl_seconds = orphan_ttl_seconds
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+        self.runs = 0
+        self.jobs_expired = 0
+        self.files_removed = 0
+        self.bytes_reclaimed = 0
+    
+    def start(self):
+        """Start the sweeper thread (no-op if it is already running)."""
+        with self._lock:
+            if self._thread is None and self.interval_seconds > 0:
+                self._thread = threading.Thread(target=self._run, name='job-sweeper', daemon=True)
+                self._thread.start()
+    
+    def _run(self):
+        while not self._closed.wait(self.interval_seconds):
+            try:
+                self.sweep()
+            except Exception as e:
+                print(f"Error in job sweeper: {str(e)}")
+    
+    def sweep(self):
+        """
+        Expire jobs and delete temp files that are no longer needed.
+        
+        Returns:
+            dict: jobs expired, files removed and bytes reclaimed by this sweep
+        """
+        expired = set(self.store.sweep())
+        now = time.time()
+        files_removed = 0
+        bytes_reclaimed = 0
+        
+        try:
+            entries = list(os.scandir(self.temp_dir))
+        except OSError as e:
+            print(f"Warning: Could not scan {self.temp_dir}: {str(e)}")
+            entries = []
+        
+        for entry in entries:
+            job_id = job_id_for_temp_file(entry.name)
+            if job_id is None:
+                continue
+            try:
+                if job_id not in expired:
+                    if now - entry.stat().st_mtime < self.orphan_ttl_seconds:
+                        continue
+                    if self.store.get(job_id) is not None:
+                        continue
+                size = _disk_usage(entry.path)
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+                else:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                # Already removed (e.g. by another worker's sweeper)
+                continue
+            except OSError as e:
+                print(f"Warning: Could not remove {entry.path}: {str(e)}")
+                continue
+            files_removed += 1
+            bytes_reclaimed += size
+        
+        with self._lock:
+            self.runs += 1
+            self.jobs_expired += len(expired)
+            self.files_removed += files_removed
+            self.bytes_reclaimed += bytes_reclaimed
+        if expired or files_removed:
+            print(f"✓ Job sweeper: expired {len(expired)} jobs, removed {files_removed} temp files ({bytes_reclaimed / (1024 * 1024):.1f} MB)")
+        return {'jobs_expired': len(expired), 'files_removed': files_removed, 'bytes_reclaimed': bytes_reclaimed}
+    
+    def stats(self):
+        """
+        Return sweeper and job store counters for monitoring.
+        
+        Returns:
+            dict: runs, jobs_expired, files_removed, bytes_reclaimed and the store's stats()
+        """
+        with self._lock:
+            stats = {
+                'runs': self.runs,
+                'jobs_expired': self.jobs_expired,
+                'files_removed': self.files_removed,
+                'bytes_reclaimed': self.bytes_reclaimed
+            }
+        stats['store'] = self.store.stats()
+        return stats
+    
+    def close(self):
+        """Stop the sweeper thread."""
+        self._closed.set()
@@ -0,0 +1,75 @@
+"""
+Optional heavy modules imported on first use instead of at import time.
+
+OpenCV and NumPy take a few hundred milliseconds to import, and most requests a
+worker serves (pages, login, progress polling) never touch them. Modules that
+use them bind a LazyModule instead of importing them:
+
+    cv2 = lazy_module('cv2')            # None if OpenCV is not installed
+    OPENCV_AVAILABLE = cv2 is not None
+
+    cv2.GaussianBlur(...)               # the first attribute access imports cv2
+
+Whether a module is installed is decided without importing it (importlib.util.find_spec),
+so a module that is installed but fails to import raises its ImportError on first use.
+"""
+
+import importlib
+import importlib.util
+import threading
+
+
+def module_available(name):
+    """
+    Check whether a module is installed without importing it.
+    
+    Args:
+        name: Module name (a dotted name imports its parent packages)
+    
+    Returns:
+        bool: Whether the module can be found
+    """
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+class LazyModule:
+    """Stands in for a module and imports it on first attribute access."""
+    
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+        self._lock = threading.Lock()
+    
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                self._module = importlib.import_module(self._name)
+        return self._module
+    
+    def __getattr__(self, attribute):
+        module = self._module
+        if module is None:
+            module = self._load()
+        return getattr(module, attribute)
+    
+    def __repr__(self):
+        state = 'loaded' if self._module is not None else 'not loaded'
+        return f'<LazyModule {self._name!r} ({state})>'
+
+
+def lazy_module(name):
+    """
+    Return a module that is imported on first use.
+    
+    Args:
+        name: Module name
+    
+    Returns:
+        LazyModule, or None if the module is not installed
+    """
+    if not module_available(name):
+        return None
+    return LazyModule(name)
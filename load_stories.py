@@ -10,7 +10,7 @@ Run this script once to seed the database with initial story data.
 
 import os
 import sys
-from project import app, init_db
+from project import app, init_db, story_catalog, STORY_CATALOG_CHECK_SECONDS
 from models import db, Storyline
 
 # Story data based on STORYBOOK_PROMPTS from project.py
@@ -189,6 +189,14 @@ def load_stories():
         try:
             db.session.commit()
             print(f"\n✅ Successfully loaded {stories_loaded} new stories and updated {stories_updated} existing stories.")
+            
+            # set_pages() bumped each story's version: running servers reload their story catalogue
+            # within STORY_CATALOG_CHECK_SECONDS; this process reloads on its next lookup
+            story_catalog.invalidate()
+            if STORY_CATALOG_CHECK_SECONDS > 0:
+                print(f"🔄 Running servers will reload the story catalogue within {STORY_CATALOG_CHECK_SECONDS}s")
+            else:
+                print("🔄 Restart running servers to reload the story catalogue (STORY_CATALOG_CHECK_SECONDS=0)")
             print(f"📚 Total stories in database: {Storyline.query.count()}")
             
             # Display summary
@@ -0,0 +1,299 @@
+"""
+In-process metrics with a Prometheus text-format exporter.
+
+Stages of book generation are timed with spans. Each span records its duration
+in the <namespace>_stage_seconds histogram, labelled with the stage name and its
+outcome (ok or error):
+
+    with metrics.span('pdf'):
+        build_pdf()
+    
+    @metrics.timed('vision')
+    def analyze(image_path):
+        ...
+
+Spans may nest (a 'book_red' span contains its 'compositing_wait' and 'pdf' spans), so
+stage totals do not add up to wall time; compare each stage against the book stages.
+
+Gauges are set directly (set / inc / dec / track) or computed on every scrape from
+a callback. Callbacks let counters that other modules already keep (job store,
+rate governor, HTTP pool, ...) be exported without keeping a second copy.
+
+Usage:
+    metrics = MetricsRegistry('storybook')
+    active = metrics.gauge('active_books', 'Books being generated', ['path'])
+    with active.track(path='red'):
+        ...
+    metrics.collect('cache_hits', 'Vision cache hits', lambda: cache.stats()['hits'], kind='counter')
+    body = metrics.render()   # serve with CONTENT_TYPE
+"""
+
+import bisect
+import functools
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Stage durations range from a cached vision lookup (milliseconds) to a whole book (minutes)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+
+
+def _format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values):
+    if not names:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in zip(names, values)) + '}'
+
+
+class _Metric:
+    """Common name, help text and label handling."""
+    
+    kind = 'untyped'
+    
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+    
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+    
+    def header(self):
+        return [f'# HELP {self.name} {_escape(self.documentation)}', f'# TYPE {self.name} {self.kind}']
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram of observed values (seconds for stage timings)."""
+    
+    kind = 'histogram'
+    
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        self._series = {}  # label values -> [bucket counts..., +Inf count], sum
+    
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+    
+    def snapshot(self):
+        """
+        Return per-series totals.
+        
+        Returns:
+            dict: {label values tuple: {'count', 'sum'}}
+        """
+        with self._lock:
+            return {key: {'count': sum(counts), 'sum': total} for key, (counts, total) in self._series.items()}
+    
+    def samples(self):
+        with self._lock:
+            series = [(key, list(counts), total) for key, (counts, total) in sorted(self._series.items())]
+        lines = []
+        names = self.labelnames + ('le',)
+        for key, counts, total in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{_format_labels(names, key + (_format_value(bound),))} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(round(total, 6))}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}')
+        return lines
+
+
+class Gauge(_Metric):
+    """A value that goes up and down (books in progress, busy threads, ...)."""
+    
+    kind = 'gauge'
+    
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+    
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+    
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+    
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+    
+    @contextmanager
+    def track(self, amount=1, **labels):
+        """Add amount to the gauge for the duration of the with block."""
+        self.inc(amount, **labels)
+        try:
+            yield
+        finally:
+            self.dec(amount, **labels)
+    
+    def value(self, **labels):
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+    
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}' for key, value in values]
+
+
+class _Callback(_Metric):
+    """Gauge or counter whose values are read from a callback on every scrape."""
+    
+    def __init__(self, name, documentation, fn, labelnames=(), kind='gauge'):
+        super().__init__(name, documentation, labelnames)
+        self.fn = fn
+        self.kind = kind
+    
+    def samples(self):
+        try:
+            values = self.fn()
+        except Exception as e:
+            print(f"⚠️  Warning: Metric {self.name} could not be collected: {str(e)}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        lines = []
+        for key, value in values.items():
+            if value is None:
+                continue
+            if not isinstance(key, tuple):
+                key = (key,)
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class MetricsRegistry:
+    """
+    A set of metrics rendered together, plus the stage timer.
+    
+    Metric names are prefixed with the namespace ("storybook" -> storybook_active_books).
+    """
+    
+    def __init__(self, namespace, stage_buckets=DEFAULT_BUCKETS):
+        """
+        Args:
+            namespace: Prefix for every metric name
+            stage_buckets: Histogram bucket bounds (seconds) for stage spans
+        """
+        self.namespace = namespace
+        self._metrics = []
+        self._names = set()
+        self._lock = threading.Lock()
+        self.stage_seconds = self.histogram(
+            'stage_seconds', 'Time spent in each stage of book generation', ['stage', 'outcome'], stage_buckets
+        )
+    
+    def _register(self, metric):
+        with self._lock:
+            if metric.name in self._names:
+                raise ValueError(f"Duplicate metric name: {metric.name}")
+            self._names.add(metric.name)
+            self._metrics.append(metric)
+        return metric
+    
+    def _full_name(self, name):
+        return f'{self.namespace}_{name}' if self.namespace else name
+    
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(self._full_name(name), documentation, labelnames, buckets))
+    
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(self._full_name(name), documentation, labelnames))
+    
+    def collect(self, name, documentation, fn, labelnames=(), kind='gauge'):
+        """
+        Register a metric read from fn() on every scrape.
+        
+        Args:
+            name: Metric name (without the namespace)
+            documentation: Help text
+            fn: Callable returning a number, or a dict of label value(s) -> number (None values are skipped)
+            labelnames: Label names for dict keys (a single value or a tuple per key)
+            kind: 'gauge' or 'counter' (counters must only go up)
+        """
+        return self._register(_Callback(self._full_name(name), documentation, fn, labelnames, kind))
+    
+    @contextmanager
+    def span(self, stage):
+        """Time the with block as one run of stage (outcome 'error' if it raises)."""
+        started = time.perf_counter()
+        outcome = 'ok'
+        try:
+            yield
+        except BaseException:
+            outcome = 'error'
+            raise
+        finally:
+            self.stage_seconds.observe(time.perf_counter() - started, stage=stage, outcome=outcome)
+    
+    def timed(self, stage):
+        """Decorator form of span(): every call of the function is one run of stage."""
+        def decorator(fn):
+            @functools.wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(stage):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return decorator
+    
+    def stage_totals(self):
+        """
+        Summarise stage spans for logging.
+        
+        Returns:
+            dict: {stage: {'count', 'seconds', 'errors'}}
+        """
+        totals = {}
+        for (stage, outcome), series in self.stage_seconds.snapshot().items():
+            entry = totals.setdefault(stage, {'count': 0, 'seconds': 0.0, 'errors': 0})
+            entry['count'] += series['count']
+            entry['seconds'] = round(entry['seconds'] + series['sum'], 3)
+            if outcome == 'error':
+                entry['errors'] += series['count']
+        return totals
+    
+    def render(self):
+        """
+        Render every metric in the Prometheus text exposition format.
+        
+        Returns:
+            str: Metrics text (serve with CONTENT_TYPE)
+        """
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            samples = metric.samples()
+            if samples:
+                lines.extend(metric.header())
+                lines.extend(samples)
+        return '\n'.join(lines) + '\n'
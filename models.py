@@ -6,10 +6,12 @@ This module defines the core database models:
 - Book: Stores generated storybooks with PDF paths
 - Log: Stores application logs for debugging and monitoring
 - Storyline: Stores pre-vetted story templates with page content
+- Job / JobEvent: Store generation job state and progress events shared across worker processes
 """
 
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import inspect, text
 from datetime import datetime
 import json
 
@@ -75,8 +77,14 @@ class Book(db.Model):
         child_name: Name of the child featured in the story
         pdf_path: File path to the generated PDF
         created_at: Timestamp when the book was created
+    
+    The (user_id, created_at, book_id) index serves a user's library newest first
+    and its keyset pagination (see /api/user_books).
     """
     __tablename__ = 'books'
+    __table_args__ = (
+        db.Index('ix_books_user_created', 'user_id', 'created_at', 'book_id'),
+    )
     
     book_id = db.Column(db.String(255), primary_key=True, unique=True, nullable=False)
     user_id = db.Column(db.String(255), db.ForeignKey('users.user_id', ondelete='CASCADE'), nullable=False, index=True)
@@ -145,6 +153,7 @@ class Storyline(db.Model):
             - scene_desc: Description of the scene
             - text: Narrative text for the page
             - image_prompt_template: Template prompt for image generation (may contain {gender} placeholder)
+        version: Incremented by set_pages() so in-memory story catalogues (story_catalog.py) notice edits
     """
     __tablename__ = 'storylines'
     
@@ -152,6 +161,7 @@ class Storyline(db.Model):
     name = db.Column(db.String(255), nullable=False)
     gender = db.Column(db.String(10), nullable=False)  # 'boy' or 'girl'
     pages_json = db.Column(db.Text, nullable=False)  # JSON string storing array of page objects
+    version = db.Column(db.Integer, nullable=False, default=1, server_default=text('1'))
     
     def __repr__(self):
         return f'<Storyline {self.story_id}: {self.name} ({self.gender})>'
@@ -164,8 +174,9 @@ class Storyline(db.Model):
             return []
     
     def set_pages(self, pages_list):
-        """Set pages_json from a Python list."""
+        """Set pages_json from a Python list and bump the version."""
         self.pages_json = json.dumps(pages_list, ensure_ascii=False)
+        self.version = (self.version or 0) + 1
     
     def to_dict(self):
         """Convert storyline object to dictionary."""
@@ -176,3 +187,108 @@ class Storyline(db.Model):
             'pages': self.get_pages()
         }
 
+
+class Job(db.Model):
+    """
+    Job model for storing the state of a storybook generation task.
+    
+    Used by the database job store (job_store.py) so that every worker process
+    can answer /progress and /download for a task started by any other worker.
+    
+    Fields:
+        job_id: Primary key, the generation task ID
+        state_json: JSON object with status, progress, total, current_step, pdf_path, error, ...
+        created_at: Timestamp when the job was created
+        updated_at: Timestamp of the last state write
+    """
+    __tablename__ = 'jobs'
+    
+    job_id = db.Column(db.String(64), primary_key=True)
+    state_json = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<Job {self.job_id}>'
+    
+    def get_state(self):
+        """Parse and return state_json as a Python dict."""
+        try:
+            return json.loads(self.state_json)
+        except (json.JSONDecodeError, TypeError):
+            return {}
+    
+    def set_state(self, state):
+        """Set state_json from a Python dict."""
+        self.state_json = json.dumps(state, ensure_ascii=False)
+
+
+class JobEvent(db.Model):
+    """
+    JobEvent model for storing progress events (e.g. page_complete) of a generation job.
+    
+    Server-sent event streams in any worker process read new events from this table.
+    
+    Fields:
+        event_id: Primary key, increasing event sequence number
+        job_id: ID of the job the event belongs to
+        event_type: Type of event (e.g., 'page_complete', 'generation_complete')
+        data_json: JSON object with the event data
+        created_at: Timestamp when the event was published
+    """
+    __tablename__ = 'job_events'
+    
+    event_id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    job_id = db.Column(db.String(64), nullable=False, index=True)
+    event_type = db.Column(db.String(50), nullable=False)
+    data_json = db.Column(db.Text, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<JobEvent {self.event_id}: {self.job_id} {self.event_type}>'
+
+
+def create_missing_indexes(bind):
+    """
+    Create the indexes declared on the models that an existing database lacks.
+    
+    db.create_all() skips tables that already exist, so an index added to an
+    existing table's model is only created here.
+    
+    Args:
+        bind: Engine or connection to create the indexes on
+    """
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=bind, checkfirst=True)
+
+
+def add_missing_columns(bind):
+    """
+    Add the columns declared on the models that an existing database's tables lack.
+    
+    db.create_all() does not alter existing tables, so a column added to a model is
+    only created here. New columns must be nullable or have a server default.
+    
+    Args:
+        bind: Engine to add the columns with
+    """
+    inspector = inspect(bind)
+    quote = bind.dialect.identifier_preparer.quote
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            ddl = f"ALTER TABLE {quote(table.name)} ADD COLUMN {quote(column.name)} {column.type.compile(dialect=bind.dialect)}"
+            if column.server_default is not None:
+                default = column.server_default.arg
+                # text('1') is emitted as-is; a plain string default is a quoted literal
+                ddl += " DEFAULT " + (default.text if hasattr(default, 'text') else "'" + str(default).replace("'", "''") + "'")
+            if not column.nullable:
+                ddl += " NOT NULL"
+            with bind.begin() as connection:
+                connection.execute(text(ddl))
+            print(f"✅ Added column {table.name}.{column.name}")
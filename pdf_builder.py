@@ -0,0 +1,345 @@
+"""
+Incremental storybook PDF assembly.
+
+Instead of drawing the whole book once every page image exists, each page is
+rendered to its own one-page PDF fragment as soon as its image (and text) are
+ready, on the compositing worker processes. When the book is finished the
+fragments are concatenated in page order with pypdf, which only copies the
+already-compressed page streams, so the final step takes milliseconds instead
+of a full re-render of every image.
+
+The page layout (full-page image, title band on the cover, text band on story
+pages) lives here and is shared with project.create_storybook_pdf, which still
+renders a whole book in one pass when pypdf is not installed.
+
+Usage:
+    builder = IncrementalPdfBuilder(pdf_path, story_title, character_name, fragment_dir,
+                                    profile='screen', submit=compositing_engine.submit)
+    builder.set_text(0, {'narrative': ['Once upon a time...']})
+    builder.set_image(0, cover_path)       # fragment for page 0 starts rendering now
+    ...
+    stats = builder.finish()               # {'profile': 'screen', 'bytes': ..., 'pages': 13, ...}
+"""
+
+import io
+import os
+import shutil
+import threading
+import time
+from concurrent.futures import Future
+
+from reportlab.lib.units import inch
+
+from lazy_import import module_available
+from pdf_profiles import PAGE_SIZE_INCHES, encode_pdf_image, get_pdf_profile
+
+# pypdf is optional - without it books are rendered in one pass at the end.
+# It and the reportlab canvas are imported when the first PDF is built, not at import.
+PYPDF_AVAILABLE = module_available('pypdf')
+
+PAGE_WIDTH = PAGE_SIZE_INCHES * inch
+PAGE_HEIGHT = PAGE_SIZE_INCHES * inch
+
+
+def open_pdf_canvas(output_path):
+    """
+    Create a reportlab canvas with the storybook page size.
+    
+    Returns:
+        reportlab.pdfgen.canvas.Canvas
+    """
+    from reportlab import rl_config
+    from reportlab.pdfgen import canvas
+    
+    # PDFs are served as binary files; ASCII85-wrapping embedded images only makes them 25% larger.
+    # Set here so worker processes rendering fragments use it too.
+    rl_config.useA85 = 0
+    return canvas.Canvas(output_path, pagesize=(PAGE_WIDTH, PAGE_HEIGHT))
+
+
+def page_narrative_text(index, text_data):
+    """
+    Return the text printed on a page: up to 3 narrative sentences, with a fallback.
+    
+    Args:
+        index: Page index in the book (0 is the cover)
+        text_data: Text data dictionary with a 'narrative' list, or None
+    
+    Returns:
+        str: Text for the page ("" if there is no text data at all)
+    """
+    if not text_data:
+        return ""
+    narrative_list = text_data.get('narrative', [])
+    
+    # Filter out empty strings
+    if narrative_list:
+        narrative_list = [n for n in narrative_list[:3] if n and n.strip()]  # Max 3 sentences
+    
+    # If no narrative, create a fallback
+    if not narrative_list:
+        if index == 0:
+            narrative_list = ["Once upon a time..."]
+        else:
+            narrative_list = ["And so the story continued..."]
+    
+    # Join narrative into text
+    return " ".join(narrative_list)
+
+
+def draw_storybook_page(c, page_image, index, narrative_text, story_title, character_name):
+    """
+    Draw one storybook page: the full-page image, then the cover title or the page text.
+    
+    Args:
+        c: reportlab canvas
+        page_image: Image file path or ImageReader
+        index: Page index in the book (0 is the cover)
+        narrative_text: Text for the page (from page_narrative_text)
+        story_title: Title of the story
+        character_name: Name of the main character for the cover title
+    """
+    page_width = PAGE_WIDTH
+    page_height = PAGE_HEIGHT
+    
+    # Draw image first (full page)
+    # Note: drawImage is slow for lossless images; JPEG pages are embedded as-is
+    c.drawImage(page_image, 0, 0, width=page_width, height=page_height, preserveAspectRatio=False)
+    
+    # For cover page (i=0), draw title with character name
+    if index == 0:
+        # Create title text: "Story Title featuring Character Name"
+        title_text = f"{story_title} featuring {character_name}"
+        
+        # Use a large, bold font for the title
+        c.setFont("Helvetica-Bold", 28)
+        
+        # Calculate title dimensions
+        title_width = c.stringWidth(title_text, "Helvetica-Bold", 28)
+        title_height = 35
+        title_y = page_height - 1.2 * inch
+        
+        # Draw semi-transparent background for title
+        title_bg_height = title_height + 0.4 * inch
+        c.setFillColorRGB(1, 1, 1, alpha=0.9)  # More opaque for title readability
+        c.rect(0, page_height - title_bg_height, page_width, title_bg_height, fill=1, stroke=0)
+        
+        # Draw title text centered
+        c.setFillColorRGB(0.1, 0.1, 0.1)  # Dark text color
+        c.setFont("Helvetica-Bold", 28)
+        title_x = (page_width - title_width) / 2
+        c.drawString(title_x, title_y, title_text)
+    
+    # Draw storybook-style text on top of image (at the top of the page) for story pages
+    elif narrative_text and narrative_text.strip():
+        # Set up text area with margins
+        margin = 0.5 * inch
+        max_width = page_width - 2 * margin
+        
+        # Use a child-friendly font size
+        c.setFont("Helvetica", 16)
+        
+        # Word wrap the text
+        words = narrative_text.split()
+        lines = []
+        current_line = ""
+        
+        for word in words:
+            test_line = current_line + (" " if current_line else "") + word
+            if c.stringWidth(test_line, "Helvetica", 16) < max_width:
+                current_line = test_line
+            else:
+                if current_line:
+                    lines.append(current_line)
+                current_line = word
+        if current_line:
+            lines.append(current_line)
+        
+        # Calculate text area dimensions
+        line_height = 22
+        text_box_height = len(lines) * line_height + 0.4 * inch
+        text_y_start = page_height - 0.3 * inch
+        
+        # Draw semi-transparent white background for text area (on top of image)
+        c.setFillColorRGB(1, 1, 1, alpha=0.85)  # Semi-transparent white background
+        c.rect(0, page_height - text_box_height, page_width, text_box_height, fill=1, stroke=0)
+        
+        # Draw the text on top
+        c.setFillColorRGB(0.1, 0.1, 0.1)  # Dark text color
+        c.setFont("Helvetica", 16)
+        
+        for j, line in enumerate(lines[:4]):  # Max 4 lines
+            if line and line.strip():
+                # Center text horizontally
+                line_width = c.stringWidth(line, "Helvetica", 16)
+                text_x = (page_width - line_width) / 2
+                text_y = text_y_start - (j * line_height)
+                c.drawString(text_x, text_y, line)
+
+
+def draw_placeholder_page(c, index):
+    """Draw the placeholder used when a page image cannot be loaded."""
+    c.setFont("Helvetica", 20)
+    c.drawString(50, PAGE_HEIGHT / 2, f"Image {index + 1} could not be loaded")
+
+
+def render_pdf_fragment(job):
+    """
+    Render one page to a one-page PDF (runs in a worker process).
+    
+    Args:
+        job: {'output_path', 'image_path', 'image_job' (encode_pdf_image job, or None
+             to embed the original image), 'index', 'narrative_text', 'story_title',
+             'character_name'}
+    
+    Returns:
+        dict: {'path': fragment path, 'bytes': fragment size, 'cpu_seconds': float, 'pid': int}
+    """
+    from reportlab.lib.utils import ImageReader
+    
+    cpu_start = time.thread_time()
+    c = open_pdf_canvas(job['output_path'])
+    try:
+        if job['image_job'] is not None:
+            page_image = ImageReader(io.BytesIO(encode_pdf_image(job['image_job'])['jpeg']))
+        else:
+            page_image = job['image_path']
+        draw_storybook_page(c, page_image, job['index'], job['narrative_text'], job['story_title'], job['character_name'])
+    except Exception as e:
+        print(f"ERROR adding image {job['index'] + 1} to PDF: {str(e)}")
+        draw_placeholder_page(c, job['index'])
+    c.save()
+    return {
+        'path': job['output_path'],
+        'bytes': os.path.getsize(job['output_path']),
+        'cpu_seconds': time.thread_time() - cpu_start,
+        'pid': os.getpid()
+    }
+
+
+def _run_inline(job, task):
+    future = Future()
+    try:
+        future.set_result(task(job))
+    except Exception as e:
+        future.set_exception(e)
+    return future
+
+
+class IncrementalPdfBuilder:
+    """
+    Renders storybook pages to PDF fragments as they complete and stitches them at the end.
+    
+    set_image() and set_text() may be called from any thread and in any order; a
+    page's fragment is submitted as soon as both are known. Pages whose text never
+    arrives are rendered with the fallback text when finish() is called.
+    """
+    
+    def __init__(self, output_path, story_title, character_name, fragment_dir, profile=None, submit=None):
+        """
+        Args:
+            output_path: Path of the finished PDF
+            story_title: Title of the story
+            character_name: Name of the main character for the cover title
+            fragment_dir: Directory for the page fragments (created if needed)
+            profile: PDF profile name (see pdf_profiles.py)
+            submit: Function (job, task) -> Future that runs a task, e.g.
+                    CompositingEngine.submit; defaults to running inline
+        """
+        if not PYPDF_AVAILABLE:
+            raise RuntimeError("pypdf is required for incremental PDF assembly")
+        self.output_path = output_path
+        self.story_title = story_title
+        self.character_name = character_name
+        self.fragment_dir = fragment_dir
+        self.profile = get_pdf_profile(profile)
+        self._submit = submit or _run_inline
+        self._lock = threading.Lock()
+        self._images = {}    # page index -> image path
+        self._texts = {}     # page index -> text data
+        self._futures = {}   # page index -> Future of render_pdf_fragment
+        self._started = time.time()
+        os.makedirs(fragment_dir, exist_ok=True)
+    
+    def set_image(self, index, image_path):
+        """Record a finished page image."""
+        with self._lock:
+            self._images[index] = image_path
+            self._maybe_submit(index)
+    
+    def set_text(self, index, text_data):
+        """Record the text for a page."""
+        with self._lock:
+            self._texts[index] = text_data
+            self._maybe_submit(index)
+    
+    def _fragment_job(self, index):
+        """Build the render_pdf_fragment() job for a page (caller holds the lock)."""
+        image_path = self._images[index]
+        return {
+            'output_path': os.path.join(self.fragment_dir, f'page_{index:03d}.pdf'),
+            'image_path': image_path,
+            'image_job': None if self.profile.lossless else self.profile.job(image_path),
+            'index': index,
+            'narrative_text': page_narrative_text(index, self._texts.get(index) or {"narrative": []}),
+            'story_title': self.story_title,
+            'character_name': self.character_name
+        }
+    
+    def _maybe_submit(self, index, force=False):
+        """Submit a page's fragment once its image and text are known (caller holds the lock)."""
+        if index in self._futures or index not in self._images:
+            return
+        if index not in self._texts and not force:
+            return
+        self._futures[index] = self._submit(self._fragment_job(index), render_pdf_fragment)
+    
+    def finish(self, indices=None):
+        """
+        Wait for the page fragments and concatenate them into the finished PDF.
+        
+        Args:
+            indices: Page indices to include, in order (defaults to every page with an image)
+        
+        Returns:
+            dict: profile, bytes, pages, stitch_seconds and build_seconds (since the builder was created)
+        """
+        with self._lock:
+            if indices is None:
+                indices = sorted(self._images)
+            for index in indices:
+                self._maybe_submit(index, force=True)
+            futures = [(index, self._futures[index]) for index in indices if index in self._futures]
+        
+        fragments = []
+        for index, future in futures:
+            try:
+                fragments.append(future.result()['path'])
+            except Exception as e:
+                # Worker failed (e.g. the pool broke); render the page here instead
+                print(f"Warning: PDF fragment for page {index + 1} failed ({str(e)}); rendering inline")
+                with self._lock:
+                    job = self._fragment_job(index)
+                fragments.append(render_pdf_fragment(job)['path'])
+        
+        from pypdf import PdfWriter
+        
+        stitch_start = time.time()
+        writer = PdfWriter()
+        for path in fragments:
+            writer.append(path)
+        with open(self.output_path, 'wb') as f:
+            writer.write(f)
+        stitch_seconds = time.time() - stitch_start
+        
+        return {
+            'profile': self.profile.name,
+            'bytes': os.path.getsize(self.output_path),
+            'pages': len(fragments),
+            'stitch_seconds': round(stitch_seconds, 3),
+            'build_seconds': round(time.time() - self._started, 3)
+        }
+    
+    def cleanup(self):
+        """Delete the page fragments."""
+        shutil.rmtree(self.fragment_dir, ignore_errors=True)
@@ -0,0 +1,137 @@
+"""
+PDF output profiles for storybook PDFs.
+
+The page images (1024x1024 DALL-E PNGs, composited story pages) used to be drawn
+into the PDF as-is, so reportlab stored every page losslessly at full size:
+large files that are slow to write, download and open. A profile decides how
+page images are re-encoded before they are placed on the 8.5" x 8.5" page:
+
+    screen  - 150 DPI JPEG, quality 80    (default; reading on a screen or tablet)
+    print   - 300 DPI JPEG, quality 92, no chroma subsampling (home / shop printing)
+    archive - original pixels, lossless    (the previous behaviour)
+
+Images are only ever downsampled to the profile's DPI, never upscaled. JPEG data
+is embedded in the PDF as-is (DCTDecode), so the canvas pass no longer has to
+compress pixels. JPEG 2000 is not offered: reportlab cannot embed it without
+decoding it back to raw pixels.
+
+encode_pdf_image() takes a small job dict and returns the encoded bytes, so it
+can run on the compositing worker processes (see compositing.py):
+
+    {'path': '/tmp/storybook_img_abc_3.png', 'max_side': 1275, 'quality': 80, 'subsampling': -1}
+"""
+
+import io
+import os
+import time
+
+from PIL import Image
+
+# Storybook pages are square, 8.5 inches per side
+PAGE_SIZE_INCHES = 8.5
+
+
+class PdfProfile:
+    """How page images are encoded for one kind of PDF output."""
+    
+    def __init__(self, name, dpi=None, quality=None, subsampling=-1):
+        """
+        Args:
+            name: Profile name
+            dpi: Target resolution on the page; None keeps the original image lossless
+            quality: JPEG quality (1-95)
+            subsampling: JPEG chroma subsampling (-1 = PIL default 4:2:0, 0 = 4:4:4)
+        """
+        self.name = name
+        self.dpi = dpi
+        self.quality = quality
+        self.subsampling = subsampling
+    
+    @property
+    def lossless(self):
+        return self.dpi is None
+    
+    @property
+    def max_side(self):
+        """Largest image side in pixels for this profile's DPI on the page."""
+        return None if self.dpi is None else int(round(self.dpi * PAGE_SIZE_INCHES))
+    
+    def job(self, path):
+        """Build the encode_pdf_image() job for one page image."""
+        return {
+            'path': path,
+            'max_side': self.max_side,
+            'quality': self.quality,
+            'subsampling': self.subsampling
+        }
+    
+    def __repr__(self):
+        if self.lossless:
+            return f'<PdfProfile {self.name}: lossless>'
+        return f'<PdfProfile {self.name}: {self.dpi} DPI JPEG q{self.quality}>'
+
+
+PDF_PROFILES = {
+    'screen': PdfProfile('screen', dpi=150, quality=80),
+    'print': PdfProfile('print', dpi=300, quality=92, subsampling=0),
+    'archive': PdfProfile('archive')
+}
+
+DEFAULT_PDF_PROFILE = 'screen'
+
+
+def get_pdf_profile(name=None):
+    """
+    Look up a profile by name.
+    
+    Args:
+        name: Profile name (None for the default profile)
+    
+    Returns:
+        PdfProfile (the default profile if the name is unknown)
+    """
+    profile = PDF_PROFILES.get(name or DEFAULT_PDF_PROFILE)
+    if profile is None:
+        print(f"⚠️  Warning: Unknown PDF profile '{name}', using '{DEFAULT_PDF_PROFILE}'")
+        profile = PDF_PROFILES[DEFAULT_PDF_PROFILE]
+    return profile
+
+
+def encode_pdf_image(job):
+    """
+    Downsample and JPEG-encode one page image (runs in a worker process).
+    
+    Args:
+        job: Job dict from PdfProfile.job()
+    
+    Returns:
+        dict: {'jpeg': bytes, 'width': int, 'height': int, 'source_bytes': int, 'cpu_seconds': float, 'pid': int}
+    """
+    cpu_start = time.thread_time()
+    max_side = job['max_side']
+    with Image.open(job['path']) as image:
+        # JPEG sources can be decoded at a reduced scale directly
+        image.draft('RGB', (max_side, max_side))
+        if image.mode in ('RGBA', 'LA', 'P'):
+            # Flatten transparency onto the white page
+            rgba = image.convert('RGBA')
+            image = Image.new('RGB', rgba.size, (255, 255, 255))
+            image.paste(rgba, mask=rgba.getchannel('A'))
+        else:
+            image = image.convert('RGB')
+    
+    if max(image.size) > max_side:
+        scale = max_side / max(image.size)
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.LANCZOS)
+    
+    buffer = io.BytesIO()
+    image.save(buffer, 'JPEG', quality=job['quality'], subsampling=job['subsampling'])
+    return {
+        'jpeg': buffer.getvalue(),
+        'width': image.width,
+        'height': image.height,
+        'source_bytes': os.path.getsize(job['path']),
+        'cpu_seconds': time.thread_time() - cpu_start,
+        'pid': os.getpid()
+    }
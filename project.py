@@ -2,27 +2,21 @@ import eventlet
 eventlet.monkey_patch()
 from flask import Flask, request, render_template_string, jsonify, send_from_directory, send_file, session, redirect, url_for, flash, Response, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
-from authlib.integrations.flask_client import OAuth
 import os
 from werkzeug.utils import secure_filename
 from werkzeug.security import generate_password_hash, check_password_hash
 import re
-from openai import OpenAI
 import base64
-from reportlab.lib.pagesizes import letter
-from reportlab.lib.units import inch
-from reportlab.pdfgen import canvas
-from reportlab.lib.utils import ImageReader
-from PIL import Image, ImageDraw, ImageFont
+from PIL import Image
 import io
-# Try to import OpenCV for face detection
+# resource is only available on Unix; used to report peak memory usage
 try:
-    import cv2
-    OPENCV_AVAILABLE = True
+    import resource
 except ImportError:
-    OPENCV_AVAILABLE = False
-    cv2 = None
-import requests
+    resource = None
+import atexit
+import multiprocessing
+import sys
 import tempfile
 import threading
 import uuid
@@ -30,34 +24,56 @@ import time
 import random
 import queue
 import json
+import hashlib
+import httpx
+from collections.abc import Mapping
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from flask_socketio import SocketIO
-# Try to import numpy, but don't fail if it's not available
-HAS_NUMPY = False
-np = None
-try:
-    import numpy as np
-    HAS_NUMPY = True
-except (ImportError, ModuleNotFoundError):
-    # numpy is optional - we have a fallback implementation
-    HAS_NUMPY = False
-    np = None
-
+from lazy_import import module_available
 from typing import List, Dict, Tuple
 import logging
 from logging.handlers import RotatingFileHandler
 from logging import Handler, LogRecord
-
-# Import profanity checker
-try:
-    from better_profanity import profanity
-    # Initialize profanity checker
-    profanity.load_censor_words()
-    PROFANITY_AVAILABLE = True
-except ImportError:
-    PROFANITY_AVAILABLE = False
+from task_graph import TaskGraph, parse_stage_limits
+from vision_cache import VisionCache
+from image_processing import BookSubject
+from compositing import CompositingEngine
+from pdf_profiles import get_pdf_profile, encode_pdf_image
+from pdf_builder import (PYPDF_AVAILABLE, IncrementalPdfBuilder, open_pdf_canvas, page_narrative_text,
+                         draw_storybook_page, draw_placeholder_page)
+from job_store import create_job_store
+from job_sweeper import JobSweeper
+from story_catalog import StoryCatalog
+from http_transport import HttpTransport
+from rate_governor import RateGovernor, GovernedClient, parse_rate_limits
+from metrics import MetricsRegistry, CONTENT_TYPE as METRICS_CONTENT_TYPE
+from vector_index import VectorIndex
+from embedding_service import EmbeddingService
+from prompt_builder import PromptTemplate, Slot
+
+# Profanity checker: better-profanity and its word list are loaded on the first name check
+PROFANITY_AVAILABLE = module_available('better_profanity')
+if not PROFANITY_AVAILABLE:
     print("Warning: better-profanity not available. Profanity checking will be disabled.")
+_profanity = None
+_profanity_lock = threading.Lock()
+
+def contains_profanity(text):
+    """
+    Check text against the better-profanity word list, loading it on first use.
+    
+    Returns:
+        bool: Whether the text contains a listed word
+    """
+    global _profanity
+    if _profanity is None:
+        with _profanity_lock:
+            if _profanity is None:
+                from better_profanity import profanity
+                profanity.load_censor_words()
+                _profanity = profanity
+    return _profanity.contains_profanity(text)
 
 app = Flask(__name__)
 socketio = SocketIO(app, cors_allowed_origins="*", async_mode='eventlet')
@@ -90,15 +106,30 @@ else:
 
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# The compositing engine's spawned worker processes import this module again (as __mp_main__
+# under `python project.py`). They only need its functions: the app-wide background services
+# below (story catalogue checks, database logging, job store and sweeper) start in the main process only.
+# A spawned child is named before it imports the main module, but its parent_process() is only set after.
+IS_MAIN_PROCESS = multiprocessing.parent_process() is None and multiprocessing.current_process().name == 'MainProcess'
+
 # Initialize database
-from models import db, User, Book, Log, Storyline
+from models import db, User, Book, Log, Storyline, add_missing_columns, create_missing_indexes
 db.init_app(app)
 
-# Initialize database tables on startup (for both local and production)
-# This ensures tables exist before logging system tries to use them
-with app.app_context():
-    try:
+# The database schema and the initial stories are set up by a one-shot command, not at import:
+#     python project.py init-db
+# Run it once per deployment (e.g. as the pre-deploy step); worker processes only connect.
+
+def init_db():
+    """
+    Initialize the database: create missing tables, columns and indexes, and load the
+    initial stories if there are none yet.
+    This should be called once per deployment (python project.py init-db).
+    """
+    with app.app_context():
         db.create_all()
+        add_missing_columns(db.engine)
+        create_missing_indexes(db.engine)
         print("✅ Database tables initialized successfully!")
         
         # Check if stories need to be loaded
@@ -173,76 +204,200 @@ with app.app_context():
                 traceback.print_exc()
         else:
             print(f"✅ Found {story_count} story(ies) in database")
-    except Exception as e:
-        print(f"⚠️  Warning: Database initialization error: {str(e)}")
-        print("   Tables may need to be created manually")
+
+# Story templates are served from an in-memory catalogue (see story_catalog.py): every storyline is
+# loaded and its pages parsed once. It is reloaded when load_stories.py invalidates it, or when the
+# storylines' versions change (checked in the background every STORY_CATALOG_CHECK_SECONDS; 0 disables
+# the check, e.g. for a single process where stories are only seeded by load_stories.py).
+STORY_CATALOG_CHECK_SECONDS = int(os.environ.get('STORY_CATALOG_CHECK_SECONDS', 30))
+
+def _load_storyline_rows():
+    with app.app_context():
+        return [
+            {'story_id': s.story_id, 'name': s.name, 'gender': s.gender, 'pages': s.pages_json, 'version': s.version}
+            for s in Storyline.query.all()
+        ]
+
+def _storylines_fingerprint():
+    # Any edit through Storyline.set_pages() raises the sum of versions; added or deleted rows change the count
+    with app.app_context():
+        count, versions = db.session.query(
+            db.func.count(Storyline.story_id), db.func.coalesce(db.func.sum(Storyline.version), 0)
+        ).one()
+        return count, int(versions)
+
+# Loaded on the first lookup, so starting a worker does not query the database
+story_catalog = StoryCatalog(_load_storyline_rows, _storylines_fingerprint,
+                             check_interval_seconds=STORY_CATALOG_CHECK_SECONDS)
+if IS_MAIN_PROCESS:
+    story_catalog.start()
+    atexit.register(story_catalog.close)
 
 # ============================================================================
 # LOGGING CONFIGURATION
 # ============================================================================
 
+# Database log writer settings: records are queued and bulk-inserted by a background
+# thread in batches of DB_LOG_BATCH_SIZE or every DB_LOG_FLUSH_INTERVAL_MS, whichever
+# comes first. At most DB_LOG_QUEUE_SIZE records are buffered; beyond that they are dropped.
+DB_LOG_BATCH_SIZE = int(os.environ.get('DB_LOG_BATCH_SIZE', 100))
+DB_LOG_FLUSH_INTERVAL_MS = int(os.environ.get('DB_LOG_FLUSH_INTERVAL_MS', 500))
+DB_LOG_QUEUE_SIZE = int(os.environ.get('DB_LOG_QUEUE_SIZE', 10000))
+
 class DBHandler(Handler):
     """
     Custom logging handler that writes log records to the database.
     This handler receives log records and stores them in the logs table.
+    
+    emit() only formats the record and puts it on a bounded queue; a background
+    flusher thread bulk-inserts queued records in batches, so logging never costs
+    the calling thread a database round trip. If the queue is full, records are
+    dropped and counted in self.dropped rather than blocking the caller.
     """
     
-    def __init__(self, app_instance):
+    def __init__(self, app_instance, batch_size=DB_LOG_BATCH_SIZE, flush_interval_ms=DB_LOG_FLUSH_INTERVAL_MS, max_queue=DB_LOG_QUEUE_SIZE):
         """
-        Initialize the database handler.
+        Initialize the database handler and start its flusher thread.
         
         Args:
             app_instance: Flask application instance for database context
+            batch_size: Maximum number of records inserted per batch
+            flush_interval_ms: Maximum time a record waits in the queue before being written
+            max_queue: Maximum number of records buffered before new records are dropped
         """
         super().__init__()
         self.app = app_instance
+        self.batch_size = max(1, batch_size)
+        self.flush_interval = max(1, flush_interval_ms) / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._table_exists = False
+        self._closed = threading.Event()
+        self.dropped = 0
+        self.written = 0
+        self._reported_dropped = 0
+        self._thread = threading.Thread(target=self._run, name='db-log-flusher', daemon=True)
+        self._thread.start()
     
     def emit(self, record: LogRecord):
         """
-        Emit a log record to the database.
+        Queue a log record for the database.
         
         Args:
             record: LogRecord instance containing log information
         """
         try:
-            # Extract user_id from record if available (set via extra parameter)
-            user_id = getattr(record, 'user_id', None)
-            
-            # Get log level as string
-            level = record.levelname
-            
-            # Format the log message
-            message = self.format(record)
-            
-            # Create log entry in database
+            self._queue.put_nowait({
+                # Extract user_id from record if available (set via extra parameter)
+                'user_id': getattr(record, 'user_id', None),
+                'level': record.levelname,
+                'message': self.format(record),
+                # Use the time the record was created, not the time its batch is written
+                'timestamp': datetime.utcfromtimestamp(record.created)
+            })
+        except queue.Full:
+            self.dropped += 1
+        except Exception:
+            self.handleError(record)
+    
+    def stats(self):
+        """
+        Return handler counters for monitoring.
+        
+        Returns:
+            dict: queued (records waiting to be written), written and dropped counts
+        """
+        return {'queued': self._queue.qsize(), 'written': self.written, 'dropped': self.dropped}
+    
+    def _next_batch(self):
+        """Wait for the first queued record, then collect up to batch_size records within flush_interval."""
+        try:
+            batch = [self._queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+    
+    def _drain(self):
+        """Take everything currently queued without waiting."""
+        rows = []
+        while True:
+            try:
+                rows.append(self._queue.get_nowait())
+            except queue.Empty:
+                return rows
+    
+    def _write_and_mark_done(self, rows):
+        try:
+            self._write(rows)
+        finally:
+            for _ in rows:
+                self._queue.task_done()
+    
+    def _run(self):
+        while not self._closed.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._write_and_mark_done(batch)
+        # Flush whatever is left after close()
+        rows = self._drain()
+        for i in range(0, len(rows), self.batch_size):
+            self._write_and_mark_done(rows[i:i + self.batch_size])
+    
+    def _write(self, rows):
+        """Insert a batch of log rows in one transaction."""
+        try:
             with self.app.app_context():
-                try:
-                    # Check if logs table exists before trying to write
-                    # This prevents errors during initial startup
+                # Check once that the logs table exists (it may not during initial startup)
+                if not self._table_exists:
                     from sqlalchemy import inspect
-                    inspector = inspect(db.engine)
-                    if 'logs' not in inspector.get_table_names():
-                        # Table doesn't exist yet, skip database logging
+                    if 'logs' not in inspect(db.engine).get_table_names():
                         return
-                    
-                    log_entry = Log(
-                        user_id=user_id,
-                        level=level,
-                        message=message
-                    )
-                    db.session.add(log_entry)
+                    self._table_exists = True
+                
+                try:
+                    db.session.execute(Log.__table__.insert(), rows)
                     db.session.commit()
-                except Exception as db_error:
-                    # If database logging fails, don't crash the application
-                    # This can happen if tables don't exist yet or database is unavailable
-                    pass
+                    self.written += len(rows)
+                except Exception:
+                    # One bad row (e.g. an unknown user_id) should not lose the whole batch
+                    db.session.rollback()
+                    for row in rows:
+                        try:
+                            db.session.execute(Log.__table__.insert(), [row])
+                            db.session.commit()
+                            self.written += 1
+                        except Exception:
+                            db.session.rollback()
+                finally:
+                    db.session.remove()
         except Exception as e:
             # If database logging fails, don't crash the application
-            # Instead, log to stderr as fallback
-            self.handleError(record)
-            # Only print error if it's not a table missing error (which is expected during startup)
             if 'no such table' not in str(e).lower():
                 print(f"Error writing log to database: {str(e)}")
+        
+        if self.dropped != self._reported_dropped:
+            print(f"⚠️  Warning: Database log queue full, {self.dropped - self._reported_dropped} log record(s) dropped")
+            self._reported_dropped = self.dropped
+    
+    def flush(self):
+        """Block until every queued record has been written (or the flusher has stopped)."""
+        while self._queue.unfinished_tasks and self._thread.is_alive():
+            time.sleep(self.flush_interval / 10)
+    
+    def close(self):
+        """Stop the flusher thread after writing every queued record."""
+        if not self._closed.is_set():
+            self._closed.set()
+            self._thread.join(timeout=10)
+        super().close()
 
 def setup_logging(app_instance):
     """
@@ -295,8 +450,8 @@ def setup_logging(app_instance):
     logger.info("Logging system initialized - File and Database handlers configured")
     return logger
 
-# Initialize logging system
-app_logger = setup_logging(app)
+# Initialize logging system (worker processes log through the root logger without handlers of their own)
+app_logger = setup_logging(app) if IS_MAIN_PROCESS else logging.getLogger()
 
 # Initialize Flask-Login
 login_manager = LoginManager()
@@ -310,46 +465,235 @@ def load_user(user_id):
     """Load user from database for Flask-Login session management."""
     return User.query.get(user_id)
 
-# Initialize OAuth
-oauth = OAuth(app)
-
 # Google OAuth configuration
 GOOGLE_CLIENT_ID = os.environ.get('GOOGLE_CLIENT_ID')
 GOOGLE_CLIENT_SECRET = os.environ.get('GOOGLE_CLIENT_SECRET')
 
-# Register Google OAuth client (only if credentials are provided)
-google = None
-if GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET:
-    try:
-        google = oauth.register(
-            name='google',
-            client_id=GOOGLE_CLIENT_ID,
-            client_secret=GOOGLE_CLIENT_SECRET,
-            server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
-            client_kwargs={
-                'scope': 'openid email profile'
-            }
-        )
-        print("✓ Google OAuth configured successfully")
-    except Exception as e:
-        print(f"⚠️  Warning: Failed to configure Google OAuth: {str(e)}")
-        google = None
-else:
-    print("ℹ️  Google OAuth not configured (GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET not set)")
+# The Google OAuth client is registered on the first Google login (authlib is slow to import)
+_google_oauth = None
+_google_oauth_lock = threading.Lock()
 
-# Store progress for each generation task
-generation_progress = {}
+def get_google_oauth():
+    """
+    Return the Google OAuth client, registering it on first use.
+    
+    Returns:
+        authlib Flask OAuth client, or None if Google OAuth is not configured or could not be registered
+    """
+    global _google_oauth
+    if _google_oauth is None and GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET:
+        with _google_oauth_lock:
+            if _google_oauth is None:
+                try:
+                    from authlib.integrations.flask_client import OAuth
+                    _google_oauth = OAuth(app).register(
+                        name='google',
+                        client_id=GOOGLE_CLIENT_ID,
+                        client_secret=GOOGLE_CLIENT_SECRET,
+                        server_metadata_url='https://accounts.google.com/.well-known/openid-configuration',
+                        client_kwargs={
+                            'scope': 'openid email profile'
+                        }
+                    )
+                    print("✓ Google OAuth configured successfully")
+                except Exception as e:
+                    print(f"⚠️  Warning: Failed to configure Google OAuth: {str(e)}")
+    return _google_oauth
 
-# Store SSE event queues for real-time progress updates
-# Key: book_id, Value: queue.Queue for SSE events
-sse_event_queues = {}
-sse_event_queues_lock = threading.Lock()
+if not (GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET):
+    print("ℹ️  Google OAuth not configured (GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET not set)")
+
+# Store progress and SSE events for each generation task (see job_store.py).
+# The default in-memory store only serves the worker process that started a task;
+# set JOB_STORE_BACKEND=database to share job state between gunicorn workers and hosts.
+JOB_STORE_BACKEND = os.environ.get('JOB_STORE_BACKEND', 'memory')
+# Finished jobs (and their temp PDFs / images) are forgotten after JOB_TTL_SECONDS,
+# unfinished jobs that stopped updating after JOB_ABANDONED_TTL_SECONDS
+JOB_TTL_SECONDS = int(os.environ.get('JOB_TTL_SECONDS', 3600))
+JOB_ABANDONED_TTL_SECONDS = int(os.environ.get('JOB_ABANDONED_TTL_SECONDS', 6 * 3600))
+JOB_STORE_MAX_JOBS = int(os.environ.get('JOB_STORE_MAX_JOBS', 1000))
+JOB_SWEEP_INTERVAL_SECONDS = int(os.environ.get('JOB_SWEEP_INTERVAL_SECONDS', 300))
+job_store = None
+job_sweeper = None
+if IS_MAIN_PROCESS:
+    # A worker process's store would be empty, so its sweeper would delete the main process's live files
+    job_store = create_job_store(
+        JOB_STORE_BACKEND, app=app, db=db,
+        ttl_seconds=JOB_TTL_SECONDS,
+        abandoned_ttl_seconds=JOB_ABANDONED_TTL_SECONDS,
+        max_jobs=JOB_STORE_MAX_JOBS
+    )
+    atexit.register(job_store.close)
+    job_sweeper = JobSweeper(
+        job_store,
+        tempfile.gettempdir(),
+        interval_seconds=JOB_SWEEP_INTERVAL_SECONDS,
+        orphan_ttl_seconds=JOB_TTL_SECONDS
+    )
+    job_sweeper.start()
+    atexit.register(job_sweeper.close)
 
 # Initialize OpenAI client
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY')
 if not OPENAI_API_KEY:
     raise ValueError("OPENAI_API_KEY environment variable is not set. Please set it before running the application.")
-client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+
+# One pooled HTTP transport (see http_transport.py) shared by the OpenAI client and image downloads.
+# Size the pool for the concurrent requests of all books a worker generates at once.
+HTTP_MAX_CONNECTIONS = int(os.environ.get('HTTP_MAX_CONNECTIONS', 32))
+HTTP_MAX_KEEPALIVE = int(os.environ.get('HTTP_MAX_KEEPALIVE', 16))
+HTTP_CONNECT_TIMEOUT = float(os.environ.get('HTTP_CONNECT_TIMEOUT', 5))
+HTTP_READ_TIMEOUT = float(os.environ.get('HTTP_READ_TIMEOUT', 120))
+IMAGE_DOWNLOAD_TIMEOUT = float(os.environ.get('IMAGE_DOWNLOAD_TIMEOUT', 30))
+http_transport = HttpTransport(
+    max_connections=HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+    connect_timeout=HTTP_CONNECT_TIMEOUT,
+    read_timeout=HTTP_READ_TIMEOUT,
+    http2=os.environ.get('HTTP2', '1') != '0'
+)
+atexit.register(http_transport.close)
+
+# Every OpenAI call goes through one rate governor (see rate_governor.py): per-model token buckets
+# for requests/tokens per minute ("model=rpm:tpm", kept in line with the API's rate limit headers),
+# retries with jittered exponential backoff, and round-robin queueing across books.
+# The governor owns retries, so the OpenAI client's own retries are off.
+# OPENAI_BASE_URL points the client at another API server, e.g. fake_openai.py for load tests.
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL') or None
+OPENAI_RATE_LIMITS = os.environ.get('OPENAI_RATE_LIMITS', 'gpt-4o=500:30000,gpt-4=500:10000,text-embedding-3-small=3000:1000000')
+OPENAI_MAX_RETRIES = int(os.environ.get('OPENAI_MAX_RETRIES', 5))
+OPENAI_BACKOFF_BASE = float(os.environ.get('OPENAI_BACKOFF_BASE', 1))
+OPENAI_BACKOFF_MAX = float(os.environ.get('OPENAI_BACKOFF_MAX', 60))
+openai_governor = RateGovernor(
+    parse_rate_limits(OPENAI_RATE_LIMITS),
+    max_retries=OPENAI_MAX_RETRIES,
+    backoff_base=OPENAI_BACKOFF_BASE,
+    backoff_max=OPENAI_BACKOFF_MAX
+)
+
+def _create_openai_client():
+    # Called on the first OpenAI request: importing openai takes about half a second
+    from openai import OpenAI
+    return OpenAI(api_key=os.environ["OPENAI_API_KEY"], base_url=OPENAI_BASE_URL, http_client=http_transport.client,
+                  timeout=http_transport.timeout, max_retries=0)
+
+client = GovernedClient(_create_openai_client, openai_governor)
+
+# DALL-E results: 'b64_json' returns the PNG bytes in the API response and writes them to disk as-is;
+# 'url' downloads each image from a result URL and re-saves it through PIL (the previous behaviour)
+DALLE_RESPONSE_FORMAT = os.environ.get('DALLE_RESPONSE_FORMAT', 'b64_json')
+if DALLE_RESPONSE_FORMAT not in ('b64_json', 'url'):
+    print(f"⚠️  Warning: Unknown DALLE_RESPONSE_FORMAT '{DALLE_RESPONSE_FORMAT}', using 'b64_json'")
+    DALLE_RESPONSE_FORMAT = 'b64_json'
+
+# Book generation scheduling
+# DALL-E books are generated as a per-book dependency graph (see task_graph.py).
+# BOOK_GRAPH_MAX_WORKERS caps the number of concurrent tasks for one book and
+# BOOK_STAGE_CONCURRENCY caps individual stages, e.g. "dalle=2,vision=4,text=4".
+BOOK_GRAPH_MAX_WORKERS = int(os.environ.get('BOOK_GRAPH_MAX_WORKERS', 8))
+BOOK_STAGE_LIMITS = {'dalle': 2, 'vision': 4, 'text': 4}
+BOOK_STAGE_LIMITS.update(parse_stage_limits(os.environ.get('BOOK_STAGE_CONCURRENCY')))
+
+# Page text: generate all pages of a book in one structured request (set to 0 for one request per page)
+BATCHED_PAGE_TEXT = os.environ.get('BATCHED_PAGE_TEXT', '1') != '0'
+
+# GPT-4o vision response cache (see vision_cache.py)
+# Responses are keyed by image content, prompt template version, model and max_tokens,
+# so retried jobs and re-uploaded photos skip the API call. Set VISION_CACHE_BYPASS=1 to disable.
+VISION_CACHE_DIR = os.environ.get('VISION_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'vision'))
+VISION_CACHE_MAX_MB = int(os.environ.get('VISION_CACHE_MAX_MB', 256))
+VISION_CACHE_BYPASS = os.environ.get('VISION_CACHE_BYPASS', '0') == '1'
+vision_cache = VisionCache(VISION_CACHE_DIR, max_bytes=VISION_CACHE_MAX_MB * 1024 * 1024, bypass=VISION_CACHE_BYPASS)
+
+# RAG embeddings (see embedding_service.py)
+# The query text of every static story page is embedded once and kept on disk as a memory-mapped
+# float16 matrix (EMBEDDING_STORE_DTYPE=float32 keeps full precision), so page queries need no API call.
+# Other texts are batched: calls within EMBEDDING_BATCH_WINDOW_MS of each other share one request.
+EMBEDDING_MODEL = 'text-embedding-3-small'
+EMBEDDING_STORE_DIR = os.environ.get('EMBEDDING_STORE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache', 'embeddings'))
+EMBEDDING_STORE_DTYPE = os.environ.get('EMBEDDING_STORE_DTYPE', 'float16')
+EMBEDDING_BATCH_WINDOW_MS = float(os.environ.get('EMBEDDING_BATCH_WINDOW_MS', 20))
+embedding_service = EmbeddingService(
+    lambda **request: client.embeddings.create(**request),
+    EMBEDDING_STORE_DIR,
+    model=EMBEDDING_MODEL,
+    dtype=EMBEDDING_STORE_DTYPE,
+    batch_window=EMBEDDING_BATCH_WINDOW_MS / 1000
+)
+
+# Pre-illustrated story pages are composited in worker processes (see compositing.py).
+# COMPOSITING_WORKERS defaults to the CPU count; set it to 0 to composite inline.
+COMPOSITING_WORKERS = os.environ.get('COMPOSITING_WORKERS')
+compositing_engine = CompositingEngine(int(COMPOSITING_WORKERS) if COMPOSITING_WORKERS else None)
+atexit.register(compositing_engine.shutdown)
+
+# PDF output profile (see pdf_profiles.py): 'screen' (150 DPI JPEG), 'print' (300 DPI JPEG)
+# or 'archive' (lossless). Page images are re-encoded on the compositing workers.
+PDF_PROFILE = os.environ.get('PDF_PROFILE', 'screen')
+# Render each page to a PDF fragment as soon as it is ready and stitch them at the end
+# (see pdf_builder.py; needs pypdf). Set PDF_INCREMENTAL=0 to render the whole PDF at the end.
+PDF_INCREMENTAL = os.environ.get('PDF_INCREMENTAL', '1') != '0'
+if PDF_INCREMENTAL and not PYPDF_AVAILABLE:
+    print("⚠️  Warning: pypdf not installed; PDFs will be rendered in one pass after all pages are done")
+
+# Stage timings and pipeline gauges, served in Prometheus text format at /metrics (see metrics.py).
+# Book stages (book_red, book_dalle, book_parallel) contain the shorter stages timed inside them.
+metrics = MetricsRegistry('storybook')
+active_books = metrics.gauge('active_books', 'Books currently being generated', ['path'])
+pool_threads = metrics.gauge('pool_threads', 'Threads of the per-book thread pools (total and busy)', ['pool', 'state'])
+
+def _governor_models(field):
+    return lambda: {model: lane[field] for model, lane in openai_governor.stats()['models'].items()}
+
+def _db_log_stats():
+    for handler in app_logger.handlers:
+        if isinstance(handler, DBHandler):
+            return handler.stats()
+    return {}
+
+metrics.collect('openai_queue_depth', 'OpenAI requests waiting for rate limit capacity', _governor_models('waiting'), ['model'])
+metrics.collect('openai_calls_total', 'OpenAI calls made', _governor_models('calls'), ['model'], kind='counter')
+metrics.collect('openai_retries_total', 'OpenAI calls retried', _governor_models('retries'), ['model'], kind='counter')
+metrics.collect('openai_rate_limited_total', 'OpenAI responses with status 429', _governor_models('rate_limited'), ['model'], kind='counter')
+metrics.collect('openai_wait_seconds_total', 'Time OpenAI calls waited for rate limit capacity', _governor_models('wait_seconds'), ['model'], kind='counter')
+metrics.collect('compositing_in_flight', 'Page jobs queued or running on the compositing workers', lambda: compositing_engine.stats()['in_flight'])
+metrics.collect('compositing_workers', 'Compositing worker processes (0: inline)', lambda: compositing_engine.stats()['workers'])
+metrics.collect('http_in_flight', 'HTTP requests in flight on the shared transport', lambda: http_transport.stats()['in_flight'])
+metrics.collect('http_open_connections', 'Open connections in the shared HTTP pool', lambda: http_transport.stats()['open_connections'])
+metrics.collect('http_requests_total', 'HTTP requests sent through the shared transport', lambda: http_transport.stats()['requests'], kind='counter')
+metrics.collect('http_reused_total', 'HTTP requests that reused a pooled connection', lambda: http_transport.stats()['reused'], kind='counter')
+metrics.collect('vision_cache_lookups_total', 'Vision cache lookups by result',
+                lambda: {'hit': vision_cache.stats()['hits'], 'miss': vision_cache.stats()['misses']}, ['result'], kind='counter')
+metrics.collect('vision_cache_bytes', 'Size of the vision cache on disk', lambda: vision_cache.stats()['bytes'])
+metrics.collect('dalle_images_total', 'DALL-E images stored, by response format',
+                lambda: {mode: entry['images'] for mode, entry in dalle_image_stats().items()}, ['mode'], kind='counter')
+metrics.collect('embedding_store_vectors', 'Static query embeddings in the embedding store', lambda: embedding_service.stats()['stored'])
+metrics.collect('embedding_store_hits_total', 'Embeddings read from the embedding store', lambda: embedding_service.stats()['store_hits'], kind='counter')
+metrics.collect('embedding_requests_total', 'Embedding API requests (each may carry several texts)', lambda: embedding_service.stats()['requests'], kind='counter')
+metrics.collect('embedding_texts_requested_total', 'Texts sent to the embedding API', lambda: embedding_service.stats()['texts_requested'], kind='counter')
+metrics.collect('story_catalog_stories', 'Story templates held in the in-memory catalogue', lambda: story_catalog.stats()['stories'])
+metrics.collect('story_catalog_loads_total', 'Times the story catalogue was loaded from the database', lambda: story_catalog.stats()['loads'], kind='counter')
+metrics.collect('jobs_live', 'Generation jobs held by the job store', lambda: job_store.stats().get('live_jobs'))
+metrics.collect('job_subscribers', 'Progress streams subscribed to jobs', lambda: job_store.stats().get('subscribers'))
+metrics.collect('db_log_queue_depth', 'Log records waiting to be written to the database', lambda: _db_log_stats().get('queued'))
+metrics.collect('db_log_dropped_total', 'Log records dropped because the queue was full', lambda: _db_log_stats().get('dropped'), kind='counter')
+
+def _pool_task(pool, fn):
+    """Wrap fn so that while it runs it counts as a busy thread of pool."""
+    def run(*args, **kwargs):
+        with pool_threads.track(pool=pool, state='busy'):
+            return fn(*args, **kwargs)
+    return run
+
+# Vision prompt template versions - bump a version when the way its response is used changes,
+# so that previously cached responses for that template are no longer served
+VISION_PROMPT_VERSIONS = {
+    'child_appearance': 1,
+    'illustration_style': 1,
+    'master_reference': 1,
+    'illustration_face': 1,
+    'consistency_info': 1
+}
 
 # Ensure upload directory exists
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
@@ -594,34 +938,79 @@ def get_all_prompts_for_story(story_choice, gender):
     print(f"DEBUG: Total prompts created: {len(all_prompts)} (should be 13: 1 cover + 12 pages)")
     return all_prompts
 
+@metrics.timed('vision')
+def _vision_completion(image_path, template, prompt_text, max_tokens, json_mode=False):
+    """
+    Send an image and prompt to GPT-4o, serving repeated requests from the vision cache.
+    
+    Args:
+        image_path: Path to the image file
+        template: Prompt template name (a key of VISION_PROMPT_VERSIONS)
+        prompt_text: Fully rendered prompt text
+        max_tokens: max_tokens for the request
+        json_mode: If True, request a JSON object response
+    
+    Returns:
+        str: The response content
+    """
+    with open(image_path, 'rb') as img_file:
+        img_data = img_file.read()
+    
+    cache_key = vision_cache.make_key(
+        hashlib.sha256(img_data).hexdigest(),
+        template,
+        VISION_PROMPT_VERSIONS[template],
+        "gpt-4o",
+        max_tokens,
+        hashlib.sha256(prompt_text.encode('utf-8')).hexdigest()
+    )
+    cached = vision_cache.get(cache_key)
+    if cached is not None:
+        print(f"✓ Vision cache hit ({template})")
+        return cached
+    
+    # Determine image format
+    img = Image.open(io.BytesIO(img_data))
+    img_format = img.format.lower() if img.format else 'jpeg'
+    mime_type = f"image/{img_format}"
+    
+    # Encode to base64
+    img_base64 = base64.b64encode(img_data).decode('utf-8')
+    data_url = f"data:{mime_type};base64,{img_base64}"
+    
+    request_args = {}
+    if json_mode:
+        request_args['response_format'] = {"type": "json_object"}
+    
+    response = client.chat.completions.create(
+        model="gpt-4o",
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {"type": "text", "text": prompt_text},
+                    {"type": "image_url", "image_url": {"url": data_url}}
+                ]
+            }
+        ],
+        max_tokens=max_tokens,
+        **request_args
+    )
+    
+    content = response.choices[0].message.content
+    vision_cache.put(cache_key, content, template=template, model="gpt-4o")
+    return content
+
 def analyze_child_appearance(image_path):
     """
     Use GPT-4 Vision to analyze the child's appearance from the photo.
     Returns a detailed description for use in prompts.
     """
     try:
-        # Read and encode image
-        with open(image_path, 'rb') as img_file:
-            img_data = img_file.read()
-        
-        # Determine image format
-        img = Image.open(io.BytesIO(img_data))
-        img_format = img.format.lower() if img.format else 'jpeg'
-        mime_type = f"image/{img_format}"
-        
-        # Encode to base64
-        img_base64 = base64.b64encode(img_data).decode('utf-8')
-        data_url = f"data:{mime_type};base64,{img_base64}"
-        
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": """Analyze this photo of a child and provide an EXTREMELY detailed description for consistent illustration generation.
+        return _vision_completion(
+            image_path,
+            'child_appearance',
+            """Analyze this photo of a child and provide an EXTREMELY detailed description for consistent illustration generation.
 
 CRITICAL - Extract these EXACT features that must remain identical across all pages:
 1. Age: Exact age appearance
@@ -635,21 +1024,9 @@ CRITICAL - Extract these EXACT features that must remain identical across all pa
 9. Distinctive features: Freckles, dimples, birthmarks, etc. - be specific
 10. Overall facial proportions
 
-This description will be used to recreate the EXACT same child in every illustration. Be extremely specific - the child must look identical across all 13 pages of the storybook."""
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": data_url
-                            }
-                        }
-                    ]
-                }
-            ],
+This description will be used to recreate the EXACT same child in every illustration. Be extremely specific - the child must look identical across all 13 pages of the storybook.""",
             max_tokens=400
         )
-        
-        return response.choices[0].message.content
     except Exception as e:
         print(f"Error analyzing child appearance: {str(e)}")
         return "a child with distinct features matching the uploaded photo"
@@ -660,42 +1037,12 @@ def analyze_illustration_style(image_path):
     Returns a detailed style description including color palette, brushwork, lighting, etc.
     """
     try:
-        # Read and encode image
-        with open(image_path, 'rb') as img_file:
-            img_data = img_file.read()
-        
-        # Determine image format
-        img = Image.open(io.BytesIO(img_data))
-        img_format = img.format.lower() if img.format else 'jpeg'
-        mime_type = f"image/{img_format}"
-        
-        # Encode to base64
-        img_base64 = base64.b64encode(img_data).decode('utf-8')
-        data_url = f"data:{mime_type};base64,{img_base64}"
-        
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Analyze this children's book illustration and provide a detailed description of its artistic style. Focus on:\n1. Color palette (specific colors, saturation, warmth/coolness)\n2. Brushwork/technique (watercolor, painterly, digital, etc.)\n3. Lighting style (soft, bright, moody, etc.)\n4. Edge quality (soft, hard, blended)\n5. Overall artistic aesthetic\n6. Texture and visual effects\n\nBe extremely specific and detailed. This description will be used to recreate the exact same style in subsequent illustrations. Format as a clear, comprehensive style guide."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": data_url
-                            }
-                        }
-                    ]
-                }
-            ],
+        return _vision_completion(
+            image_path,
+            'illustration_style',
+            "Analyze this children's book illustration and provide a detailed description of its artistic style. Focus on:\n1. Color palette (specific colors, saturation, warmth/coolness)\n2. Brushwork/technique (watercolor, painterly, digital, etc.)\n3. Lighting style (soft, bright, moody, etc.)\n4. Edge quality (soft, hard, blended)\n5. Overall artistic aesthetic\n6. Texture and visual effects\n\nBe extremely specific and detailed. This description will be used to recreate the exact same style in subsequent illustrations. Format as a clear, comprehensive style guide.",
             max_tokens=400
         )
-        
-        return response.choices[0].message.content
     except Exception as e:
         print(f"Error analyzing illustration style: {str(e)}")
         return "watercolor/painterly style with soft, artistic brushstrokes, gentle color blending, and an emotional, gentle feel"
@@ -712,28 +1059,10 @@ def extract_master_reference_character_details(image_path):
     - Age and ethnicity
     """
     try:
-        # Read and encode image
-        with open(image_path, 'rb') as img_file:
-            img_data = img_file.read()
-        
-        # Determine image format
-        img = Image.open(io.BytesIO(img_data))
-        img_format = img.format.lower() if img.format else 'jpeg'
-        mime_type = f"image/{img_format}"
-        
-        # Encode to base64
-        img_base64 = base64.b64encode(img_data).decode('utf-8')
-        data_url = f"data:{mime_type};base64,{img_base64}"
-        
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": """This is the MASTER REFERENCE IMAGE - the first illustration of the child character.
+        return _vision_completion(
+            image_path,
+            'master_reference',
+            """This is the MASTER REFERENCE IMAGE - the first illustration of the child character.
 
 You MUST extract EVERY detail about the child's appearance that will be used to recreate this EXACT child in all subsequent illustrations.
 
@@ -754,21 +1083,9 @@ Provide an EXTREMELY detailed description including:
 13. OVERALL FACIAL PROPORTIONS: How features relate to each other
 14. FACIAL STRUCTURE: Bone structure, cheekbones, jawline
 
-This description will be the MASTER REFERENCE for ALL subsequent pages. The child in every page MUST match this description exactly - same face, same age, same hair, same everything. Be extremely precise and detailed."""
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": data_url
-                            }
-                        }
-                    ]
-                }
-            ],
+This description will be the MASTER REFERENCE for ALL subsequent pages. The child in every page MUST match this description exactly - same face, same age, same hair, same everything. Be extremely precise and detailed.""",
             max_tokens=500
         )
-        
-        return response.choices[0].message.content
     except Exception as e:
         print(f"Error extracting master reference character details: {str(e)}")
         return None
@@ -779,46 +1096,17 @@ def analyze_child_face_from_illustration(image_path):
     Returns a detailed face description that can be used to maintain consistency across pages.
     """
     try:
-        # Read and encode image
-        with open(image_path, 'rb') as img_file:
-            img_data = img_file.read()
-        
-        # Determine image format
-        img = Image.open(io.BytesIO(img_data))
-        img_format = img.format.lower() if img.format else 'jpeg'
-        mime_type = f"image/{img_format}"
-        
-        # Encode to base64
-        img_base64 = base64.b64encode(img_data).decode('utf-8')
-        data_url = f"data:{mime_type};base64,{img_base64}"
-        
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Analyze this children's book illustration and focus specifically on the child character's face and appearance. Provide a detailed description of:\n1. Hair color and exact style/texture\n2. Eye color and shape\n3. Face shape and structure\n4. Skin tone\n5. Nose shape and size\n6. Mouth shape and size\n7. Age appearance\n8. Any distinctive facial features (freckles, dimples, etc.)\n9. Overall facial proportions\n\nBe extremely specific and detailed. This description will be used to recreate the EXACT same child's face in all subsequent illustrations. The child must look identical in every page - this is critical for consistency."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {
-                                "url": data_url
-                            }
-                        }
-                    ]
-                }
-            ],
+        return _vision_completion(
+            image_path,
+            'illustration_face',
+            "Analyze this children's book illustration and focus specifically on the child character's face and appearance. Provide a detailed description of:\n1. Hair color and exact style/texture\n2. Eye color and shape\n3. Face shape and structure\n4. Skin tone\n5. Nose shape and size\n6. Mouth shape and size\n7. Age appearance\n8. Any distinctive facial features (freckles, dimples, etc.)\n9. Overall facial proportions\n\nBe extremely specific and detailed. This description will be used to recreate the EXACT same child's face in all subsequent illustrations. The child must look identical in every page - this is critical for consistency.",
             max_tokens=300
         )
-        
-        return response.choices[0].message.content
     except Exception as e:
         print(f"Error analyzing child face from illustration: {str(e)}")
         return None
 
+@metrics.timed('vision_verify')
 def verify_face_matches_master_reference(generated_image_path, master_reference_description):
     """
     Verify if the child's face in a generated image matches the master reference.
@@ -964,285 +1252,85 @@ def validate_image_for_book(file_path):
 # IMAGE PROCESSING FOR PRE-EXISTING STORY IMAGES
 # ============================================================================
 
-def load_story_image(story_id, page_number):
+def _peak_rss_mb():
+    """Return this process's peak resident set size in MB, or None if unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and kilobytes on Linux
+    if sys.platform == 'darwin':
+        return round(peak / (1024 * 1024), 1)
+    return round(peak / 1024, 1)
+
+
+@metrics.timed('subject')
+def prepare_book_subject(user_image_path, output_dir):
     """
-    Load a pre-existing story image from the story images folder.
+    Decode and analyse the user's photo once for a book and store it for the compositing workers.
     
     Args:
-        story_id: The story identifier (e.g., 'red' for Little Red Riding Hood)
-        page_number: Page number (1-13, where 1 is cover, 13 is last page)
+        user_image_path: Path to user's uploaded image
+        output_dir: The book's working directory
     
     Returns:
-        PIL Image object or None if not found
+        BookSubject with its path set
     """
-    try:
-        # Map story_id to folder name
-        story_folders = {
-            'red': 'LittleRedRidingHoodImages'
-        }
-        
-        if story_id not in story_folders:
-            return None
-        
-        folder_name = story_folders[story_id]
-        folder_path = os.path.join(os.path.dirname(__file__), folder_name)
-        
-        # Try different image formats and naming conventions
-        image_extensions = ['.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG']
-        image_names = [
-            f'Image{page_number}.jpg',
-            f'Image{page_number}.png',
-            f'image{page_number}.jpg',
-            f'image{page_number}.png',
-            f'Image{page_number:02d}.jpg',
-            f'Image{page_number:02d}.png'
-        ]
-        
-        for img_name in image_names:
-            img_path = os.path.join(folder_path, img_name)
-            if os.path.exists(img_path):
-                return Image.open(img_path).convert('RGB')
-        
-        # If exact match not found, try with extensions
-        for ext in image_extensions:
-            img_path = os.path.join(folder_path, f'Image{page_number}{ext}')
-            if os.path.exists(img_path):
-                return Image.open(img_path).convert('RGB')
-        
-        print(f"Warning: Could not find image for story {story_id}, page {page_number}")
-        return None
-        
-    except Exception as e:
-        print(f"Error loading story image: {str(e)}")
-        return None
+    subject = BookSubject.from_path(user_image_path)
+    subject.save(os.path.join(output_dir, 'subject.png'))
+    return subject
 
 
-def replace_face_in_image(story_image, user_image, character_name=None):
+def submit_story_image(story_id, page_number, subject, character_name):
     """
-    Replace the main character's face in the story image with the user's face.
-    
-    This function:
-    1. Detects faces in both images using OpenCV's face detection
-    2. Extracts facial features from user image
-    3. Replaces/overlays the face in the story image
+    Queue a pre-existing story page on the compositing engine.
     
     Args:
-        story_image: PIL Image of the story page
-        user_image: PIL Image of the user's uploaded photo
-        character_name: Optional character name for text replacement
+        story_id: Story identifier (e.g., 'red')
+        page_number: Page number (1-13)
+        subject: BookSubject from prepare_book_subject()
+        character_name: Character name for text replacement
     
     Returns:
-        PIL Image with replaced face
+        Future resolving to the encoded page (see compositing.render_page)
     """
-    try:
-        if not OPENCV_AVAILABLE or not HAS_NUMPY:
-            # Fallback: Simple blending if OpenCV or NumPy not available
-            print("OpenCV or NumPy not available, using simple image blending")
-            return _simple_face_blend(story_image, user_image)
-        
-        # Convert PIL images to numpy arrays for OpenCV
-        story_array = np.array(story_image)
-        user_array = np.array(user_image)
-        
-        # Convert RGB to BGR for OpenCV (OpenCV uses BGR format)
-        story_bgr = cv2.cvtColor(story_array, cv2.COLOR_RGB2BGR)
-        user_bgr = cv2.cvtColor(user_array, cv2.COLOR_RGB2BGR)
-        
-        # Convert to grayscale for face detection
-        story_gray = cv2.cvtColor(story_bgr, cv2.COLOR_BGR2GRAY)
-        user_gray = cv2.cvtColor(user_bgr, cv2.COLOR_BGR2GRAY)
-        
-        # Load OpenCV's face detection cascade
-        # Try to use DNN-based face detector (more accurate) or fallback to Haar cascade
-        face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
-        
-        # Detect faces in both images
-        story_faces = face_cascade.detectMultiScale(
-            story_gray,
-            scaleFactor=1.1,
-            minNeighbors=5,
-            minSize=(30, 30)
-        )
-        user_faces = face_cascade.detectMultiScale(
-            user_gray,
-            scaleFactor=1.1,
-            minNeighbors=5,
-            minSize=(30, 30)
-        )
-        
-        if len(story_faces) == 0 or len(user_faces) == 0:
-            print("Could not detect faces, using simple blending")
-            return _simple_face_blend(story_image, user_image)
-        
-        # Get the largest face from user image (assuming it's the main subject)
-        user_face = max(user_faces, key=lambda rect: rect[2] * rect[3])
-        user_x, user_y, user_w, user_h = user_face
-        
-        # Get the largest face from story image (assuming it's the main character)
-        story_face = max(story_faces, key=lambda rect: rect[2] * rect[3])
-        story_x, story_y, story_w, story_h = story_face
-        
-        # Extract face regions (convert back to RGB for PIL)
-        user_face_region = user_array[user_y:user_y+user_h, user_x:user_x+user_w]
-        story_face_region = story_array[story_y:story_y+story_h, story_x:story_x+story_w]
-        
-        # Resize user face to match story face size
-        user_face_resized = cv2.resize(user_face_region, (story_w, story_h))
-        
-        # Create a mask for seamless blending (elliptical mask)
-        mask = np.zeros((story_h, story_w), dtype=np.float32)
-        center = (story_w // 2, story_h // 2)
-        axes = (story_w // 2 - 10, story_h // 2 - 10)
-        cv2.ellipse(mask, center, axes, 0, 0, 360, 1.0, -1)
-        
-        # Apply Gaussian blur to mask edges for smoother blending
-        mask = cv2.GaussianBlur(mask, (15, 15), 0)
-        
-        # Blend the faces
-        # Normalize mask to [0, 1] range
-        mask = mask / 255.0 if mask.max() > 1.0 else mask
-        
-        blended_face = np.zeros_like(story_face_region, dtype=np.float32)
-        for c in range(3):
-            # mask is 2D (story_h, story_w), so use it directly without np.newaxis
-            blended_face[:, :, c] = (
-                story_face_region[:, :, c].astype(np.float32) * (1 - mask) +
-                user_face_resized[:, :, c].astype(np.float32) * mask
-            )
-        blended_face = np.clip(blended_face, 0, 255).astype(np.uint8)
-        
-        # Replace the face region in the story image
-        result_array = story_array.copy()
-        result_array[story_y:story_y+story_h, story_x:story_x+story_w] = blended_face
-        
-        # Convert back to PIL Image
-        result_image = Image.fromarray(result_array)
-        
-        return result_image
-        
-    except Exception as e:
-        print(f"Error in face replacement: {str(e)}")
-        import traceback
-        traceback.print_exc()
-        # Fallback to simple blending
-        return _simple_face_blend(story_image, user_image)
-
-
-def _simple_face_blend(story_image, user_image):
-    """
-    Simple fallback method for face blending when face recognition is not available.
-    Uses basic image blending techniques.
-    """
-    try:
-        # Resize user image to a reasonable size for blending
-        user_resized = user_image.resize((400, 400), Image.Resampling.LANCZOS)
-        
-        # Create a circular mask for blending
-        mask_size = 300
-        mask = Image.new('L', (mask_size, mask_size), 0)
-        draw = ImageDraw.Draw(mask)
-        draw.ellipse([(0, 0), (mask_size, mask_size)], fill=255)
-        
-        # Apply Gaussian blur to mask (simulated with resize)
-        mask = mask.resize((mask_size, mask_size), Image.Resampling.LANCZOS)
-        
-        # Find a good position to place the face (center-left area, typical for character)
-        story_width, story_height = story_image.size
-        paste_x = int(story_width * 0.15)
-        paste_y = int(story_height * 0.3)
-        
-        # Resize user image to match mask
-        user_face = user_resized.resize((mask_size, mask_size), Image.Resampling.LANCZOS)
-        
-        # Create a copy of story image
-        result = story_image.copy()
-        
-        # Paste user face with mask for blending
-        result.paste(user_face, (paste_x, paste_y), mask)
-        
-        return result
-        
-    except Exception as e:
-        print(f"Error in simple face blend: {str(e)}")
-        return story_image
+    return compositing_engine.submit({
+        'story_id': story_id,
+        'page_number': page_number,
+        'subject_path': subject.path,
+        'character_name': character_name
+    })
 
 
-def replace_text_in_image(image, old_text_patterns, new_text, character_name):
+@metrics.timed('compositing_wait')
+def save_story_image(future, page_number, output_path):
     """
-    Replace text in the image with the character's name.
+    Wait for a submitted story page and write it to disk.
     
-    This function attempts to find and replace text in the image.
-    Since OCR can be unreliable, we use a simpler approach:
-    - Detect text regions (if OCR available)
-    - Or use predefined regions for known text locations
-    - Overlay new text with similar font/style
-    
-    Args:
-        image: PIL Image
-        old_text_patterns: List of text patterns to look for (e.g., ["Little Red Riding Hood", "Red"])
-        new_text: New text to replace with (character name)
-        character_name: The character's name
+    Waiting only blocks the calling green thread; the compositing itself runs in a
+    worker process, so the eventlet hub keeps serving other requests.
     
     Returns:
-        PIL Image with text replaced
+        bool: True if successful, False otherwise
     """
     try:
-        result = image.copy()
-        draw = ImageDraw.Draw(result)
-        
-        # Try to load a font (use default if not available)
-        try:
-            # Try to use a nice font
-            font_size = 40
-            try:
-                font = ImageFont.truetype("arial.ttf", font_size)
-            except:
-                try:
-                    font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf", font_size)
-                except:
-                    font = ImageFont.load_default()
-        except:
-            font = ImageFont.load_default()
-        
-        # Common text regions in storybook images (top, center, bottom)
-        # We'll overlay text in likely locations
-        width, height = image.size
-        
-        # Text regions to check/overlay (as percentages)
-        text_regions = [
-            (0.1, 0.05, 0.9, 0.15),  # Top area (title)
-            (0.1, 0.85, 0.9, 0.95),  # Bottom area (caption)
-        ]
-        
-        # For now, we'll add the character name as a subtle overlay
-        # In a production system, you'd use OCR to detect and replace exact text
-        # For this implementation, we'll add the name in a corner or replace visible text areas
-        
-        # Draw character name in bottom-right corner (subtle)
-        text_bbox = draw.textbbox((0, 0), character_name, font=font)
-        text_width = text_bbox[2] - text_bbox[0]
-        text_height = text_bbox[3] - text_bbox[1]
-        
-        # Position: bottom-right with padding
-        x = width - text_width - 20
-        y = height - text_height - 20
-        
-        # Draw text with outline for visibility
-        # Draw outline
-        for adj in range(-2, 3):
-            for adj2 in range(-2, 3):
-                draw.text((x + adj, y + adj2), character_name, font=font, fill=(0, 0, 0, 200))
-        # Draw main text
-        draw.text((x, y), character_name, font=font, fill=(255, 255, 255, 255))
-        
-        return result
+        result = future.result()
+        with open(output_path, 'wb') as f:
+            f.write(result['png'])
+        # CPU time in the worker process; compositing_wait is how long the book waited for it
+        metrics.stage_seconds.observe(result['cpu_seconds'], stage='compositing_cpu', outcome='ok')
+        
+        print(f"✓ Processed story image for page {page_number}: {output_path} (CPU {result['cpu_seconds']:.3f}s, worker {result['pid']})")
+        app_logger.info(f"Story image page {page_number} processed: CPU {result['cpu_seconds']:.3f}s in worker {result['pid']}, peak RSS {_peak_rss_mb()} MB")
+        return True
         
     except Exception as e:
-        print(f"Error replacing text in image: {str(e)}")
-        return image
+        print(f"Error processing story image: {str(e)}")
+        import traceback
+        traceback.print_exc()
+        return False
 
 
-def process_story_image(story_id, page_number, user_image_path, character_name, output_path):
+def process_story_image(story_id, page_number, user_image_path, character_name, output_path, subject=None):
     """
     Main function to process a pre-existing story image:
     1. Load the story image
@@ -1251,67 +1339,41 @@ def process_story_image(story_id, page_number, user_image_path, character_name,
     4. Replace text with character name
     5. Save the result
     
+    Steps 1-4 run on the compositing engine (see compositing.py).
+    
     Args:
         story_id: Story identifier (e.g., 'red')
         page_number: Page number (1-13)
         user_image_path: Path to user's uploaded image
         character_name: Character name for text replacement
         output_path: Where to save the processed image
+        subject: Optional BookSubject from prepare_book_subject(); if omitted, the photo at
+                 user_image_path is decoded and analysed for this page alone
     
     Returns:
         bool: True if successful, False otherwise
     """
     try:
-        # Yield control to eventlet periodically to prevent worker timeout
-        eventlet.sleep(0)
-        
-        # Load story image
-        story_image = load_story_image(story_id, page_number)
-        if story_image is None:
-            print(f"Failed to load story image for page {page_number}")
-            return False
-        
-        # Yield control
-        eventlet.sleep(0)
-        
-        # Load user image
-        user_image = Image.open(user_image_path).convert('RGB')
-        
-        # Yield control
-        eventlet.sleep(0)
-        
-        # Replace face/character features
-        processed_image = replace_face_in_image(story_image, user_image, character_name)
-        
-        # Yield control
-        eventlet.sleep(0)
-        
-        # Replace text with character name
-        # Common text patterns in Little Red Riding Hood images
-        old_text_patterns = ["Little Red Riding Hood", "Red Riding Hood", "Little Red", "Red"]
-        final_image = replace_text_in_image(processed_image, old_text_patterns, character_name, character_name)
-        
-        # Yield control
-        eventlet.sleep(0)
-        
-        # Save the result
-        final_image.save(output_path, 'PNG', quality=95)
-        
-        print(f"✓ Processed story image for page {page_number}: {output_path}")
-        return True
-        
+        if subject is None:
+            subject = prepare_book_subject(user_image_path, os.path.dirname(os.path.abspath(output_path)))
     except Exception as e:
-        print(f"Error processing story image: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        print(f"Error loading user image: {str(e)}")
         return False
+    
+    future = submit_story_image(story_id, page_number, subject, character_name)
+    return save_story_image(future, page_number, output_path)
 
 
 # ============================================================================
 # MULTI-THREADED IMAGE GENERATION
 # ============================================================================
 
-def generate_page_image(page_data, user_image_path, output_dir, page_index, storyline_id=None, character_name=None):
+# Storylines whose pages generate_page_image composites from real illustrations
+# (other storylines get placeholder images, so no book is built for them)
+PRE_ILLUSTRATED_STORYLINES = ('red',)
+
+@metrics.timed('page_image')
+def generate_page_image(page_data, user_image_path, output_dir, page_index, storyline_id=None, character_name=None, subject=None):
     """
     Worker function that creates a single page image.
     
@@ -1330,6 +1392,7 @@ def generate_page_image(page_data, user_image_path, output_dir, page_index, stor
         page_index: Index of the page (0-11 for the 12 story pages, or 0-12 for 13 pages including cover)
         storyline_id: Story identifier (e.g., 'red' for Little Red Riding Hood)
         character_name: Name of the character for text replacement
+        subject: Optional BookSubject for the user's photo, shared by every page
     
     Returns:
         dict: {
@@ -1366,7 +1429,8 @@ def generate_page_image(page_data, user_image_path, output_dir, page_index, stor
                 page_number=story_image_number,
                 user_image_path=user_image_path,
                 character_name=character_name or "Little Red Riding Hood",
-                output_path=image_path
+                output_path=image_path,
+                subject=subject
             )
             
             if success:
@@ -1464,6 +1528,30 @@ def generate_book_filepath(user_id, story_id):
     
     return full_path, relative_path
 
+def storyline_text_page_prompts(pages, story_title, first_page_number=1):
+    """
+    Build (page number, prompt_info) text inputs for generate_all_page_texts from storyline pages.
+    
+    Args:
+        pages: Page mappings of a story_catalog StoryTemplate (or Storyline.get_pages())
+        story_title: Story title used in default page descriptions
+        first_page_number: Book page number of the first storyline page
+    
+    Returns:
+        list: (page_number, prompt_info) tuples
+    """
+    text_page_prompts = []
+    for page_offset, page_data in enumerate(pages):
+        page_number = first_page_number + page_offset
+        # Ensure page_data has required fields (copy so the storyline data is not modified)
+        page_data = dict(page_data) if isinstance(page_data, Mapping) else {}
+        if 'description' not in page_data:
+            page_data['description'] = page_data.get('scene_desc') or f"Page {page_number} of {story_title}"
+        if 'prompt' not in page_data:
+            page_data['prompt'] = page_data.get('image_prompt_template', "")
+        text_page_prompts.append((page_number, page_data))
+    return text_page_prompts
+
 def _send_sse_event(book_id, event_type, data):
     """
     Helper function to send SSE events to the queue for a specific book_id.
@@ -1473,30 +1561,25 @@ def _send_sse_event(book_id, event_type, data):
         event_type: Type of event (e.g., 'page_complete', 'generation_complete', 'error')
         data: Dictionary containing event data
     """
-    with sse_event_queues_lock:
-        if book_id in sse_event_queues:
-            try:
-                event_data = {
-                    'type': event_type,
-                    'data': data,
-                    'timestamp': time.time()
-                }
-                sse_event_queues[book_id].put(event_data, timeout=0.1)
-            except queue.Full:
-                # Queue is full, skip this event (non-blocking)
-                pass
+    job_store.publish(book_id, event_type, data)
 
+@metrics.timed('book_parallel')
 def start_book_generation(storyline_id, user_image_path, output_dir=None, book_id=None, user_id=None, child_name=None):
     """
     Master function that orchestrates parallel image generation for all 12 story pages.
     
     This function:
     1. Loads the 12 page objects from the Storyline model
-    2. Submits all 12 page generation tasks to ThreadPoolExecutor simultaneously
-    3. Collects results as they complete using as_completed()
+    2. Submits all 12 page generation tasks to ThreadPoolExecutor simultaneously,
+       together with the cover and (when the book has a child name) the page text
+    3. Collects results as they complete using as_completed(), rendering each
+       finished page into the PDF right away (see pdf_builder.py)
     4. Sends real-time SSE updates when book_id is provided
     5. Compiles the final PDF and saves it to the database
     
+    Books are only built for PRE_ILLUSTRATED_STORYLINES: for other storylines the page
+    images are placeholders, so a call with user_id and child_name returns an error.
+    
     Args:
         storyline_id: The story_id from the Storyline model (e.g., 'red', 'jack')
         user_image_path: Path to the user's uploaded image
@@ -1515,43 +1598,59 @@ def start_book_generation(storyline_id, user_image_path, output_dir=None, book_i
             'errors': list of error messages,
             'output_dir': str,
             'pdf_path': str,  # Path to generated PDF (if saved)
-            'book_id': str    # Book ID from database (if saved)
+            'book_id': str,   # Book ID from database (if saved)
+            'timings': dict   # pages_seconds, text_seconds, pdf_seconds, total_seconds
         }
     """
+    generation_start = time.time()
+    active_books.inc(path='parallel')
     try:
         # Create output directory if not provided
         if output_dir is None:
             output_dir = os.path.join('generated_images', str(uuid.uuid4()))
         os.makedirs(output_dir, exist_ok=True)
         
-        # Load storyline from database
-        with app.app_context():
-            storyline = Storyline.query.filter_by(story_id=storyline_id).first()
-            
-            if not storyline:
-                return {
-                    'success': False,
-                    'results': [],
-                    'total_pages': 0,
-                    'completed_pages': 0,
-                    'failed_pages': 0,
-                    'errors': [f'Storyline {storyline_id} not found'],
-                    'output_dir': output_dir
-                }
-            
-            # Get the 12 page objects from the storyline
-            pages = storyline.get_pages()
-            
-            if len(pages) != 12:
-                return {
-                    'success': False,
-                    'results': [],
-                    'total_pages': len(pages),
-                    'completed_pages': 0,
-                    'failed_pages': 0,
-                    'errors': [f'Expected 12 pages but found {len(pages)}'],
-                    'output_dir': output_dir
-                }
+        # Load storyline from the in-memory story catalogue
+        storyline = story_catalog.get(storyline_id)
+        
+        if not storyline:
+            return {
+                'success': False,
+                'results': [],
+                'total_pages': 0,
+                'completed_pages': 0,
+                'failed_pages': 0,
+                'errors': [f'Storyline {storyline_id} not found'],
+                'output_dir': output_dir
+            }
+        
+        # Get the 12 page objects from the storyline (read-only, parsed when the catalogue loaded)
+        pages = storyline.pages
+        
+        if len(pages) != 12:
+            return {
+                'success': False,
+                'results': [],
+                'total_pages': len(pages),
+                'completed_pages': 0,
+                'failed_pages': 0,
+                'errors': [f'Expected 12 pages but found {len(pages)}'],
+                'output_dir': output_dir
+            }
+        
+        # A real book (cover + 12 pages, PDF and Book record) is built when it belongs to a user
+        build_book = bool(user_id and child_name)
+        if build_book and storyline_id not in PRE_ILLUSTRATED_STORYLINES:
+            return {
+                'success': False,
+                'results': [],
+                'total_pages': len(pages),
+                'completed_pages': 0,
+                'failed_pages': 0,
+                'errors': [f'Storyline {storyline_id} has no page illustrations; its books are generated '
+                           f'through /generate-story'],
+                'output_dir': output_dir
+            }
         
         print(f"\n{'='*60}")
         print(f"Starting parallel image generation for storyline: {storyline_id}")
@@ -1577,30 +1676,132 @@ def start_book_generation(storyline_id, user_image_path, output_dir=None, book_i
         completed_count = 0
         failed_count = 0
         
+        # Decode and analyse the user's photo once for the whole book
+        subject = prepare_book_subject(user_image_path, output_dir) if storyline_id in PRE_ILLUSTRATED_STORYLINES else None
+        
+        story_title = STORY_NAMES.get(storyline_id, 'Custom Story')
+        total_book_pages = len(pages) + 1
+        page_images = {}  # book page index (0 = cover, then page_number) -> image path
+        page_texts = {}   # book page index -> text data
+        full_pdf_path = relative_pdf_path = None
+        pdf_builder = None
+        if build_book:
+            full_pdf_path, relative_pdf_path = generate_book_filepath(user_id, storyline_id)
+            pdf_builder = new_pdf_builder(full_pdf_path, story_title, child_name, os.path.join(output_dir, 'pdf'))
+            # The cover shows the title only, so it has no page text
+            page_texts[0] = None
+            if pdf_builder is not None:
+                pdf_builder.set_text(0, None)
+        
+        # Page text (numbered like the PDF pages: the cover is page 1) is written in parallel with the images
+        text_page_prompts = storyline_text_page_prompts(pages, story_title, first_page_number=2) if build_book else []
+        text_seconds = []
+        
+        def batched_text_task():
+            text_start = time.time()
+            try:
+                return generate_all_page_texts(text_page_prompts, storyline_id, total_book_pages, child_name)
+            finally:
+                text_seconds.append(time.time() - text_start)
+        
+        def page_text_task(text_page_number, prompt_info):
+            text_start = time.time()
+            try:
+                return generate_page_text(prompt_info, storyline_id, text_page_number, total_book_pages, child_name)
+            except Exception as text_error:
+                print(f"Warning: Error generating text for page {text_page_number}: {text_error}")
+                return {"narrative": []}
+            finally:
+                text_seconds.append(time.time() - text_start)
+        
+        def record_text(book_index, text_data):
+            page_texts[book_index] = text_data
+            if pdf_builder is not None:
+                pdf_builder.set_text(book_index, text_data)
+        
+        def record_image(book_index, image_path):
+            page_images[book_index] = image_path
+            if pdf_builder is not None:
+                pdf_builder.set_image(book_index, image_path)
+        
         # Use ThreadPoolExecutor to manage parallel execution
-        # max_workers=12 allows all 12 pages to be generated simultaneously
-        with ThreadPoolExecutor(max_workers=12) as executor:
+        # max_workers covers all 12 pages plus the cover and the text request, so everything runs at once
+        # (the rate governor queues their OpenAI requests fairly against other books)
+        pages_done_at = None
+        governor_book = openai_governor.current_book() or book_id or f"{user_id}:{storyline_id}"
+        pool_size = len(pages) + 2
+        with ThreadPoolExecutor(max_workers=pool_size, initializer=openai_governor.enter_book, initargs=(governor_book,)) as executor, \
+                pool_threads.track(pool_size, pool='book_pages', state='total'):
+            def submit(fn, *args):
+                # Time on the pool counts towards the book_pages busy threads gauge
+                return executor.submit(_pool_task('book_pages', fn), *args)
+            
+            # Text and cover tasks first, so they are not queued behind the pages
+            text_futures = {}
+            if BATCHED_PAGE_TEXT and text_page_prompts:
+                text_futures[submit(batched_text_task)] = None
+            else:
+                for text_page_number, prompt_info in text_page_prompts:
+                    text_futures[submit(page_text_task, text_page_number, prompt_info)] = text_page_number
+            
+            # page_index -1 is the cover (Image1 for the pre-illustrated story)
+            cover_future = submit(
+                generate_page_image, {}, user_image_path, output_dir, -1, storyline_id, child_name, subject
+            ) if build_book else None
+            
             # Submit all 12 tasks simultaneously
             future_to_page = {}
             
             for page_index, page_data in enumerate(pages):
                 # Submit each page generation task
-                future = executor.submit(
+                future = submit(
                     generate_page_image,
                     page_data,
                     user_image_path,
                     output_dir,
                     page_index,
                     storyline_id,  # Pass storyline_id for pre-existing image detection
-                    child_name  # Pass child_name for text replacement (character_name parameter)
+                    child_name,  # Pass child_name for text replacement (character_name parameter)
+                    subject
                 )
                 future_to_page[future] = page_index
             
             print(f"✓ Submitted {len(future_to_page)} page generation tasks to ThreadPoolExecutor")
             
+            all_futures = list(text_futures) + list(future_to_page) + ([cover_future] if cover_future else [])
+            pages_remaining = len(future_to_page)
+            
             # Collect results as they complete (using as_completed for real-time processing)
-            for future in as_completed(future_to_page):
+            for future in as_completed(all_futures):
+                if future in text_futures:
+                    text_page_number = text_futures[future]
+                    try:
+                        text_result = future.result()
+                    except Exception as e:
+                        print(f"Warning: Error generating page text: {str(e)}")
+                        text_result = None
+                    if text_page_number is None:
+                        # Batched request: {text page number: text data}
+                        for batch_page_number, _ in text_page_prompts:
+                            record_text(batch_page_number - 1, (text_result or {}).get(batch_page_number))
+                    else:
+                        record_text(text_page_number - 1, text_result)
+                    continue
+                
+                if future is cover_future:
+                    cover_result = future.result()
+                    if cover_result['success']:
+                        record_image(0, cover_result['image_path'])
+                        print(f"✓ Cover completed successfully")
+                    else:
+                        errors.append(f"Cover: {cover_result['error']}")
+                        print(f"✗ Cover failed: {cover_result['error']}")
+                    continue
+                
                 page_index = future_to_page[future]
+                pages_remaining -= 1
+                if pages_remaining == 0:
+                    pages_done_at = time.time()
                 try:
                     result = future.result()
                     results.append(result)
@@ -1608,6 +1809,7 @@ def start_book_generation(storyline_id, user_image_path, output_dir=None, book_i
                     if result['success']:
                         completed_count += 1
                         print(f"✓ Page {result['page_number']} completed successfully")
+                        record_image(result['page_number'], result['image_path'])
                         
                         # Update page status tracker
                         page_status[result['page_number']] = {
@@ -1688,40 +1890,32 @@ def start_book_generation(storyline_id, user_image_path, output_dir=None, book_i
         print(f"Total pages: {len(pages)}")
         print(f"Completed: {completed_count}")
         print(f"Failed: {failed_count}")
+        print(f"Peak RSS: {_peak_rss_mb()} MB")
         print(f"{'='*60}\n")
         
-        # Send final completion event
-        if book_id:
-            _send_sse_event(book_id, 'generation_complete', {
-                'success': failed_count == 0,
-                'total_pages': len(pages),
-                'completed_pages': completed_count,
-                'failed_pages': failed_count,
-                'errors': errors,
-                'output_dir': output_dir,
-                'page_status': page_status
-            })
-        
         # Post-completion: Compile PDF and save to database
         pdf_path = None
         saved_book_id = None
+        pdf_seconds = None
         
-        if failed_count == 0 and user_id and child_name:
+        if build_book and failed_count == 0 and 0 in page_images:
             try:
-                # Generate book filepath using naming convention
-                full_pdf_path, relative_pdf_path = generate_book_filepath(user_id, storyline_id)
-                
-                # Simulate PDF compilation by creating an empty file
-                # In production, this would compile the actual PDF from generated images
-                with open(full_pdf_path, 'wb') as pdf_file:
-                    # Create a minimal PDF header (simulation)
-                    # In production, use reportlab or similar to create actual PDF
-                    pdf_file.write(b'%PDF-1.4\n')
-                    pdf_file.write(b'%Simulated PDF - Replace with actual PDF compilation\n')
-                    pdf_file.write(b'1 0 obj\n<< /Type /Catalog /Pages 2 0 R >>\nendobj\n')
-                    pdf_file.write(b'xref\n0 3\ntrailer\n<< /Size 3 /Root 1 0 R >>\nstartxref\n100\n%%EOF')
+                pdf_start = time.time()
+                if pdf_builder is not None:
+                    # Pages were rendered as they completed; only stitch them together
+                    with metrics.span('pdf'):
+                        pdf_stats = pdf_builder.finish(list(range(total_book_pages)))
+                else:
+                    pdf_stats = create_storybook_pdf(
+                        [page_images[i] for i in range(total_book_pages)],
+                        [page_texts.get(i) or {"narrative": []} for i in range(total_book_pages)],
+                        full_pdf_path,
+                        story_title,
+                        child_name
+                    )
+                pdf_seconds = time.time() - pdf_start
                 
-                print(f"✓ PDF created at: {full_pdf_path}")
+                print(f"✓ PDF created at: {full_pdf_path} ({pdf_stats['bytes']} bytes)")
                 
                 # Save book record to database
                 with app.app_context():
@@ -1757,6 +1951,36 @@ def start_book_generation(storyline_id, user_image_path, output_dir=None, book_i
                 print(f"✗ {error_msg}")
                 # Don't fail the entire generation if saving fails
                 errors.append(error_msg)
+        elif build_book and failed_count == 0:
+            errors.append("Book not saved: the cover could not be generated")
+        
+        if pdf_builder is not None:
+            pdf_builder.cleanup()
+        
+        timings = {
+            'pages_seconds': round((pages_done_at or time.time()) - generation_start, 3),
+            'text_seconds': round(max(text_seconds), 3) if text_seconds else None,
+            'pdf_seconds': round(pdf_seconds, 3) if pdf_seconds is not None else None,
+            'total_seconds': round(time.time() - generation_start, 3)
+        }
+        app_logger.info(
+            f"Book generation for {storyline_id} finished in {timings['total_seconds']}s "
+            f"(pages {timings['pages_seconds']}s, text {timings['text_seconds']}s, PDF {timings['pdf_seconds']}s)"
+        )
+        
+        # Send final completion event
+        if book_id:
+            _send_sse_event(book_id, 'generation_complete', {
+                'success': failed_count == 0,
+                'total_pages': len(pages),
+                'completed_pages': completed_count,
+                'failed_pages': failed_count,
+                'errors': errors,
+                'output_dir': output_dir,
+                'page_status': page_status,
+                'pdf_path': pdf_path,
+                'timings': timings
+            })
         
         return {
             'success': failed_count == 0,
@@ -1768,7 +1992,8 @@ def start_book_generation(storyline_id, user_image_path, output_dir=None, book_i
             'output_dir': output_dir,
             'page_status': page_status,
             'pdf_path': pdf_path,
-            'book_id': saved_book_id
+            'book_id': saved_book_id,
+            'timings': timings
         }
     
     except Exception as e:
@@ -1783,6 +2008,8 @@ def start_book_generation(storyline_id, user_image_path, output_dir=None, book_i
             'errors': [error_msg],
             'output_dir': output_dir if 'output_dir' in locals() else None
         }
+    finally:
+        active_books.dec(path='parallel')
 
 def extract_consistency_info_from_image(image_path, page_description, story_choice):
     """
@@ -1791,16 +2018,6 @@ def extract_consistency_info_from_image(image_path, page_description, story_choi
     Returns a structured dictionary for RAG storage.
     """
     try:
-        # Read and encode image
-        with open(image_path, 'rb') as img_file:
-            img_data = img_file.read()
-        
-        img = Image.open(io.BytesIO(img_data))
-        img_format = img.format.lower() if img.format else 'jpeg'
-        mime_type = f"image/{img_format}"
-        img_base64 = base64.b64encode(img_data).decode('utf-8')
-        data_url = f"data:{mime_type};base64,{img_base64}"
-        
         # Determine what to extract based on story
         extraction_prompt = f"""Analyze this children's book illustration (page: {page_description}) and extract EXACT details for consistency:
 
@@ -1827,23 +2044,14 @@ def extract_consistency_info_from_image(image_path, page_description, story_choi
 
 Format as JSON with keys: character_features, objects, style. Be extremely specific - these details must match exactly across all pages."""
         
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {"type": "text", "text": extraction_prompt},
-                        {"type": "image_url", "image_url": {"url": data_url}}
-                    ]
-                }
-            ],
-            response_format={"type": "json_object"},
-            max_tokens=500
+        content = _vision_completion(
+            image_path,
+            'consistency_info',
+            extraction_prompt,
+            max_tokens=500,
+            json_mode=True
         )
         
-        import json
-        content = response.choices[0].message.content
         try:
             consistency_info = json.loads(content)
             return consistency_info
@@ -1860,162 +2068,157 @@ Format as JSON with keys: character_features, objects, style. Be extremely speci
         print(f"Error extracting consistency info: {str(e)}")
         return None
 
-def create_embedding(text: str) -> List[float]:
+@metrics.timed('embedding')
+def create_embedding(text: str):
     """
     Create an embedding for text using OpenAI's text-embedding-3-small model.
+    
+    Texts in the embedding store (static page queries, see precompute_static_embeddings)
+    are read from disk; others are sent in a batched request shared with concurrent calls.
+    
+    Returns:
+        float array (list of floats without NumPy), or None on error
     """
     try:
-        response = client.embeddings.create(
-            model="text-embedding-3-small",
-            input=text
-        )
-        return response.data[0].embedding
+        return embedding_service.embed(text)
     except Exception as e:
         print(f"Error creating embedding: {str(e)}")
         return None
 
-def cosine_similarity(vec1: List[float], vec2: List[float]) -> float:
+def rag_query_text(prompt_info):
     """
-    Calculate cosine similarity between two vectors.
-    Uses numpy if available, otherwise falls back to pure Python.
+    Build the RAG query for a page from its description and prompt.
+    
+    The query only depends on the story page, so it is the same for every book and
+    its embedding can be precomputed.
     """
-    try:
-        # Try numpy first (faster) if available
-        if HAS_NUMPY and np is not None:
-            try:
-                vec1_arr = np.array(vec1)
-                vec2_arr = np.array(vec2)
-                return np.dot(vec1_arr, vec2_arr) / (np.linalg.norm(vec1_arr) * np.linalg.norm(vec2_arr))
-            except Exception:
-                pass  # Fall through to pure Python implementation
-        
-        # Fallback to pure Python if numpy not available or failed
-        dot_product = sum(a * b for a, b in zip(vec1, vec2))
-        magnitude1 = sum(a * a for a in vec1) ** 0.5
-        magnitude2 = sum(b * b for b in vec2) ** 0.5
-        if magnitude1 == 0 or magnitude2 == 0:
-            return 0.0
-        return dot_product / (magnitude1 * magnitude2)
-    except Exception as e:
-        print(f"Error calculating similarity: {str(e)}")
-        return 0.0
+    return f"{prompt_info['description']} {prompt_info['prompt'][:200]}"
+
+def static_rag_query_texts(story_choice=None):
+    """
+    Collect the RAG query texts of the static story pages.
+    
+    Args:
+        story_choice: Only this STORYBOOK_PROMPTS story (None: every story and every storyline)
+    
+    Returns:
+        list: Query texts (both genders where a prompt uses {gender})
+    """
+    texts = []
+    stories = [story_choice] if story_choice else list(STORYBOOK_PROMPTS)
+    for story in stories:
+        for page in STORYBOOK_PROMPTS.get(story, {}).get('pages', []):
+            for gender in ('boy', 'girl'):
+                texts.append(rag_query_text({'description': page['description'],
+                                             'prompt': page['prompt'].replace('{gender}', gender)}))
+    if story_choice is None:
+        try:
+            for storyline in story_catalog.all():
+                for _, page_data in storyline_text_page_prompts(storyline.pages, storyline.name):
+                    page_data['prompt'] = page_data['prompt'].replace('{gender}', storyline.gender or 'child')
+                    texts.append(rag_query_text(page_data))
+        except Exception as e:
+            print(f"⚠️  Warning: Could not read storylines for embedding precompute: {str(e)}")
+    # Keep order, drop duplicates
+    return list(dict.fromkeys(texts))
+
+def precompute_static_embeddings(story_choice=None):
+    """
+    Embed and persist every static RAG query text that is not in the embedding store yet.
+    
+    Run once after deploying or changing stories (missing texts are also embedded on
+    the first book of each story):
+        python -c "from project import precompute_static_embeddings; precompute_static_embeddings()"
+    
+    Args:
+        story_choice: Only this STORYBOOK_PROMPTS story (None: everything)
+    
+    Returns:
+        int: Number of texts embedded
+    """
+    texts = static_rag_query_texts(story_choice)
+    added = embedding_service.precompute(texts)
+    if added:
+        print(f"✓ Embedding store: added {added} of {len(texts)} static query texts")
+    return added
 
-def retrieve_relevant_context(query_text: str, context_store: List[Dict], top_k: int = 3) -> List[Dict]:
+def retrieve_relevant_context(query_text: str, context_store, top_k: int = 3) -> List[Dict]:
     """
     Use RAG to retrieve the most relevant context chunks from previous images.
     
     Args:
         query_text: The current page description or prompt to find relevant context for
-        context_store: List of previous image contexts with embeddings
+        context_store: VectorIndex of previous image contexts (or a list of context dicts
+                       with an 'embedding' key, indexed on the fly)
         top_k: Number of top relevant chunks to retrieve
     
     Returns:
         List of top_k most relevant context chunks
     """
-    if not context_store:
+    if not isinstance(context_store, VectorIndex):
+        index = VectorIndex()
+        for context in context_store or []:
+            index.add(context.get('embedding'), context)
+        context_store = index
+    if not len(context_store):
         return []
     
     try:
         # Create embedding for query
         query_embedding = create_embedding(query_text)
-        if not query_embedding:
-            return context_store[:top_k]  # Fallback to first items
-        
-        # Calculate similarities
-        similarities = []
-        for context in context_store:
-            if context.get('embedding'):
-                similarity = cosine_similarity(query_embedding, context['embedding'])
-                similarities.append((similarity, context))
-        
-        # Sort by similarity and return top_k
-        similarities.sort(key=lambda x: x[0], reverse=True)
-        return [context for _, context in similarities[:top_k]]
+        if query_embedding is None:
+            return context_store.items()[:top_k]  # Fallback to first items
+        
+        # One matrix-vector product over every stored context
+        return [context for _, context in context_store.search(query_embedding, top_k)]
     except Exception as e:
         print(f"Error in RAG retrieval: {str(e)}")
-        return context_store[:top_k]  # Fallback
+        return context_store.items()[:top_k]  # Fallback
 
-def generate_character_consistency_rules(child_appearance, story_choice, is_cover=False):
-    """
-    Generate comprehensive character consistency rules for image generation.
-    These rules ensure the child looks identical across all pages.
-    
-    Args:
-        child_appearance: Description of child's appearance from photo
-        story_choice: 'red' or 'jack'
-        is_cover: Whether this is the cover page
-    
-    Returns:
-        Formatted string with consistency rules
-    """
-    # Truncate child appearance to fit within prompt limits
-    child_appearance_short = child_appearance[:250] if len(child_appearance) > 250 else child_appearance
-    
-    if story_choice == 'red':
-        rules = f"""CORE CHARACTER CONSISTENCY RULES - MANDATORY:
-- The child character MUST look EXACTLY like the reference photo in every single image
-- Based on photo: {child_appearance_short}
-- ALWAYS maintain: same age, ethnicity, hair color & hairstyle, face shape, skin tone, eye color & shape
-- The child must ALWAYS look like the same real child across all pages - NO variations
-
-LITTLE RED RIDING HOOD SPECIFIC:
-- Red cloak/cape: Keep the EXACT same shade of red, style, length, and details in every page
-- Basket: Must contain the EXACT same items (bread, cakes, wine bottle) with same appearance
-- The child's face must be identical to the photo in every illustration"""
-    
-    elif story_choice == 'jack':
-        rules = f"""CORE CHARACTER CONSISTENCY RULES - MANDATORY:
-- The child character MUST look EXACTLY like the reference photo in every single image
-- Based on photo: {child_appearance_short}
-- ALWAYS maintain: same age, ethnicity, hair color & hairstyle, face shape, skin tone, eye color & shape
-- The child must ALWAYS look like the same real child across all pages - NO variations
-
-JACK AND THE BEANSTALK SPECIFIC:
-- Magic beans: Keep EXACT same color, size, and glow effect when shown
-- Treasure: Maintain EXACT same appearance (golden egg or coins) with same details
-- Beanstalk: Keep EXACT same green shade, leaf size, and sparkle details
-- The child's face must be identical to the photo in every illustration"""
-    
-    else:
-        rules = f"""CORE CHARACTER CONSISTENCY RULES - MANDATORY:
-- The child character MUST look EXACTLY like the reference photo in every single image
-- Based on photo: {child_appearance_short}
-- ALWAYS maintain: same age, ethnicity, hair color & hairstyle, face shape, skin tone, eye color & shape
-- The child must ALWAYS look like the same real child across all pages - NO variations"""
-    
-    return rules
+PAGE_TEXT_SYSTEM_PROMPT = "You are a children's book writer who creates simple, engaging text for picture books. Always provide narrative text - it is required."
+
+STORY_NAMES = {
+    'red': 'Little Red Riding Hood',
+    'jack': 'Jack and the Beanstalk'
+}
+
+def _extract_json_text(text_content):
+    """Strip markdown code fences (```json ... ```) from a model response."""
+    if '```json' in text_content:
+        return text_content.split('```json')[1].split('```')[0].strip()
+    if '```' in text_content:
+        return text_content.split('```')[1].split('```')[0].strip()
+    return text_content
+
+def _clean_narrative(narrative):
+    """Return the non-empty sentences of a narrative value, or [] if it is not a list."""
+    if not isinstance(narrative, list):
+        return []
+    return [n for n in narrative if isinstance(n, str) and n.strip()]
 
-def generate_style_consistency_rules(is_cover=False, style_description=None):
+def _fallback_page_narrative(prompt_info, story_name, page_number, character_name):
     """
-    Generate style consistency rules for the entire storybook.
-    
-    Args:
-        is_cover: Whether this is the cover page
-        style_description: Style description from cover (if available)
+    Build a simple narrative from the page description when the model gave no usable text.
     
     Returns:
-        Formatted string with style rules
+        list: Narrative sentences using the character name
     """
-    if is_cover:
-        return """STYLE RULES - APPLY TO ALL PAGES:
-- Soft illustrated children's book style
-- Warm lighting, gentle colors, magical fairy-tale tone
-- Watercolor/painterly technique with soft brushstrokes
-- No anime style, no hyper-realism, no style changes between pages
-- Consistent art style for the entire book - gentle, emotional, dreamy atmosphere"""
-    else:
-        if style_description:
-            style_short = style_description[:200] if len(style_description) > 200 else style_description
-            return f"""STYLE RULES - MATCH COVER EXACTLY:
-- Use the EXACT same style as the cover page: {style_short}
-- Same color palette, brushwork, lighting, edge quality, and aesthetic
-- No style changes - must be visually identical to cover page"""
-        else:
-            return """STYLE RULES:
-- Soft illustrated children's book style
-- Warm lighting, gentle colors, magical fairy-tale tone
-- Consistent art style - gentle, emotional, dreamy atmosphere"""
-
+    desc = prompt_info.get('description', '').lower()
+    if 'cover' in desc:
+        return [f"Welcome to the story of {story_name}, featuring {character_name}."]
+    elif 'child' in desc or 'jack' in desc or 'red' in desc:
+        # Create narrative based on common story elements using character name
+        if 'walking' in desc or 'forest' in desc:
+            return [f"{character_name} walked through the magical forest."]
+        elif 'mother' in desc or 'home' in desc:
+            return [f"{character_name} was at home with their mother."]
+        elif 'beanstalk' in desc:
+            return [f"{character_name} looked up at the enormous beanstalk."]
+        elif 'castle' in desc or 'giant' in desc:
+            return [f"{character_name} discovered a magnificent castle in the clouds."]
+    return [f"{character_name}'s adventure continues on page {page_number}."]
+
+@metrics.timed('page_text')
 def generate_page_text(prompt_info, story_choice, page_number, total_pages, character_name):
     """
     Generate text content (speech bubbles and narrative) for a storybook page.
@@ -2027,11 +2230,7 @@ def generate_page_text(prompt_info, story_choice, page_number, total_pages, char
         total_pages: Total number of pages
         character_name: The name of the main character to use in the story
     """
-    story_context = {
-        'red': 'Little Red Riding Hood',
-        'jack': 'Jack and the Beanstalk'
-    }
-    story_name = story_context.get(story_choice, 'Story')
+    story_name = STORY_NAMES.get(story_choice, 'Story')
     
     # Create a more detailed prompt that uses the actual page prompt description
     page_prompt_text = prompt_info.get('prompt', '')[:200]  # Use first 200 chars of image prompt for context
@@ -2071,7 +2270,7 @@ IMPORTANT:
             messages=[
                 {
                     "role": "system",
-                    "content": "You are a children's book writer who creates simple, engaging text for picture books. Always provide narrative text - it is required."
+                    "content": PAGE_TEXT_SYSTEM_PROMPT
                 },
                 {
                     "role": "user",
@@ -2085,43 +2284,18 @@ IMPORTANT:
         text_content = response.choices[0].message.content
         
         # Try to parse JSON from response
-        import json
         try:
             # Extract JSON from response if it's wrapped in markdown
-            if '```json' in text_content:
-                text_content = text_content.split('```json')[1].split('```')[0].strip()
-            elif '```' in text_content:
-                text_content = text_content.split('```')[1].split('```')[0].strip()
+            text_content = _extract_json_text(text_content)
             
             text_data = json.loads(text_content)
             
-            # Validate and ensure we have narrative text
-            if not text_data.get('narrative'):
-                text_data['narrative'] = []
-            
-            # Filter out empty strings
-            text_data['narrative'] = [n for n in text_data['narrative'] if n and n.strip()]
+            # Validate and ensure we have narrative text (filtering out empty strings)
+            text_data['narrative'] = _clean_narrative(text_data.get('narrative'))
             
             # If no narrative after filtering, create a fallback based on description
             if not text_data['narrative']:
-                # Create simple narrative from description using character name
-                desc = prompt_info['description'].lower()
-                if 'cover' in desc:
-                    text_data['narrative'] = [f"Welcome to the story of {story_name}, featuring {character_name}."]
-                elif 'child' in desc or 'jack' in desc or 'red' in desc:
-                    # Create narrative based on common story elements using character name
-                    if 'walking' in desc or 'forest' in desc:
-                        text_data['narrative'] = [f"{character_name} walked through the magical forest."]
-                    elif 'mother' in desc or 'home' in desc:
-                        text_data['narrative'] = [f"{character_name} was at home with their mother."]
-                    elif 'beanstalk' in desc:
-                        text_data['narrative'] = [f"{character_name} looked up at the enormous beanstalk."]
-                    elif 'castle' in desc or 'giant' in desc:
-                        text_data['narrative'] = [f"{character_name} discovered a magnificent castle in the clouds."]
-                    else:
-                        text_data['narrative'] = [f"{character_name}'s adventure continues on page {page_number}."]
-                else:
-                    text_data['narrative'] = [f"{character_name}'s adventure continues on page {page_number}."]
+                text_data['narrative'] = _fallback_page_narrative(prompt_info, story_name, page_number, character_name)
             
             return text_data
         except Exception as parse_error:
@@ -2136,11 +2310,114 @@ IMPORTANT:
     except Exception as e:
         print(f"Error generating page text: {str(e)}")
         # Always return at least some narrative text as fallback using character name
-        desc = prompt_info.get('description', f'Page {page_number}')
         return {
             "narrative": [f"{character_name}'s story continues on page {page_number}."]
         }
 
+@metrics.timed('page_text_batch')
+def generate_all_page_texts(page_prompts, story_choice, total_pages, character_name):
+    """
+    Generate the narrative for every page of a book in a single structured request.
+    
+    The shared instructions are sent once and the model returns one JSON object keyed
+    by page number. Each entry is validated on its own; pages with a missing or empty
+    narrative fall back to the description-based narrative used by generate_page_text.
+    
+    Args:
+        page_prompts: List of (page_number, prompt_info) tuples
+        story_choice: 'red' or 'jack'
+        total_pages: Total number of pages in the book
+        character_name: The name of the main character to use in the story
+    
+    Returns:
+        dict: Mapping of page_number to text data ({"narrative": [...]})
+    """
+    story_name = STORY_NAMES.get(story_choice, 'Story')
+    if not page_prompts:
+        return {}
+    
+    page_sections = []
+    for page_number, prompt_info in page_prompts:
+        page_sections.append(
+            f"PAGE {page_number}:\n"
+            f"Page description: {prompt_info.get('description', '')}\n"
+            f"Page scene: {prompt_info.get('prompt', '')[:200]}"
+        )
+    pages_text = "\n\n".join(page_sections)
+    
+    text_prompt = f"""Create storybook text for the following {len(page_prompts)} pages of the {total_pages}-page children's storybook "{story_name}".
+
+{pages_text}
+
+CRITICAL: The main character's name is "{character_name}". Use this name throughout the text instead of "the child" or generic terms.
+
+For EACH page, write 2-3 simple sentences that tell the story for that page. The text should:
+- Use the character's name "{character_name}" when referring to the main character
+- Be written in third person, simple past tense
+- Be age-appropriate for 4-8 year olds
+- Match what's happening in the illustration
+- Be engaging and easy to read
+- Each sentence should be 8-15 words maximum
+- Flow naturally from one page to the next
+
+Examples (using character name "{character_name}"):
+- "{character_name} walked through the magical forest. Birds and butterflies danced around {character_name}."
+- "{character_name} climbed up the enormous beanstalk. Higher and higher {character_name} went into the clouds."
+
+Format as JSON with one entry per page number:
+{{
+  "pages": {{
+    "<page number>": {{"narrative": ["sentence 1", "sentence 2", "sentence 3"]}}
+  }}
+}}
+
+IMPORTANT: 
+- You MUST include every page number listed above, each with at least 2 narrative sentences.
+- Always use the character's name "{character_name}" instead of "the child" or generic pronouns when referring to the main character."""
+
+    pages_data = {}
+    try:
+        response = client.chat.completions.create(
+            model="gpt-4",
+            messages=[
+                {
+                    "role": "system",
+                    "content": PAGE_TEXT_SYSTEM_PROMPT
+                },
+                {
+                    "role": "user",
+                    "content": text_prompt
+                }
+            ],
+            max_tokens=min(4000, 120 * len(page_prompts) + 100),
+            temperature=0.7
+        )
+        text_content = _extract_json_text(response.choices[0].message.content)
+        parsed = json.loads(text_content)
+        pages_data = parsed.get('pages', parsed) if isinstance(parsed, dict) else {}
+        if not isinstance(pages_data, dict):
+            pages_data = {}
+    except Exception as e:
+        print(f"Error generating batched page text: {str(e)}. Using description-based fallbacks.")
+    
+    text_by_page = {}
+    fallback_pages = []
+    for page_number, prompt_info in page_prompts:
+        entry = pages_data.get(str(page_number), pages_data.get(page_number))
+        if isinstance(entry, dict):
+            narrative = _clean_narrative(entry.get('narrative'))
+        else:
+            # Accept a bare list of sentences as the page entry
+            narrative = _clean_narrative(entry)
+        if not narrative:
+            narrative = _fallback_page_narrative(prompt_info, story_name, page_number, character_name)
+            fallback_pages.append(page_number)
+        text_by_page[page_number] = {"narrative": narrative}
+    
+    print(f"✓ Batched text generated for {len(page_prompts)} pages in one request"
+          f"{f' (fallback used for pages {fallback_pages})' if fallback_pages else ''}")
+    return text_by_page
+
 HTML_TEMPLATE = '''
 <!DOCTYPE html>
 <html lang="en">
@@ -2781,6 +3058,64 @@ HTML_TEMPLATE = '''
 </html>
 '''
 
+# DALL-E 3 rejects prompts over 4000 characters
+DALLE_PROMPT_MAX_LENGTH = 4000
+
+# Story page prompt for DALL-E books (see prompt_builder.py). The outfit sections are bound once per
+# book; the page prompt, master reference, previous page line and RAG context are filled in for each
+# page. If a page would go over the budget, the RAG context is shortened first, then the previous page
+# line, then the master reference.
+DALLE_PAGE_PROMPT = PromptTemplate(
+    """{page_prompt}
+
+================================================================================
+CONSISTENCY LOCK - MANDATORY FOR ALL PAGES AFTER THE FIRST:
+================================================================================
+
+Use the FIRST illustration as the face reference. Also match the style and facial identity from the previous page. Match the reference child's face EXACTLY — identical facial features, proportions, eyes, nose, mouth, cheeks, skin tone, hair color and length, and age. Do NOT alter, stylize, or reinterpret the child's face or age. SAME hairstyle, {outfit_consistency_lock}, SAME art style, SAME brush texture, SAME lighting and color palette. If the face does not match, regenerate.
+
+================================================================================
+MASTER REFERENCE (FIRST ILLUSTRATION) CHARACTER DETAILS:
+================================================================================
+
+{master_reference}
+{previous_page}{rag_context}
+
+================================================================================
+OUTFIT & STYLE RULES:
+================================================================================
+
+{outfit_rules}
+- Soft watercolor storybook style.
+- No realism, no anime, no style changes.
+- SAME illustration style, SAME brush style, SAME lighting, SAME fairy-tale tone as the first image.
+
+================================================================================
+CHARACTER RULES:
+================================================================================
+
+{wolf_rule}
+- Hunter is always a human adult male (not a wolf or animal).
+- No animal-human hybrids.
+
+================================================================================
+QUALITY CHECK:
+================================================================================
+
+If the child does not match the reference identity or the style changes:
+- Prioritize facial identity match before style variation
+- Regenerate up to 3 times if needed
+- The child MUST look EXACTLY like the FIRST illustration in EVERY image.
+================================================================================""",
+    slots=[
+        Slot('page_prompt', priority=2),
+        Slot('master_reference', max_chars=400, priority=1),
+        Slot('previous_page', priority=0),
+        Slot('rag_context', priority=-1)
+    ],
+    max_length=DALLE_PROMPT_MAX_LENGTH
+)
+
 def truncate_prompt_for_dalle(prompt_text, max_length=4000):
     """
     Truncate prompt to fit DALL-E 3's maximum length requirement (4000 characters).
@@ -2837,13 +3172,15 @@ def truncate_prompt_for_dalle(prompt_text, max_length=4000):
     print(f"Truncated prompt to {len(truncated)} characters")
     return truncated
 
-def generate_image_with_dalle(prompt_text, reference_image_path=None):
+@metrics.timed('dalle')
+def generate_image_with_dalle(prompt_text, reference_image_path=None, response_format='url'):
     """
     Generate an image using OpenAI's DALL-E API.
     
     Args:
         prompt_text: The text prompt for image generation
         reference_image_path: Optional path to reference image (child's photo)
+        response_format: 'url' or 'b64_json'
     
     Returns:
         URL or base64 data of generated image
@@ -2859,14 +3196,119 @@ def generate_image_with_dalle(prompt_text, reference_image_path=None):
             size="1024x1024",
             quality="standard",
             n=1,
+            response_format=response_format,
         )
         
+        if response_format == 'b64_json':
+            return response.data[0].b64_json
         image_url = response.data[0].url
         return image_url
     except Exception as e:
         print(f"Error generating image: {str(e)}")
         raise
 
+# Base64 is decoded in slices of this many characters (a multiple of 4) so the whole
+# image is never held twice in memory
+B64_DECODE_CHUNK = 1024 * 1024
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+# Per-mode totals for storing DALL-E results: images written and seconds spent
+# between the API response and the file being on disk
+dalle_store_stats = {'b64_json': {'images': 0, 'seconds': 0.0}, 'url': {'images': 0, 'seconds': 0.0}}
+dalle_store_lock = threading.Lock()
+
+def write_base64_image(b64_data, output_path):
+    """
+    Decode base64 image data straight into a file, without decoding the pixels.
+    
+    The file is written under a temporary name and renamed into place, so readers
+    never see a partly written image.
+    
+    Args:
+        b64_data: Base64-encoded PNG data
+        output_path: Destination file path
+    
+    Returns:
+        int: Number of bytes written
+    """
+    tmp_path = f"{output_path}.part"
+    written = 0
+    try:
+        with open(tmp_path, 'wb') as f:
+            for start in range(0, len(b64_data), B64_DECODE_CHUNK):
+                chunk = base64.b64decode(b64_data[start:start + B64_DECODE_CHUNK])
+                if start == 0 and not chunk.startswith(PNG_SIGNATURE):
+                    raise ValueError("DALL-E response is not PNG data")
+                f.write(chunk)
+                written += len(chunk)
+        os.replace(tmp_path, output_path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return written
+
+def save_dalle_image(prompt_text, output_path, reference_image_path=None):
+    """
+    Generate an image with DALL-E and save it to a file.
+    
+    In b64_json mode (DALLE_RESPONSE_FORMAT) the PNG bytes arrive in the API response and
+    are written to disk as-is: no download from the result URL and no PIL decode/encode.
+    Pixels are only decoded later by the stages that need them (vision checks, PDF encoding).
+    In url mode the image is downloaded and re-saved through PIL.
+    
+    Args:
+        prompt_text: The text prompt for image generation
+        output_path: PNG file path to write
+        reference_image_path: Optional path to reference image (child's photo)
+    
+    Returns:
+        dict: {'path': output_path, 'mode': response format, 'generate_seconds': float,
+               'store_seconds': float (download / decode / write time after the API call)}
+    """
+    mode = DALLE_RESPONSE_FORMAT
+    generate_start = time.time()
+    image_data = generate_image_with_dalle(prompt_text, reference_image_path, response_format=mode)
+    store_start = time.time()
+    
+    if not image_data:
+        raise ValueError(f"DALL-E response had no {mode} data")
+    if mode == 'b64_json':
+        write_base64_image(image_data, output_path)
+    else:
+        img = download_image_from_url(image_data)
+        img.save(output_path)
+    
+    store_seconds = time.time() - store_start
+    metrics.stage_seconds.observe(store_seconds, stage='dalle_store', outcome='ok')
+    with dalle_store_lock:
+        dalle_store_stats[mode]['images'] += 1
+        dalle_store_stats[mode]['seconds'] += store_seconds
+    return {
+        'path': output_path,
+        'mode': mode,
+        'generate_seconds': round(store_start - generate_start, 3),
+        'store_seconds': round(store_seconds, 4)
+    }
+
+def dalle_image_stats():
+    """
+    Return per-mode DALL-E store counters for monitoring.
+    
+    Returns:
+        dict: mode -> {'images', 'seconds', 'avg_ms'}
+    """
+    with dalle_store_lock:
+        return {
+            mode: {
+                'images': stats['images'],
+                'seconds': round(stats['seconds'], 3),
+                'avg_ms': round(1000 * stats['seconds'] / stats['images'], 1) if stats['images'] else 0.0
+            }
+            for mode, stats in dalle_store_stats.items()
+        }
+
+@metrics.timed('image_download')
 def download_image_from_url(url):
     """
     Download an image from a URL and return as PIL Image.
@@ -2878,7 +3320,8 @@ def download_image_from_url(url):
         PIL Image object
     """
     try:
-        response = requests.get(url, timeout=30)
+        # Keep-alive connection from the shared pool (see http_transport.py)
+        response = http_transport.client.get(url, timeout=httpx.Timeout(IMAGE_DOWNLOAD_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT))
         response.raise_for_status()
         img = Image.open(io.BytesIO(response.content))
         return img
@@ -2886,7 +3329,60 @@ def download_image_from_url(url):
         print(f"Error downloading image: {str(e)}")
         raise
 
-def create_storybook_pdf(image_paths, text_data_list, output_path, story_title, character_name):
+def encode_pdf_images(image_paths, profile):
+    """
+    Re-encode page images for a PDF profile, in parallel on the compositing workers.
+    
+    Args:
+        image_paths: List of image file paths in order
+        profile: PdfProfile
+    
+    Returns:
+        list: Per page, an ImageReader over the encoded JPEG, or the original path
+              (lossless profile, or if encoding the page failed)
+    """
+    if profile.lossless:
+        return list(image_paths)
+    from reportlab.lib.utils import ImageReader
+    
+    futures = [
+        compositing_engine.submit(profile.job(img_path), task=encode_pdf_image) if os.path.exists(img_path) else None
+        for img_path in image_paths
+    ]
+    images = []
+    for img_path, future in zip(image_paths, futures):
+        if future is None:
+            images.append(img_path)
+            continue
+        try:
+            result = future.result()
+            images.append(ImageReader(io.BytesIO(result['jpeg'])))
+        except Exception as e:
+            print(f"Warning: Could not re-encode {img_path} for the PDF ({str(e)}); embedding the original")
+            images.append(img_path)
+    return images
+
+def new_pdf_builder(output_path, story_title, character_name, fragment_dir):
+    """
+    Create an incremental PDF builder that renders pages on the compositing workers.
+    
+    Returns:
+        IncrementalPdfBuilder, or None if incremental assembly is disabled or unavailable
+        (callers then use create_storybook_pdf once every page is done)
+    """
+    if not (PDF_INCREMENTAL and PYPDF_AVAILABLE):
+        return None
+    return IncrementalPdfBuilder(
+        output_path,
+        story_title,
+        character_name,
+        fragment_dir,
+        profile=PDF_PROFILE,
+        submit=compositing_engine.submit
+    )
+
+@metrics.timed('pdf')
+def create_storybook_pdf(image_paths, text_data_list, output_path, story_title, character_name, profile=None):
     """
     Create a PDF storybook with traditional layout: image on top, text at bottom.
     
@@ -2896,17 +3392,20 @@ def create_storybook_pdf(image_paths, text_data_list, output_path, story_title,
         output_path: Path to save the PDF
         story_title: Title of the story
         character_name: Name of the main character for the cover title
+        profile: PDF profile name (see pdf_profiles.py); defaults to PDF_PROFILE
+    
+    Returns:
+        dict: profile, bytes, encode_seconds and build_seconds of the written PDF
     """
-    # Page size: 8.5 inches x 8.5 inches
-    page_width = 8.5 * inch
-    page_height = 8.5 * inch
+    build_start = time.time()
+    pdf_profile = get_pdf_profile(profile or PDF_PROFILE)
     
-    # Storybook layout: text on top, image below
-    text_area_height = 1.5 * inch  # Text area at top
-    image_height = 7 * inch  # Image area below text
+    # Downsample and JPEG-encode every page image up front, in parallel
+    page_images = encode_pdf_images(image_paths, pdf_profile)
+    encode_seconds = time.time() - build_start
     
     print(f"Creating PDF canvas at: {output_path}")
-    c = canvas.Canvas(output_path, pagesize=(page_width, page_height))
+    c = open_pdf_canvas(output_path)
     
     print(f"Processing {len(image_paths)} images for PDF...")
     for i, img_path in enumerate(image_paths):
@@ -2924,103 +3423,11 @@ def create_storybook_pdf(image_paths, text_data_list, output_path, story_title,
             # Yield control to eventlet periodically to prevent blocking
             eventlet.sleep(0)
             
-            # Get text for this page first
-            narrative_text = ""
-            if i < len(text_data_list) and text_data_list[i]:
-                text_data = text_data_list[i]
-                narrative_list = text_data.get('narrative', [])
-                
-                # Filter out empty strings
-                if narrative_list:
-                    narrative_list = [n for n in narrative_list[:3] if n and n.strip()]  # Max 3 sentences
-                
-                # If no narrative, create a fallback
-                if not narrative_list:
-                    if i == 0:
-                        narrative_list = ["Once upon a time..."]
-                    else:
-                        narrative_list = ["And so the story continued..."]
-                
-                # Join narrative into text
-                narrative_text = " ".join(narrative_list)
-            
-            # Draw image first (full page)
-            # Note: drawImage can be slow with large images, but we yield after
-            c.drawImage(img_path, 0, 0, width=page_width, height=page_height, preserveAspectRatio=False)
-            
-            # Yield after drawing image (this is a potentially slow operation)
-            # This allows eventlet to handle other requests during PDF creation
-            eventlet.sleep(0.01)  # Small delay to ensure eventlet can process other requests
-            
-            # For cover page (i=0), draw title with character name
-            if i == 0:
-                # Create title text: "Story Title featuring Character Name"
-                title_text = f"{story_title} featuring {character_name}"
-                
-                # Use a large, bold font for the title
-                c.setFont("Helvetica-Bold", 28)
-                
-                # Calculate title dimensions
-                title_width = c.stringWidth(title_text, "Helvetica-Bold", 28)
-                title_height = 35
-                title_y = page_height - 1.2 * inch
-                
-                # Draw semi-transparent background for title
-                title_bg_height = title_height + 0.4 * inch
-                c.setFillColorRGB(1, 1, 1, alpha=0.9)  # More opaque for title readability
-                c.rect(0, page_height - title_bg_height, page_width, title_bg_height, fill=1, stroke=0)
-                
-                # Draw title text centered
-                c.setFillColorRGB(0.1, 0.1, 0.1)  # Dark text color
-                c.setFont("Helvetica-Bold", 28)
-                title_x = (page_width - title_width) / 2
-                c.drawString(title_x, title_y, title_text)
+            # Get text for this page first
+            narrative_text = page_narrative_text(i, text_data_list[i] if i < len(text_data_list) else None)
             
-            # Draw storybook-style text on top of image (at the top of the page) for story pages
-            elif narrative_text and narrative_text.strip():
-                # Set up text area with margins
-                margin = 0.5 * inch
-                max_width = page_width - 2 * margin
-                
-                # Use a child-friendly font size
-                c.setFont("Helvetica", 16)
-                
-                # Word wrap the text
-                words = narrative_text.split()
-                lines = []
-                current_line = ""
-                
-                for word in words:
-                    test_line = current_line + (" " if current_line else "") + word
-                    if c.stringWidth(test_line, "Helvetica", 16) < max_width:
-                        current_line = test_line
-                    else:
-                        if current_line:
-                            lines.append(current_line)
-                        current_line = word
-                if current_line:
-                    lines.append(current_line)
-                
-                # Calculate text area dimensions
-                line_height = 22
-                text_box_height = len(lines) * line_height + 0.4 * inch
-                text_y_start = page_height - 0.3 * inch
-                
-                # Draw semi-transparent white background for text area (on top of image)
-                c.setFillColorRGB(1, 1, 1, alpha=0.85)  # Semi-transparent white background
-                c.rect(0, page_height - text_box_height, page_width, text_box_height, fill=1, stroke=0)
-                
-                # Draw the text on top
-                c.setFillColorRGB(0.1, 0.1, 0.1)  # Dark text color
-                c.setFont("Helvetica", 16)
-                
-                for j, line in enumerate(lines[:4]):  # Max 4 lines
-                    if line and line.strip():
-                        # Center text horizontally
-                        line_width = c.stringWidth(line, "Helvetica", 16)
-                        text_x = (page_width - line_width) / 2
-                        text_y = text_y_start - (j * line_height)
-                        c.drawString(text_x, text_y, line)
+            # Draw the image and the cover title / page text (see pdf_builder.py)
+            draw_storybook_page(c, page_images[i], i, narrative_text, story_title, character_name)
             
             # Yield after processing each page to allow eventlet to handle requests
             eventlet.sleep(0.01)
@@ -3030,8 +3437,7 @@ def create_storybook_pdf(image_paths, text_data_list, output_path, story_title,
             import traceback
             traceback.print_exc()
             # Add a placeholder if image fails
-            c.setFont("Helvetica", 20)
-            c.drawString(50, page_height / 2, f"Image {i+1} could not be loaded")
+            draw_placeholder_page(c, i)
     
     print(f"Saving PDF to: {output_path}")
     # Yield before final save operation
@@ -3039,7 +3445,16 @@ def create_storybook_pdf(image_paths, text_data_list, output_path, story_title,
     c.save()
     # Yield after save to ensure it completes
     eventlet.sleep(0)
-    print(f"✓ PDF saved successfully")
+    
+    pdf_stats = {
+        'profile': pdf_profile.name,
+        'bytes': os.path.getsize(output_path),
+        'encode_seconds': round(encode_seconds, 3),
+        'build_seconds': round(time.time() - build_start, 3)
+    }
+    print(f"✓ PDF saved successfully (profile {pdf_stats['profile']}: {pdf_stats['bytes'] / 1024:.0f} KB, "
+          f"built in {pdf_stats['build_seconds']}s, image encoding {pdf_stats['encode_seconds']}s)")
+    return pdf_stats
 
 # ============================================================================
 # AUTHENTICATION UTILITIES
@@ -3120,7 +3535,7 @@ def validate_child_name(name):
     
     # Rule 3: Profanity check
     if PROFANITY_AVAILABLE:
-        if profanity.contains_profanity(name):
+        if contains_profanity(name):
             return False, "Name contains inappropriate language"
     else:
         # Fallback: Basic profanity check if library not available
@@ -3664,6 +4079,7 @@ def login_google():
     Initiate Google OAuth login flow.
     Redirects user to Google's authorization page.
     """
+    google = get_google_oauth()
     if not google or not GOOGLE_CLIENT_ID or not GOOGLE_CLIENT_SECRET:
         return jsonify({
             'success': False,
@@ -3694,6 +4110,7 @@ def oauth_google_callback():
     4. If not, creates new user account
     5. Logs the user in
     """
+    google = get_google_oauth()
     if not google:
         return jsonify({
             'success': False,
@@ -4202,11 +4619,8 @@ def stream_progress(book_id):
         Response: SSE stream with text/event-stream content type
     """
     def generate():
-        # Create a queue for this book_id if it doesn't exist
-        with sse_event_queues_lock:
-            if book_id not in sse_event_queues:
-                sse_event_queues[book_id] = queue.Queue(maxsize=100)
-            event_queue = sse_event_queues[book_id]
+        # Receive events published for this book_id from now on (by any worker with a shared job store)
+        subscription = job_store.subscribe(book_id)
         
         try:
             # Send initial connection confirmation
@@ -4217,7 +4631,7 @@ def stream_progress(book_id):
                 try:
                     # Wait for event with timeout to allow periodic keep-alive
                     try:
-                        event = event_queue.get(timeout=30)
+                        event = subscription.get(timeout=30)
                     except queue.Empty:
                         # Send keep-alive ping
                         yield f": keep-alive\n\n"
@@ -4249,16 +4663,8 @@ def stream_progress(book_id):
                     break
         
         finally:
-            # Clean up: remove queue when connection closes
-            with sse_event_queues_lock:
-                if book_id in sse_event_queues:
-                    # Drain any remaining events
-                    try:
-                        while True:
-                            sse_event_queues[book_id].get_nowait()
-                    except queue.Empty:
-                        pass
-                    del sse_event_queues[book_id]
+            # Clean up: stop receiving events when connection closes
+            subscription.close()
     
     return Response(
         stream_with_context(generate()),
@@ -4624,37 +5030,86 @@ def test_sse():
 # USER LIBRARY AND BOOK MANAGEMENT
 # ============================================================================
 
+# The library is paged by keyset over (created_at, book_id), newest first, served by the
+# ix_books_user_created index: each page costs the same however many books a user has.
+USER_BOOKS_PAGE_SIZE = int(os.environ.get('USER_BOOKS_PAGE_SIZE', 50))
+USER_BOOKS_MAX_PAGE_SIZE = 200
+
+def encode_books_cursor(book):
+    """
+    Build the opaque cursor for the page of books after this one.
+    
+    Args:
+        book: The last Book on the current page
+    
+    Returns:
+        str: URL-safe cursor
+    """
+    position = json.dumps([book.created_at.isoformat(), book.book_id])
+    return base64.urlsafe_b64encode(position.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_books_cursor(cursor):
+    """
+    Parse a cursor from encode_books_cursor().
+    
+    Returns:
+        tuple: (created_at datetime, book_id)
+    
+    Raises:
+        ValueError: If the cursor is malformed
+    """
+    try:
+        position = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode('utf-8')
+        created_at, book_id = json.loads(position)
+        return datetime.fromisoformat(created_at), str(book_id)
+    except Exception:
+        raise ValueError('Invalid cursor')
+
 @app.route('/api/user_books')
 @login_required
 def api_user_books():
     """
-    Protected API endpoint that returns all books for the currently logged-in user.
-    Results are sorted by created_at (most recent first).
+    Protected API endpoint that returns the currently logged-in user's books.
+    Results are sorted by created_at (most recent first) and paged by cursor.
+    
+    Query parameters:
+        limit: Books per page (default USER_BOOKS_PAGE_SIZE, at most USER_BOOKS_MAX_PAGE_SIZE)
+        cursor: next_cursor from the previous page
     
     Returns:
-        JSON response with list of user's books
+        JSON response with the page of books and next_cursor (None on the last page)
     """
+    try:
+        limit = min(max(int(request.args.get('limit', USER_BOOKS_PAGE_SIZE)), 1), USER_BOOKS_MAX_PAGE_SIZE)
+        cursor = request.args.get('cursor')
+        after = decode_books_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    
     try:
         with app.app_context():
-            # Query books for current user, sorted by created_at (most recent first)
-            books = Book.query.filter_by(user_id=current_user.user_id)\
-                             .order_by(Book.created_at.desc())\
-                             .all()
+            # One query: story names are joined in rather than looked up per book
+            query = db.session.query(Book, Storyline.name)\
+                              .outerjoin(Storyline, Storyline.story_id == Book.story_id)\
+                              .filter(Book.user_id == current_user.user_id)
+            if after is not None:
+                created_at, book_id = after
+                query = query.filter(db.or_(
+                    Book.created_at < created_at,
+                    db.and_(Book.created_at == created_at, Book.book_id < book_id)
+                ))
+            rows = query.order_by(Book.created_at.desc(), Book.book_id.desc()).limit(limit + 1).all()
+            
+            has_more = len(rows) > limit
+            rows = rows[:limit]
             
             # Convert to list of dictionaries
             books_list = []
-            for book in books:
-                # Get story name from Storyline if available
-                story_name = book.story_id  # Default to story_id
-                if book.story_id:
-                    storyline = Storyline.query.filter_by(story_id=book.story_id).first()
-                    if storyline:
-                        story_name = storyline.name
-                
+            for book, story_name in rows:
                 books_list.append({
                     'book_id': book.book_id,
                     'story_id': book.story_id,
-                    'story_name': story_name,
+                    'story_name': story_name or book.story_id,  # Default to story_id
                     'child_name': book.child_name,
                     'created_at': book.created_at.isoformat() if book.created_at else None,
                     'pdf_path': book.pdf_path
@@ -4663,7 +5118,8 @@ def api_user_books():
             return jsonify({
                 'success': True,
                 'books': books_list,
-                'count': len(books_list)
+                'count': len(books_list),
+                'next_cursor': encode_books_cursor(rows[-1][0]) if has_more else None
             })
     
     except Exception as e:
@@ -5017,6 +5473,10 @@ def library():
                     <!-- Books will be populated here -->
                 </div>
                 
+                <div id="loadMore" style="display: none; text-align: center; margin-top: 30px;">
+                    <button type="button" class="btn btn-secondary" onclick="loadBooks(nextCursor)">Load more books</button>
+                </div>
+                
                 <div id="emptyState" class="empty-state" style="display: none;">
                     <div class="empty-state-icon">📖</div>
                     <h2>No Books Yet</h2>
@@ -5027,10 +5487,15 @@ def library():
         </div>
         
         <script>
-            // Fetch and display user's books
-            async function loadBooks() {
+            // Cursor for the next page of books (null once every book is shown)
+            let nextCursor = null;
+            
+            // Fetch and display user's books, one page at a time
+            async function loadBooks(cursor) {
                 try {
-                    const response = await fetch('/api/user_books');
+                    const loadMore = document.getElementById('loadMore');
+                    loadMore.style.display = 'none';
+                    const response = await fetch('/api/user_books' + (cursor ? '?cursor=' + encodeURIComponent(cursor) : ''));
                     const data = await response.json();
                     
                     const loadingDiv = document.getElementById('loading');
@@ -5043,8 +5508,13 @@ def library():
                         booksGrid.style.display = 'grid';
                         emptyState.style.display = 'none';
                         
-                        // Clear existing content
-                        booksGrid.innerHTML = '';
+                        // Clear existing content (later pages are appended)
+                        if (!cursor) {
+                            booksGrid.innerHTML = '';
+                        }
+                        
+                        nextCursor = data.next_cursor;
+                        loadMore.style.display = nextCursor ? 'block' : 'none';
                         
                         // Populate books
                         data.books.forEach(book => {
@@ -5076,7 +5546,7 @@ def library():
                             
                             booksGrid.appendChild(card);
                         });
-                    } else {
+                    } else if (!cursor) {
                         booksGrid.style.display = 'none';
                         emptyState.style.display = 'block';
                     }
@@ -5120,25 +5590,18 @@ def api_stories_by_gender(gender):
                 'error': 'Invalid gender. Must be "boy" or "girl"'
             }), 400
         
-        # Query Storyline model for stories matching the gender
-        with app.app_context():
-            storylines = Storyline.query.filter_by(gender=gender).all()
-            
-            # Convert to list of dictionaries
-            stories = []
-            for storyline in storylines:
-                stories.append({
-                    'story_id': storyline.story_id,
-                    'name': storyline.name,
-                    'gender': storyline.gender
-                })
-            
-            return jsonify({
-                'success': True,
-                'gender': gender,
-                'stories': stories,
-                'count': len(stories)
-            })
+        # Stories matching the gender, from the in-memory story catalogue
+        stories = [
+            {'story_id': storyline.story_id, 'name': storyline.name, 'gender': storyline.gender}
+            for storyline in story_catalog.by_gender(gender)
+        ]
+        
+        return jsonify({
+            'success': True,
+            'gender': gender,
+            'stories': stories,
+            'count': len(stories)
+        })
     
     except Exception as e:
         app_logger.error(f"Error fetching stories by gender: {str(e)}", exc_info=True)
@@ -5156,15 +5619,21 @@ def generate_storybook_background(task_id, filepath, gender, story_choice, chara
     # TEST MODE: Set to True to only generate cover page for testing
     TEST_MODE_SINGLE_PAGE = False  # Change to False to generate full storybook
     
+    # OpenAI requests made for this book are queued fairly against other books
+    openai_governor.enter_book(task_id)
+    book_path = 'red' if story_choice == 'red' else 'dalle'
+    book_start = time.perf_counter()
+    active_books.inc(path=book_path)
+    
     try:
-        generation_progress[task_id] = {
+        job_store.create(task_id, {
             'status': 'analyzing',
             'progress': 0,
             'total': 1 if TEST_MODE_SINGLE_PAGE else 13,  # Generating full storybook: 1 cover + 12 story pages (or just 1 for test mode)
             'current_step': 'Analyzing child\'s appearance...',
             'pdf_path': None,
             'error': None
-        }
+        })
         
         # Determine story base
         story_titles = {
@@ -5191,12 +5660,48 @@ def generate_storybook_background(task_id, filepath, gender, story_choice, chara
                 text_data_list = []
                 
                 # Get page data from storyline for text
-                with app.app_context():
-                    storyline = Storyline.query.filter_by(story_id='red').first()
-                    if storyline:
-                        pages = storyline.get_pages()
-                    else:
-                        pages = []
+                storyline = story_catalog.get('red')
+                pages = storyline.pages if storyline else ()
+                
+                # Page text inputs for every page that has storyline data
+                text_page_prompts = storyline_text_page_prompts(pages[:13], story_title)
+                
+                # Decode and analyse the user's photo once; every page reuses it
+                subject = prepare_book_subject(filepath, output_dir)
+                
+                # Render each page into the PDF as soon as it is saved (None: render the PDF at the end)
+                pdf_path = os.path.join(tempfile.gettempdir(), f"storybook_{task_id}.pdf")
+                pdf_builder = new_pdf_builder(pdf_path, story_title, character_name, os.path.join(output_dir, 'pdf'))
+                
+                # Queue all 13 pages on the compositing engine up front so they render on
+                # every core while this loop collects them in page order
+                page_futures = {
+                    page_number: submit_story_image('red', page_number, subject, character_name or "Little Red Riding Hood")
+                    for page_number in range(1, 14)
+                }
+                
+                # Write all page text in one request while the pages render (see BATCHED_PAGE_TEXT).
+                # Pages collected before it returns get their text when it arrives.
+                text_future = None
+                pending_texts = []
+                if BATCHED_PAGE_TEXT and text_page_prompts:
+                    text_executor = ThreadPoolExecutor(max_workers=1, initializer=openai_governor.enter_book, initargs=(task_id,))
+                    text_future = text_executor.submit(generate_all_page_texts, text_page_prompts, 'red', 13, character_name)
+                    # The request still runs to completion; no more work is queued on this executor
+                    text_executor.shutdown(wait=False)
+                
+                def fill_batched_texts():
+                    # Text for the pages collected so far, from the batched request
+                    try:
+                        batched_texts = text_future.result() or {}
+                    except Exception as e:
+                        print(f"Warning: Error generating page text: {str(e)}")
+                        batched_texts = {}
+                    for text_index, text_page_number in pending_texts:
+                        text_data_list[text_index] = batched_texts.get(text_page_number) or {"narrative": []}
+                        if pdf_builder is not None:
+                            pdf_builder.set_text(text_index, text_data_list[text_index])
+                    pending_texts.clear()
                 
                 # Process all 13 images
                 for page_index in range(13):
@@ -5204,20 +5709,13 @@ def generate_storybook_background(task_id, filepath, gender, story_choice, chara
                     eventlet.sleep(0)
                     
                     page_number = page_index + 1
-                    generation_progress[task_id]['progress'] = page_number
-                    generation_progress[task_id]['current_step'] = f'Processing page {page_number}/13...'
+                    job_store.update(task_id, progress=page_number, current_step=f'Processing page {page_number}/13...')
                     
                     # Process the story image
                     image_filename = f'page_{page_number:02d}.png'
                     image_path = os.path.join(output_dir, image_filename)
                     
-                    success = process_story_image(
-                        story_id='red',
-                        page_number=page_number,
-                        user_image_path=filepath,
-                        character_name=character_name or "Little Red Riding Hood",
-                        output_path=image_path
-                    )
+                    success = save_story_image(page_futures[page_number], page_number, image_path)
                     
                     # Yield again after processing each image
                     eventlet.sleep(0)
@@ -5225,20 +5723,18 @@ def generate_storybook_background(task_id, filepath, gender, story_choice, chara
                     if success:
                         generated_images.append(image_path)
                         # Get text data for this page if available
-                        if page_index < len(pages):
+                        if page_index < len(text_page_prompts) and text_future is not None:
+                            # Filled in by fill_batched_texts()
+                            text_data_list.append(None)
+                            pending_texts.append((len(generated_images) - 1, page_number))
+                            if text_future.done():
+                                fill_batched_texts()
+                        elif page_index < len(text_page_prompts):
                             try:
                                 # Yield control before text generation
                                 eventlet.sleep(0)
                                 
-                                page_data = pages[page_index] if page_index < len(pages) else {}
-                                # Ensure page_data has required fields
-                                if not isinstance(page_data, dict):
-                                    page_data = {}
-                                if 'description' not in page_data:
-                                    page_data['description'] = f"Page {page_number} of Little Red Riding Hood"
-                                if 'prompt' not in page_data:
-                                    page_data['prompt'] = ""
-                                
+                                page_data = text_page_prompts[page_index][1]
                                 text_data = generate_page_text(
                                     page_data,
                                     'red',
@@ -5254,41 +5750,65 @@ def generate_storybook_background(task_id, filepath, gender, story_choice, chara
                                 text_data_list.append({"narrative": []})
                         else:
                             text_data_list.append({"narrative": []})
+                        if pdf_builder is not None:
+                            if text_data_list[-1] is not None:
+                                pdf_builder.set_text(len(generated_images) - 1, text_data_list[-1])
+                            pdf_builder.set_image(len(generated_images) - 1, image_path)
+                        _send_sse_event(task_id, 'page_complete', {
+                            'page_number': page_number,
+                            'completed_count': len(generated_images),
+                            'total_pages': 13
+                        })
                         print(f"✓ Processed page {page_number}/13")
                     else:
                         error_msg = f"Failed to process page {page_number}/13"
                         print(f"✗ {error_msg}")
-                        # Continue with other pages even if one fails, but log the error
-                        generation_progress[task_id]['error'] = f"{error_msg}. Some pages may be missing."
-                        text_data_list.append({"narrative": []})
+                        # Continue with other pages even if one fails, but log the error.
+                        # No text entry either, so text stays aligned with the pages that exist.
+                        job_store.update(task_id, error=f"{error_msg}. Some pages may be missing.")
+                
+                if text_future is not None:
+                    if pending_texts:
+                        job_store.update(task_id, current_step='Writing story text...')
+                    fill_batched_texts()
+                
+                app_logger.info(f"Book {task_id}: processed {len(generated_images)}/13 story images, peak RSS {_peak_rss_mb()} MB")
                 
                 # Generate PDF
                 if generated_images:
                     # Yield control before PDF creation
                     eventlet.sleep(0)
                     
-                    generation_progress[task_id]['current_step'] = 'Creating PDF...'
-                    pdf_path = os.path.join(tempfile.gettempdir(), f"storybook_{task_id}.pdf")
+                    job_store.update(task_id, current_step='Creating PDF...')
                     
-                    create_storybook_pdf(
-                        generated_images,
-                        text_data_list,
-                        pdf_path,
-                        story_title,
-                        character_name
-                    )
+                    if pdf_builder is not None:
+                        # Pages were rendered as they completed; only stitch them together
+                        with metrics.span('pdf'):
+                            pdf_stats = pdf_builder.finish()
+                        pdf_builder.cleanup()
+                    else:
+                        pdf_stats = create_storybook_pdf(
+                            generated_images,
+                            text_data_list,
+                            pdf_path,
+                            story_title,
+                            character_name
+                        )
                     
                     # Yield control after PDF creation
                     eventlet.sleep(0)
                     
-                    generation_progress[task_id]['status'] = 'completed'
-                    generation_progress[task_id]['pdf_path'] = pdf_path
-                    generation_progress[task_id]['progress'] = 13
-                    generation_progress[task_id]['current_step'] = 'Storybook completed!'
+                    job_store.update(
+                        task_id,
+                        status='complete',
+                        pdf_path=pdf_path,
+                        pdf=pdf_stats,
+                        progress=13,
+                        current_step='Storybook completed!'
+                    )
                     print(f"✓ Storybook PDF created: {pdf_path}")
                 else:
-                    generation_progress[task_id]['status'] = 'error'
-                    generation_progress[task_id]['error'] = 'Failed to process any images'
+                    job_store.update(task_id, status='error', error='Failed to process any images')
                 
                 return
                 
@@ -5297,23 +5817,15 @@ def generate_storybook_background(task_id, filepath, gender, story_choice, chara
                 print(error_msg)
                 import traceback
                 traceback.print_exc()
-                generation_progress[task_id]['status'] = 'error'
-                generation_progress[task_id]['error'] = error_msg
-                generation_progress[task_id]['current_step'] = f'Error: {str(e)[:100]}'
+                job_store.update(task_id, status='error', error=error_msg, current_step=f'Error: {str(e)[:100]}')
                 app_logger.error(error_msg, exc_info=True)
                 return
         
         # For other stories (Jack and the Beanstalk), continue with DALL-E generation
-        # Analyze child's appearance
-        child_appearance = analyze_child_appearance(filepath)
-        generation_progress[task_id]['progress'] = 1
-        generation_progress[task_id]['current_step'] = 'Child appearance analyzed'
-        
         # Get all prompts - ensure we get the FULL storybook (13 images total)
         all_prompts = get_all_prompts_for_story(story_choice, gender)
         if not all_prompts:
-            generation_progress[task_id]['status'] = 'error'
-            generation_progress[task_id]['error'] = 'Invalid story selection'
+            job_store.update(task_id, status='error', error='Invalid story selection')
             return
         
         # Verify we have the expected number of prompts (13 total: 1 cover + 12 story pages)
@@ -5339,56 +5851,67 @@ def generate_storybook_background(task_id, filepath, gender, story_choice, chara
             story_objects['treasure'] = 'golden egg or bag of gold coins'
             story_objects['beanstalk'] = 'enormous, magical green beanstalk'
         
-        generated_images = []
-        text_data_list = []
-        temp_files = []
-        style_description = None  # Will store style from first image (consistent across all)
-        current_face_description = None  # Will track the most recent face description from GPT-4 Vision
-        
-        # MASTER REFERENCE SYSTEM: Store the first generated image as the master reference
-        master_reference_image_path = None
-        master_reference_description = None  # Detailed character description extracted from master reference
-        
         # RAG Context Store: Store consistency information from each generated image
-        # Each entry contains: consistency_info (dict), embedding (list), page_description (str), page_number (int)
-        context_store = []
-        
-        # Generate all pages for complete storybook (1 cover + 12 story pages = 13 total)
-        
-        print(f"\n{'*'*60}")
-        print(f"STEP 1: Generating MASTER REFERENCE (cover image)")
-        print(f"STEP 2: Extract master reference character details")
-        print(f"STEP 3: Generate all subsequent pages using master reference")
-        print(f"{'*'*60}\n")
-        
-        # STEP 1: Generate ONLY the cover first to establish master reference
-        print(f"\n{'='*60}")
-        print(f"STEP 1: GENERATING MASTER REFERENCE IMAGE (Cover)")
-        print(f"{'='*60}\n")
-        
-        cover_prompt_info = all_prompts[0]
-        generation_progress[task_id]['progress'] = 1
-        generation_progress[task_id]['current_step'] = 'Generating master reference cover page...'
-        
-        # Build cover prompt - FIRST IMAGE: Creates the master reference illustration
-        base_prompt = cover_prompt_info['prompt']
+        # Each row is a page's embedding (see vector_index.py) with metadata:
+        # consistency_info (dict), page_description (str), page_number (int), context_text (str)
+        context_store = VectorIndex()
         
         # Determine story-specific outfit and items
         if story_choice == 'red':
             outfit_desc = "red hooded cape"
             items_desc = "basket"
             story_context = "Little Red Riding Hood"
+            outfit_consistency_lock = "SAME red cloak, SAME basket"
+            outfit_rules = "- Same red hood and cloak every page.\n- Same basket every page."
         elif story_choice == 'jack':
             outfit_desc = "appropriate clothing"
             items_desc = "magic beans"
             story_context = "Jack and the Beanstalk"
+            outfit_consistency_lock = "SAME clothing, SAME magic beans and treasure items"
+            outfit_rules = "- Same clothing style every page.\n- Same magic beans appearance every page.\n- Same treasure items (golden egg/coins) appearance every page."
         else:
             outfit_desc = "story-appropriate clothing"
             items_desc = ""
             story_context = "the story"
+            outfit_consistency_lock = "SAME clothing and items"
+            outfit_rules = "- Same clothing style every page.\n- Same story items every page."
+        
+        # Sections that are the same for every page are rendered into the page prompt once per book
+        page_prompt_template = DALLE_PAGE_PROMPT.bind(
+            outfit_consistency_lock=outfit_consistency_lock,
+            outfit_rules=outfit_rules,
+            wolf_rule="- Wolf is always a wolf (not human)." if story_choice == 'red' else ""
+        )
+        
+        # The book is generated as a dependency graph instead of one serial loop.
+        # Only real dependencies wait on each other:
+        #   cover -> master reference / style -> page 1 -> page 2 -> ... (each page needs
+        #   the previous page's face description and RAG context)
+        # Everything else runs alongside the chain: the child photo analysis, all page
+        # text, face verification and the per-page face analysis / RAG extraction.
+        print(f"\n{'*'*60}")
+        print(f"STEP 1: Generating MASTER REFERENCE (cover image)")
+        print(f"STEP 2: Extract master reference character details")
+        print(f"STEP 3: Generate all subsequent pages using master reference")
+        print(f"Scheduling: dependency graph (max workers: {BOOK_GRAPH_MAX_WORKERS}, stage limits: {BOOK_STAGE_LIMITS})")
+        print(f"{'*'*60}\n")
+        
+        cover_prompt_info = all_prompts[0]
+        story_prompts = all_prompts[1:] if not TEST_MODE_SINGLE_PAGE else []
+        
+        job_store.update(task_id, progress=1, current_step='Generating master reference cover page...')
+        
+        if TEST_MODE_SINGLE_PAGE:
+            print(f"\n{'!'*60}")
+            print(f"TEST MODE ENABLED: Only generating cover page (skipping story pages)")
+            print(f"{'!'*60}\n")
+        
+        def analyze_appearance_task(results):
+            return analyze_child_appearance(filepath)
         
-        # FIRST IMAGE PROMPT: Create master reference illustration based on uploaded photo
-        cover_prompt = f"""Create a children's storybook illustration of the uploaded child as {story_context}. 
+        def cover_task(results):
+            # FIRST IMAGE PROMPT: Create master reference illustration based on uploaded photo
+            cover_prompt = f"""Create a children's storybook illustration of the uploaded child as {story_context}.
 
 The child must look EXACTLY like the uploaded photo - same face, same age, same ethnicity, same hair, same features.
 
@@ -5397,361 +5920,325 @@ STYLE: Soft watercolor fairy-tale storybook illustration style. Gentle, magical,
 OUTFIT AND ITEMS: {outfit_desc.title() if outfit_desc else "Story-appropriate clothing"}{f", {items_desc}" if items_desc else ""}.
 
 This is the FIRST and MASTER REFERENCE illustration. All subsequent pages will match this exact child character, outfit, and art style."""
-        
-        # Generate master reference cover
-        # NOTE: filepath is passed here for the FIRST image only (to match the uploaded photo)
-        try:
+
+            # NOTE: filepath is passed here for the FIRST image only (to match the uploaded photo)
             print(f"Generating master reference cover (FIRST illustration based on uploaded photo)...")
-            image_url = generate_image_with_dalle(cover_prompt, filepath)
-            img = download_image_from_url(image_url)
             master_reference_image_path = os.path.join(tempfile.gettempdir(), f"storybook_img_{task_id}_master_reference.png")
-            img.save(master_reference_image_path)
-            generated_images.append(master_reference_image_path)
-            temp_files.append(master_reference_image_path)
-            print(f"✓ Master reference image saved: {master_reference_image_path}")
-        except Exception as e:
-            print(f"ERROR: Failed to generate master reference: {e}")
-            generation_progress[task_id]['status'] = 'error'
-            generation_progress[task_id]['error'] = f'Failed to generate master reference: {str(e)}'
-            return
-        
-        # STEP 2: Extract master reference character details
-        print(f"\n{'='*60}")
-        print(f"STEP 2: EXTRACTING MASTER REFERENCE CHARACTER DETAILS")
-        print(f"{'='*60}\n")
+            saved = save_dalle_image(cover_prompt, master_reference_image_path, filepath)
+            print(f"✓ Master reference image saved: {master_reference_image_path} ({saved['mode']}, stored in {saved['store_seconds'] * 1000:.0f} ms)")
+            return master_reference_image_path
         
-        generation_progress[task_id]['current_step'] = 'Extracting master reference character details...'
-        
-        try:
-            master_reference_description = extract_master_reference_character_details(master_reference_image_path)
-            if master_reference_description:
-                print(f"✓ Master reference description extracted: {master_reference_description[:200]}...")
-            else:
+        def master_reference_task(results):
+            job_store.update(task_id, current_step='Extracting master reference character details...')
+            child_appearance = results['appearance']
+            try:
+                master_reference_description = extract_master_reference_character_details(results['cover'])
+                if master_reference_description:
+                    print(f"✓ Master reference description extracted: {master_reference_description[:200]}...")
+                    return master_reference_description
                 print("⚠️  Warning: Could not extract master reference details. Using fallback.")
-                master_reference_description = child_appearance
-        except Exception as e:
-            print(f"⚠️  Warning: Error extracting master reference: {e}. Using fallback.")
-            master_reference_description = child_appearance
+            except Exception as e:
+                print(f"⚠️  Warning: Error extracting master reference: {e}. Using fallback.")
+            return child_appearance
         
-        # Extract style from master reference
-        try:
-            style_description = analyze_illustration_style(master_reference_image_path)
-            print(f"✓ Style description extracted: {style_description[:100]}...")
-        except Exception as e:
-            print(f"⚠️  Warning: Error analyzing style: {e}. Using default.")
-            style_description = "watercolor/painterly style with soft, artistic brushstrokes, gentle color blending, and an emotional, gentle feel"
+        def style_task(results):
+            try:
+                style_description = analyze_illustration_style(results['cover'])
+                print(f"✓ Style description extracted: {style_description[:100]}...")
+                return style_description
+            except Exception as e:
+                print(f"⚠️  Warning: Error analyzing style: {e}. Using default.")
+                return "watercolor/painterly style with soft, artistic brushstrokes, gentle color blending, and an emotional, gentle feel"
         
-        # Generate text for cover
-        try:
-            text_data = generate_page_text(cover_prompt_info, story_choice, 1, len(all_prompts), character_name)
-            text_data_list.append(text_data)
-        except Exception as e:
-            print(f"Warning: Error generating text for cover: {e}")
-            text_data_list.append({"narrative": []})
+        # Page text for the cover and every story page, keyed by the page number used in the text prompt
+        text_page_prompts = [(1, cover_prompt_info)] + [
+            (prompt_info['page_number'] + 1, prompt_info) for prompt_info in story_prompts
+        ]
         
-        # STEP 3: Generate all subsequent pages using master reference
-        print(f"\n{'='*60}")
-        print(f"STEP 3: GENERATING ALL SUBSEQUENT PAGES USING MASTER REFERENCE")
-        print(f"{'='*60}\n")
+        def batched_text_task(results):
+            return generate_all_page_texts(text_page_prompts, story_choice, len(all_prompts), character_name)
         
-        if TEST_MODE_SINGLE_PAGE:
-            print(f"\n{'!'*60}")
-            print(f"TEST MODE ENABLED: Only generating cover page (skipping story pages)")
-            print(f"{'!'*60}\n")
-        else:
-            # Track previous page image for continuity (secondary reference)
-            previous_page_image_path = master_reference_image_path  # Start with master reference
-            previous_page_description = None  # Will store description of previous page
-            
-            # Iterate through remaining prompts (skip cover, start from index 1)
-            for i, prompt_info in enumerate(all_prompts[1:], start=1):
+        def make_text_task(prompt_info, text_page_number):
+            def text_task(results):
                 try:
-                    print(f"\n>>> LOOP ITERATION {i+1}/{len(all_prompts)} STARTING <<<")
-                    page_num = prompt_info['page_number']
-                    generation_progress[task_id]['progress'] = i + 1
-                    
-                    if i == 0:
-                        generation_progress[task_id]['current_step'] = f'Generating cover page...'
-                    else:
-                        generation_progress[task_id]['current_step'] = f'Generating page {page_num + 1}: {prompt_info["description"]}'
-                    
-                    # RAG: Retrieve relevant context from previous images for consistency
-                    rag_consistency_info = ""
-                    if i > 0 and context_store:
-                        # Use RAG to retrieve most relevant previous images
-                        query_text = f"{prompt_info['description']} {prompt_info['prompt'][:200]}"
-                        relevant_contexts = retrieve_relevant_context(query_text, context_store, top_k=3)
-                        
-                        if relevant_contexts:
-                            print(f"RAG: Retrieved {len(relevant_contexts)} relevant context chunks from previous images")
-                            # Build consistency instructions from retrieved contexts
-                            rag_parts = []
-                            for idx, ctx in enumerate(relevant_contexts):
-                                if ctx.get('consistency_info'):
-                                    info = ctx['consistency_info']
-                                    # Extract character features (most important for consistency)
-                                    if info.get('character_features'):
-                                        char_features = str(info['character_features'])[:200]  # Truncate
-                                        rag_parts.append(f"Character (match exactly): {char_features}")
-                                    # Extract objects (basket contents, etc.)
-                                    if info.get('objects'):
-                                        objects = str(info['objects'])[:150]  # Truncate
-                                        rag_parts.append(f"Objects (match exactly): {objects}")
-                                    # Only take first 2 most relevant to keep prompt length manageable
-                                    if len(rag_parts) >= 2:
-                                        break
-                            if rag_parts:
-                                rag_consistency_info = ". ".join(rag_parts)
-                                print(f"RAG consistency info retrieved ({len(rag_parts)} chunks): {rag_consistency_info[:150]}...")
-                    
-                    # Build enhanced prompt with appearance and object consistency
-                    consistency_notes = []
-                    
-                    # Add object consistency notes based on story
-                    if story_choice == 'red':
-                        if 'basket' in prompt_info['prompt'].lower():
-                            consistency_notes.append(f"The basket must contain: {', '.join(story_objects['basket_contents'])}. This is consistent across all pages.")
-                        if 'red' in prompt_info['prompt'].lower() or 'cape' in prompt_info['prompt'].lower():
-                            consistency_notes.append(f"The child wears a {story_objects['red_cape']} in every scene where they appear.")
-                    
-                    elif story_choice == 'jack':
-                        if 'beanstalk' in prompt_info['prompt'].lower():
-                            consistency_notes.append(f"The beanstalk is an {story_objects['beanstalk']} with giant green leaves and magical sparkles.")
-                        if 'treasure' in prompt_info['prompt'].lower() or 'gold' in prompt_info['prompt'].lower():
-                            consistency_notes.append(f"The treasure is a {story_objects['treasure']} - maintain this exact appearance.")
-                        if 'beans' in prompt_info['prompt'].lower():
-                            consistency_notes.append(f"The magic beans are {story_objects['magic_beans']} - keep them consistent.")
-                    
-                    # Combine RAG info with story-based consistency
-                    consistency_text = " ".join(consistency_notes)
-                    if rag_consistency_info:
-                        consistency_text = f"{consistency_text} {rag_consistency_info}" if consistency_text else rag_consistency_info
-                    
-                    # Build the enhanced prompt
-                    base_prompt = prompt_info['prompt']
-                    if 'watercolor' not in base_prompt.lower() and 'painterly' not in base_prompt.lower():
-                        base_prompt = f"Create a children's book illustration page in a watercolor/painterly style with a soft, artistic feel that is gentle and emotional. {base_prompt}"
-                    
-                    # For subsequent pages: Use MASTER REFERENCE description
-                    # Generate comprehensive consistency rules using master reference
-                    character_rules = generate_character_consistency_rules(child_appearance, story_choice, is_cover=False)
-                    
-                    # Add MASTER REFERENCE description (CRITICAL for consistency)
-                    if master_reference_description:
-                        master_ref_short = master_reference_description[:400] if len(master_reference_description) > 400 else master_reference_description
-                        character_rules += f"\n\n{'='*80}\nMASTER REFERENCE CHARACTER DETAILS (MUST MATCH EXACTLY):\n{master_ref_short}\n{'='*80}"
-                    
-                    # Generate style rules using master reference style
-                    style_rules = generate_style_consistency_rules(is_cover=False, style_description=style_description)
-                    
-                    # Combine all consistency information
-                    # Truncate RAG consistency text if too long
-                    rag_consistency_text = ""
-                    if rag_consistency_info:
-                        rag_consistency_text = f"\n\nRAG-RETRIEVED CONSISTENCY (from previous pages):\n{rag_consistency_info[:300]}" if len(rag_consistency_info) > 300 else f"\n\nRAG-RETRIEVED CONSISTENCY (from previous pages):\n{rag_consistency_info}"
-                    
-                    # Truncate story-based consistency notes if too long
-                    story_consistency_text = consistency_text[:150] if consistency_text and len(consistency_text) > 150 else (consistency_text if consistency_text else "")
-                    
-                    # Extract previous page description for continuity (secondary reference)
-                    previous_page_continuity = ""
-                    if previous_page_image_path and previous_page_image_path != master_reference_image_path:
-                        try:
-                            previous_page_desc = analyze_child_face_from_illustration(previous_page_image_path)
-                            if previous_page_desc:
-                                previous_page_continuity = f"\nPREVIOUS PAGE REFERENCE: Also match the style and facial identity from the previous page. {previous_page_desc[:200]}"
-                                print(f"✓ Extracted previous page description for continuity")
-                        except Exception as e:
-                            print(f"⚠️  Warning: Could not extract previous page description: {e}")
-                    
-                    # Build story-specific consistency lock text
-                    if story_choice == 'red':
-                        outfit_consistency_lock = "SAME red cloak, SAME basket"
-                        outfit_rules = "- Same red hood and cloak every page.\n- Same basket every page."
-                    elif story_choice == 'jack':
-                        outfit_consistency_lock = "SAME clothing, SAME magic beans and treasure items"
-                        outfit_rules = "- Same clothing style every page.\n- Same magic beans appearance every page.\n- Same treasure items (golden egg/coins) appearance every page."
-                    else:
-                        outfit_consistency_lock = "SAME clothing and items"
-                        outfit_rules = "- Same clothing style every page.\n- Same story items every page."
+                    return generate_page_text(prompt_info, story_choice, text_page_number, len(all_prompts), character_name)
+                except Exception as text_error:
+                    print(f"Warning: Error generating text for page {text_page_number}: {text_error}")
+                    return {"narrative": []}
+            return text_task
+        
+        def make_page_task(i, prompt_info):
+            def page_task(results):
+                print(f"\n>>> PAGE {i+1}/{len(all_prompts)} STARTING <<<")
+                page_num = prompt_info['page_number']
+                job_store.update(task_id, current_step=f'Generating page {page_num + 1}: {prompt_info["description"]}')
+                master_reference_description = results['master_reference']
+                
+                # RAG: Retrieve relevant context from previous images for consistency
+                rag_consistency_info = ""
+                if len(context_store):
+                    # Use RAG to retrieve most relevant previous images
+                    query_text = rag_query_text(prompt_info)
+                    relevant_contexts = retrieve_relevant_context(query_text, context_store, top_k=3)
                     
-                    # Build the comprehensive prompt with EXACT consistency lock text from user requirements
-                    enhanced_prompt = f"""{base_prompt}
-
-================================================================================
-CONSISTENCY LOCK - MANDATORY FOR ALL PAGES AFTER THE FIRST:
-================================================================================
-
-Use the FIRST illustration as the face reference. Also match the style and facial identity from the previous page. Match the reference child's face EXACTLY — identical facial features, proportions, eyes, nose, mouth, cheeks, skin tone, hair color and length, and age. Do NOT alter, stylize, or reinterpret the child's face or age. SAME hairstyle, {outfit_consistency_lock}, SAME art style, SAME brush texture, SAME lighting and color palette. If the face does not match, regenerate.
-
-================================================================================
-MASTER REFERENCE (FIRST ILLUSTRATION) CHARACTER DETAILS:
-================================================================================
-
-{master_reference_description[:400] if master_reference_description else "Match the FIRST generated illustration character exactly."}
-{previous_page_continuity}
-
-================================================================================
-OUTFIT & STYLE RULES:
-================================================================================
-
-{outfit_rules}
-- Soft watercolor storybook style.
-- No realism, no anime, no style changes.
-- SAME illustration style, SAME brush style, SAME lighting, SAME fairy-tale tone as the first image.
-
-================================================================================
-CHARACTER RULES:
-================================================================================
-
-{f"- Wolf is always a wolf (not human)." if story_choice == 'red' else ""}
-- Hunter is always a human adult male (not a wolf or animal).
-- No animal-human hybrids.
-
-================================================================================
-QUALITY CHECK:
-================================================================================
+                    if relevant_contexts:
+                        print(f"RAG: Retrieved {len(relevant_contexts)} relevant context chunks from previous images")
+                        # Build consistency instructions from retrieved contexts
+                        rag_parts = []
+                        for idx, ctx in enumerate(relevant_contexts):
+                            if ctx.get('consistency_info'):
+                                info = ctx['consistency_info']
+                                # Extract character features (most important for consistency)
+                                if info.get('character_features'):
+                                    char_features = str(info['character_features'])[:200]  # Truncate
+                                    rag_parts.append(f"Character (match exactly): {char_features}")
+                                # Extract objects (basket contents, etc.)
+                                if info.get('objects'):
+                                    objects = str(info['objects'])[:150]  # Truncate
+                                    rag_parts.append(f"Objects (match exactly): {objects}")
+                                # Only take first 2 most relevant to keep prompt length manageable
+                                if len(rag_parts) >= 2:
+                                    break
+                        if rag_parts:
+                            rag_consistency_info = ". ".join(rag_parts)
+                            print(f"RAG consistency info retrieved ({len(rag_parts)} chunks): {rag_consistency_info[:150]}...")
+                rag_context = ""
+                if rag_consistency_info:
+                    rag_context = f"\n\nRAG-RETRIEVED CONSISTENCY (from previous pages):\n{rag_consistency_info[:300]}"
+                
+                # Build the enhanced prompt
+                base_prompt = prompt_info['prompt']
+                if 'watercolor' not in base_prompt.lower() and 'painterly' not in base_prompt.lower():
+                    base_prompt = f"Create a children's book illustration page in a watercolor/painterly style with a soft, artistic feel that is gentle and emotional. {base_prompt}"
+                
+                # Previous page description for continuity (secondary reference).
+                # Uses the face analysis of the most recent successful page; the cover
+                # (master reference) itself is not re-analyzed.
+                previous_page_continuity = ""
+                for previous_index in range(i - 1, 0, -1):
+                    previous_page_desc = results.get(f'face:{previous_index}')
+                    if previous_page_desc:
+                        previous_page_continuity = f"\nPREVIOUS PAGE REFERENCE: Also match the style and facial identity from the previous page. {previous_page_desc[:200]}"
+                        print(f"✓ Using previous page description for continuity (page {previous_index + 1})")
+                        break
+                
+                # Per-book sections are already rendered; only the page slots are filled here
+                enhanced_prompt = page_prompt_template.render(
+                    page_prompt=base_prompt,
+                    master_reference=master_reference_description or "Match the FIRST generated illustration character exactly.",
+                    previous_page=previous_page_continuity,
+                    rag_context=rag_context
+                )
 
-If the child does not match the reference identity or the style changes:
-- Prioritize facial identity match before style variation
-- Regenerate up to 3 times if needed
-- The child MUST look EXACTLY like the FIRST illustration in EVERY image.
-================================================================================"""
-                    
-                    # Generate image with verification and regeneration logic
-                    total_pages = len(all_prompts)
-                    prompt_length = len(enhanced_prompt)
-                    print(f"\n{'='*60}")
-                    print(f"Generating image {i+1}/{total_pages}: Story page {page_num}")
-                    print(f"Page description: {prompt_info['description']}")
-                    print(f"Prompt length: {prompt_length} characters (max: 4000)")
-                    if prompt_length > 4000:
-                        print(f"⚠️  WARNING: Prompt exceeds 4000 characters! Will be truncated.")
-                    print(f"{'='*60}\n")
-                    
-                    # Generate image (no retry logic - generate once and accept)
-                    # IMPORTANT: Do NOT pass filepath for subsequent pages - only use FIRST illustration reference
-                    image_url = generate_image_with_dalle(enhanced_prompt, None)
-                    print(f"Image generated successfully, URL: {image_url[:50]}...")
-                    
-                    # Download and save
-                    img = download_image_from_url(image_url)
-                    temp_img_path = os.path.join(tempfile.gettempdir(), f"storybook_img_{task_id}_{i}.png")
-                    img.save(temp_img_path)
-                    
-                    # Optional quality check (informational only - no retry)
-                    if master_reference_description:
-                        print(f"🔍 Quality check: Verifying face matches FIRST illustration and style consistency...")
-                        matches, feedback = verify_face_matches_master_reference(temp_img_path, master_reference_description)
-                        
-                        if matches:
-                            print(f"✓ Quality check PASSED: Face matches FIRST illustration - {feedback}")
-                        else:
-                            print(f"⚠️  Quality check: Face/style may not match - {feedback}")
-                            print(f"   (Image accepted regardless - no regeneration)")
-                    else:
-                        print(f"⚠️  No master reference available for verification.")
-                    
-                    # Use the generated image directly (no need for separate final path)
-                    final_img_path = temp_img_path
-                    generated_images.append(final_img_path)
-                    temp_files.append(final_img_path)
-                    print(f"✓ Successfully generated and saved image {i+1}/{total_pages}: {final_img_path}")
-                    
-                    # Update previous page reference for next iteration (for continuity - secondary reference)
-                    previous_page_image_path = final_img_path
-                    
-                    # RAG: Extract and store consistency information from this generated image
-                    try:
-                        print(f"RAG: Extracting consistency information from page {i+1}...")
-                        consistency_info = extract_consistency_info_from_image(
-                            final_img_path, 
-                            prompt_info['description'], 
-                            story_choice
-                        )
-                        
-                        if consistency_info:
-                            # Create embedding for this image's context
-                            context_text = f"{prompt_info['description']} {prompt_info['prompt'][:200]}"
-                            if consistency_info.get('character_features'):
-                                context_text += f" {consistency_info['character_features']}"
-                            if consistency_info.get('objects'):
-                                context_text += f" {consistency_info['objects']}"
-                            
-                            embedding = create_embedding(context_text)
-                            
-                            # Store in context store for RAG retrieval
-                            context_store.append({
-                                'consistency_info': consistency_info,
-                                'embedding': embedding,
-                                'page_description': prompt_info['description'],
-                                'page_number': i + 1,
-                                'context_text': context_text
-                            })
-                            print(f"RAG: Stored consistency info for page {i+1} in context store (total: {len(context_store)} items)")
-                        else:
-                            print(f"RAG: Warning - Could not extract consistency info from page {i+1}")
-                    except Exception as rag_error:
-                        print(f"RAG: Warning - Error extracting/storing consistency info: {rag_error}. Continuing...")
-                    
-                    # For subsequent pages, we already have master reference, so no need for additional analysis
-                    # The master reference is the canonical source of truth for all pages
-                    # (Optional: Track latest face for logging purposes, but master reference takes precedence)
-                    try:
-                        generation_progress[task_id]['current_step'] = f'Page {i+1} completed and verified against master reference'
-                        # Optional: Log face analysis for monitoring (but master reference is the source of truth)
-                        latest_face_description = analyze_child_face_from_illustration(final_img_path)
-                        if latest_face_description:
-                            print(f"Face description from page {i+1}: {latest_face_description[:100]}...")
-                            print(f"(Master reference description is used for all subsequent pages)")
-                    except Exception as analysis_error:
-                        print(f"Warning: Error in optional analysis step: {analysis_error}. Continuing...")
-                        # Continue anyway - master reference is the source of truth
-                    
-                    # Generate text for this page
-                    try:
-                        text_data = generate_page_text(prompt_info, story_choice, page_num + 1, len(all_prompts), character_name)
-                        text_data_list.append(text_data)
-                    except Exception as text_error:
-                        print(f"Warning: Error generating text for page {i+1}: {text_error}")
-                        text_data_list.append({"narrative": []})
-                    
-                    # Continue generating all pages (no break - generating full storybook)
-                    total_pages = len(all_prompts)
-                    print(f"Completed image {i+1}/{total_pages}. Total images so far: {len(generated_images)}")
-                    print(f"Moving to next image... (loop will continue)")
-                    
-                except Exception as e:
-                    import traceback
-                    print(f"\n{'!'*60}")
-                    print(f"ERROR generating page {i+1}/{len(all_prompts)}: {str(e)}")
-                    print(f"Error type: {type(e).__name__}")
-                    print(f"Traceback:")
-                    traceback.print_exc()
-                    print(f"{'!'*60}\n")
-                    # Still add empty text data and continue to next page
-                    text_data_list.append({"narrative": []})
-                    # Continue to next image instead of stopping
-                    continue
+                total_pages = len(all_prompts)
+                prompt_length = len(enhanced_prompt)
+                print(f"\n{'='*60}")
+                print(f"Generating image {i+1}/{total_pages}: Story page {page_num}")
+                print(f"Page description: {prompt_info['description']}")
+                print(f"Prompt length: {prompt_length} characters (max: {DALLE_PROMPT_MAX_LENGTH})")
+                print(f"{'='*60}\n")
+                
+                # Generate image (no retry logic - generate once and accept)
+                # IMPORTANT: Do NOT pass filepath for subsequent pages - only use FIRST illustration reference
+                temp_img_path = os.path.join(tempfile.gettempdir(), f"storybook_img_{task_id}_{i}.png")
+                saved = save_dalle_image(enhanced_prompt, temp_img_path, None)
+                print(f"✓ Successfully generated and saved image {i+1}/{total_pages}: {temp_img_path} "
+                      f"(generated in {saved['generate_seconds']:.1f}s, {saved['mode']} stored in {saved['store_seconds'] * 1000:.0f} ms)")
+                return temp_img_path
+            return page_task
+        
+        def make_verify_task(i):
+            def verify_task(results):
+                # Optional quality check (informational only - no retry)
+                master_reference_description = results['master_reference']
+                if not master_reference_description:
+                    print(f"⚠️  No master reference available for verification.")
+                    return None
+                print(f"🔍 Quality check page {i+1}: Verifying face matches FIRST illustration and style consistency...")
+                matches, feedback = verify_face_matches_master_reference(results[f'page:{i}'], master_reference_description)
+                if matches:
+                    print(f"✓ Quality check PASSED (page {i+1}): Face matches FIRST illustration - {feedback}")
+                else:
+                    print(f"⚠️  Quality check (page {i+1}): Face/style may not match - {feedback}")
+                    print(f"   (Image accepted regardless - no regeneration)")
+                return matches
+            return verify_task
+        
+        def make_face_task(i):
+            def face_task(results):
+                # Face analysis of this page: logged for monitoring and reused as the
+                # previous-page continuity reference for the next page
+                latest_face_description = analyze_child_face_from_illustration(results[f'page:{i}'])
+                if latest_face_description:
+                    print(f"Face description from page {i+1}: {latest_face_description[:100]}...")
+                    print(f"(Master reference description is used for all subsequent pages)")
+                return latest_face_description
+            return face_task
+        
+        def make_rag_task(i, prompt_info):
+            def rag_task(results):
+                # RAG: Extract and store consistency information from this generated image
+                print(f"RAG: Extracting consistency information from page {i+1}...")
+                consistency_info = extract_consistency_info_from_image(
+                    results[f'page:{i}'],
+                    prompt_info['description'],
+                    story_choice
+                )
+                if not consistency_info:
+                    print(f"RAG: Warning - Could not extract consistency info from page {i+1}")
+                    return None
+                
+                # Create embedding for this image's context
+                context_text = rag_query_text(prompt_info)
+                if consistency_info.get('character_features'):
+                    context_text += f" {consistency_info['character_features']}"
+                if consistency_info.get('objects'):
+                    context_text += f" {consistency_info['objects']}"
+                
+                embedding = create_embedding(context_text)
+                
+                # Store in context store for RAG retrieval (normalised once, here)
+                row = context_store.add(embedding, {
+                    'consistency_info': consistency_info,
+                    'page_description': prompt_info['description'],
+                    'page_number': i + 1,
+                    'context_text': context_text
+                })
+                total_contexts = row + 1
+                print(f"RAG: Stored consistency info for page {i+1} in context store (total: {total_contexts} items)")
+                return consistency_info
+            return rag_task
+        
+        completed_pages = []
+        
+        # Render each page into the PDF as soon as its image and text exist (None: render the PDF at the end)
+        pdf_path = os.path.join(tempfile.gettempdir(), f"storybook_{task_id}.pdf")
+        pdf_builder = new_pdf_builder(
+            pdf_path, story_title, character_name,
+            os.path.join(tempfile.gettempdir(), f"storybook_{task_id}", 'pdf')
+        )
+        
+        def on_task_done(name, state, result):
+            if name == 'cover' or name.startswith('page:'):
+                if state == 'succeeded':
+                    completed_pages.append(name)
+                    job_store.update(
+                        task_id,
+                        progress=len(completed_pages),
+                        current_step=f'Page {len(completed_pages)}/{len(all_prompts)} generated'
+                    )
+                    if pdf_builder is not None:
+                        pdf_builder.set_image(0 if name == 'cover' else int(name.split(':')[1]), result)
+                    _send_sse_event(task_id, 'page_complete', {
+                        'page_number': 1 if name == 'cover' else int(name.split(':')[1]) + 1,
+                        'completed_count': len(completed_pages),
+                        'total_pages': len(all_prompts)
+                    })
+            elif pdf_builder is not None and state == 'succeeded':
+                if name == 'text':
+                    for text_index, (text_page_number, _) in enumerate(text_page_prompts):
+                        pdf_builder.set_text(text_index, (result or {}).get(text_page_number))
+                elif name.startswith('text:'):
+                    pdf_builder.set_text(int(name.split(':')[1]), result)
+        
+        graph = TaskGraph(
+            task_id,
+            max_workers=BOOK_GRAPH_MAX_WORKERS,
+            stage_limits=BOOK_STAGE_LIMITS,
+            on_task_done=on_task_done,
+            initializer=openai_governor.enter_book,
+            initargs=(task_id,)
+        )
+        
+        def add_task(name, fn, **kwargs):
+            # Time on the pool counts towards the book_graph busy threads gauge
+            graph.add(name, _pool_task('book_graph', fn), **kwargs)
+        
+        add_task('appearance', analyze_appearance_task, stage='vision')
+        add_task('cover', cover_task, stage='dalle')
+        add_task('master_reference', master_reference_task, deps=['cover', 'appearance'], stage='vision')
+        add_task('style', style_task, deps=['cover'], stage='vision')
+        if BATCHED_PAGE_TEXT:
+            add_task('text', batched_text_task, stage='text')
+        else:
+            for text_index, (text_page_number, prompt_info) in enumerate(text_page_prompts):
+                add_task(f'text:{text_index}', make_text_task(prompt_info, text_page_number), stage='text')
+        
+        if story_prompts:
+            # Page RAG queries are static: after the first book of a story they are read from the embedding store
+            add_task('rag_queries', lambda results: precompute_static_embeddings(story_choice))
+        
+        for i, prompt_info in enumerate(story_prompts, start=1):
+            soft_deps = ['style']
+            if i > 1:
+                # Continuity with the previous page: its face description is the previous page line.
+                # The RAG context uses whatever rag:* tasks have stored by then (rag:{i-1} runs alongside
+                # face:{i-1}), so the next DALL-E call does not wait for a consistency extraction.
+                soft_deps += [f'face:{i-1}', f'page:{i-1}', 'rag_queries']
+            add_task(f'page:{i}', make_page_task(i, prompt_info),
+                     deps=['master_reference', 'appearance'], soft_deps=soft_deps, stage='dalle')
+            add_task(f'verify:{i}', make_verify_task(i), deps=[f'page:{i}', 'master_reference'], stage='vision')
+            add_task(f'face:{i}', make_face_task(i), deps=[f'page:{i}'], stage='vision')
+            add_task(f'rag:{i}', make_rag_task(i, prompt_info), deps=[f'page:{i}'], stage='vision')
+        
+        with pool_threads.track(BOOK_GRAPH_MAX_WORKERS, pool='book_graph', state='total'):
+            results = graph.run()
+        
+        if graph.state('cover') != 'succeeded':
+            cover_error = graph.error('cover')
+            print(f"ERROR: Failed to generate master reference: {cover_error}")
+            job_store.update(task_id, status='error', error=f'Failed to generate master reference: {str(cover_error)}')
+            return
+        
+        # Assemble pages in order; text entries stay aligned with successfully generated images
+        if BATCHED_PAGE_TEXT:
+            batched_texts = results.get('text') or {}
+            page_texts = [batched_texts.get(text_page_number) for text_page_number, _ in text_page_prompts]
+        else:
+            page_texts = [results.get(f'text:{text_index}') for text_index in range(len(text_page_prompts))]
+        
+        generated_images = [results['cover']]
+        text_data_list = [page_texts[0] or {"narrative": []}]
+        for i, prompt_info in enumerate(story_prompts, start=1):
+            if graph.state(f'page:{i}') != 'succeeded':
+                print(f"ERROR generating page {i+1}/{len(all_prompts)}: {graph.error(f'page:{i}')}")
+                continue
+            generated_images.append(results[f'page:{i}'])
+            text_data_list.append(page_texts[i] or {"narrative": []})
+        
+        timing_summary = graph.summary()
+        job_store.update(task_id, timings=timing_summary)
+        app_logger.info(
+            f"Book {task_id} graph finished: wall {timing_summary['wall_seconds']}s, "
+            f"critical path {timing_summary['critical_path_seconds']}s "
+            f"({' -> '.join(timing_summary['critical_path'])}), serial {timing_summary['serial_seconds']}s"
+        )
         
         # Summary
         print(f"\n{'#'*60}")
-        print(f"LOOP COMPLETED: Finished iterating through all {len(all_prompts)} prompts")
+        print(f"GRAPH COMPLETED: Finished all tasks for {len(all_prompts)} prompts")
         print(f"Image generation complete!")
         print(f"Successfully generated: {len(generated_images)}/{len(all_prompts)} images")
         print(f"Text data entries: {len(text_data_list)}/{len(all_prompts)}")
+        print(f"Wall time: {timing_summary['wall_seconds']}s | Critical path: {timing_summary['critical_path_seconds']}s | Serial work: {timing_summary['serial_seconds']}s")
+        cache_stats = vision_cache.stats()
+        print(f"Vision cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses (hit rate {cache_stats['hit_rate']}){' [bypassed]' if cache_stats['bypass'] else ''}")
+        for mode, store_stats in dalle_image_stats().items():
+            if store_stats['images']:
+                print(f"DALL-E images ({mode}): {store_stats['images']} stored, avg {store_stats['avg_ms']} ms per image after generation")
+        governor_stats = openai_governor.stats()
+        print(f"OpenAI governor: {governor_stats['calls']} calls, {governor_stats['retries']} retries, {governor_stats['rate_limited']} rate limited, {governor_stats['failures']} failed")
+        http_stats = http_transport.stats()
+        print(f"HTTP pool: {http_stats['requests']} requests, reuse rate {http_stats['reuse_rate']}, peak in flight {http_stats['peak_in_flight']}/{http_stats['max_connections']}, saturated {http_stats['saturated_requests']}")
         if len(generated_images) < len(all_prompts):
             print(f"WARNING: Only {len(generated_images)} images generated out of {len(all_prompts)} expected!")
         print(f"{'#'*60}\n")
-        
         if not generated_images:
-            generation_progress[task_id]['status'] = 'error'
-            generation_progress[task_id]['error'] = 'Failed to generate any images'
+            job_store.update(task_id, status='error', error='Failed to generate any images')
             return
         
         # Create PDF
-        generation_progress[task_id]['current_step'] = 'Creating PDF...'
-        pdf_path = os.path.join(tempfile.gettempdir(), f"storybook_{task_id}.pdf")
+        job_store.update(task_id, current_step='Creating PDF...')
         
         print(f"\n{'='*60}")
         print(f"Starting PDF creation...")
@@ -5768,15 +6255,22 @@ If the child does not match the reference identity or the style changes:
         if missing_images:
             error_msg = f"Missing image files: {', '.join(missing_images)}"
             print(f"ERROR: {error_msg}")
-            generation_progress[task_id]['status'] = 'error'
-            generation_progress[task_id]['error'] = error_msg
+            job_store.update(task_id, status='error', error=error_msg)
             return
         
         print(f"All {len(generated_images)} image files verified")
         print(f"{'='*60}\n")
         
         try:
-            create_storybook_pdf(generated_images, text_data_list, pdf_path, story_title, character_name)
+            if pdf_builder is not None:
+                # Pages were rendered as they completed; only stitch the successful ones together
+                with metrics.span('pdf'):
+                    pdf_stats = pdf_builder.finish([0] + [
+                        i for i in range(1, len(story_prompts) + 1) if graph.state(f'page:{i}') == 'succeeded'
+                    ])
+                pdf_builder.cleanup()
+            else:
+                pdf_stats = create_storybook_pdf(generated_images, text_data_list, pdf_path, story_title, character_name)
             
             # Verify PDF was created
             if not os.path.exists(pdf_path):
@@ -5785,10 +6279,14 @@ If the child does not match the reference identity or the style changes:
             pdf_size = os.path.getsize(pdf_path)
             print(f"✓ PDF created successfully: {pdf_path} ({pdf_size} bytes)")
             
-            generation_progress[task_id]['pdf_path'] = pdf_path
-            generation_progress[task_id]['status'] = 'complete'
-            generation_progress[task_id]['progress'] = len(all_prompts) + 1  # All pages generated (cover + 12 story pages)
-            generation_progress[task_id]['current_step'] = 'Storybook ready!'
+            job_store.update(
+                task_id,
+                pdf_path=pdf_path,
+                pdf=pdf_stats,
+                status='complete',
+                progress=len(all_prompts) + 1,  # All pages generated (cover + 12 story pages)
+                current_step='Storybook ready!'
+            )
             
             print(f"\n{'='*60}")
             print(f"PDF generation complete! Status set to 'complete'")
@@ -5802,14 +6300,24 @@ If the child does not match the reference identity or the style changes:
             print(f"Traceback:")
             traceback.print_exc()
             print(f"{'!'*60}\n")
-            generation_progress[task_id]['status'] = 'error'
-            generation_progress[task_id]['error'] = f'Failed to create PDF: {str(pdf_error)}'
+            job_store.update(task_id, status='error', error=f'Failed to create PDF: {str(pdf_error)}')
             return
         
     except Exception as e:
         print(f"Error in background generation: {str(e)}")
-        generation_progress[task_id]['status'] = 'error'
-        generation_progress[task_id]['error'] = str(e)
+        job_store.update(task_id, status='error', error=str(e))
+    finally:
+        # Close /stream_progress/<task_id> streams, however the generation ended
+        progress = job_store.get(task_id) or {}
+        active_books.dec(path=book_path)
+        metrics.stage_seconds.observe(time.perf_counter() - book_start, stage=f'book_{book_path}',
+                                      outcome='ok' if progress.get('status') == 'complete' else 'error')
+        _send_sse_event(task_id, 'generation_complete', {
+            'success': progress.get('status') == 'complete',
+            'status': progress.get('status'),
+            'completed_pages': progress.get('progress', 0),
+            'error': progress.get('error')
+        })
 
 @app.route('/generate-story', methods=['POST'])
 def generate_story():
@@ -5858,26 +6366,31 @@ def get_progress(task_id):
     # Yield to eventlet to prevent blocking
     eventlet.sleep(0)
     
-    if task_id not in generation_progress:
+    progress = job_store.get(task_id)
+    if progress is None:
         return jsonify({'error': 'Task not found'}), 404
     
-    progress = generation_progress[task_id]
     return jsonify({
-        'status': progress['status'],
-        'progress': progress['progress'],
-        'total': progress['total'],
-        'current_step': progress['current_step'],
+        'status': progress.get('status'),
+        'progress': progress.get('progress', 0),
+        'total': progress.get('total'),
+        'current_step': progress.get('current_step'),
         'error': progress.get('error')
     })
 
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """Stage timing histograms and pipeline gauges in Prometheus text format."""
+    return Response(metrics.render(), content_type=METRICS_CONTENT_TYPE)
+
 @app.route('/download/<task_id>', methods=['GET'])
 def download_pdf(task_id):
     """Download the generated PDF."""
-    if task_id not in generation_progress:
+    progress = job_store.get(task_id)
+    if progress is None:
         return jsonify({'error': 'Task not found'}), 404
     
-    progress = generation_progress[task_id]
-    if progress['status'] != 'complete' or not progress['pdf_path']:
+    if progress.get('status') != 'complete' or not progress.get('pdf_path'):
         return jsonify({'error': 'PDF not ready yet'}), 400
     
     pdf_path = progress['pdf_path']
@@ -5896,15 +6409,6 @@ def download_pdf(task_id):
         download_name=f"Storybook.pdf"
     )
 
-def init_db():
-    """
-    Initialize the database by creating all tables.
-    This should be called once to set up the database schema.
-    """
-    with app.app_context():
-        db.create_all()
-        print("✅ Database initialized successfully!")
-
 if __name__ == '__main__':
     import sys
     import io
@@ -5912,6 +6416,9 @@ if __name__ == '__main__':
     
     # Initialize database tables
     init_db()
+    # "python project.py init-db" only sets up the database (the one-shot deploy step)
+    if sys.argv[1:] == ['init-db']:
+        sys.exit(0)
     
     port = int(os.environ.get('PORT', 5000))
     print("✨ Starting Fairy Tale Generator...")
@@ -0,0 +1,195 @@
+"""
+Prompt templates compiled once and filled per page within a length budget.
+
+A template is parsed once into literal text and named slots. Sections that are
+the same for every page of a book (outfit rules, the consistency lock, ...) are
+bound with bind(), which renders them into the literal text, so assembling a
+page prompt is one join over a handful of pieces.
+
+The length budget is enforced while the prompt is composed: the literal text has
+a known length, so render() knows how many characters the slots may use and
+shortens the lowest-priority slots first (at a sentence end where possible).
+Nothing is cut out of an assembled prompt after the fact.
+
+Usage:
+    template = PromptTemplate(
+        "{scene}\\n\\nRULES:\\n{rules}\\n\\nREFERENCE:\\n{reference}",
+        slots=[Slot('scene', priority=2), Slot('reference', max_chars=400, priority=1)],
+        max_length=4000
+    )
+    book_template = template.bind(rules=outfit_rules)      # once per book
+    prompt = book_template.render(scene=page_prompt, reference=master_reference)
+"""
+
+import string
+
+
+class Slot:
+    """A per-page value in a template."""
+    
+    def __init__(self, name, max_chars=None, priority=0):
+        """
+        Args:
+            name: Placeholder name in the template
+            max_chars: Values longer than this are cut to it (None: no limit of its own)
+            priority: Slots with lower priority are shortened first when the prompt is over budget
+        """
+        self.name = name
+        self.max_chars = max_chars
+        self.priority = priority
+    
+    def __repr__(self):
+        return f'Slot({self.name!r}, max_chars={self.max_chars}, priority={self.priority})'
+
+
+def shorten(text, length):
+    """
+    Cut text to at most length characters, ending at a sentence if that keeps at least half of it.
+    
+    Returns:
+        str: The shortened text
+    """
+    if len(text) <= length:
+        return text
+    if length <= 0:
+        return ''
+    cut = text[:length]
+    period = cut.rfind('.')
+    return cut[:period + 1] if period >= length // 2 else cut
+
+
+class PromptTemplate:
+    """
+    Literal text with named slots, rendered with a length budget.
+    
+    Placeholders use str.format syntax without format specs ("{name}"; "{{" for a
+    literal brace). Placeholders without a Slot are plain slots (priority 0, no limit).
+    """
+    
+    def __init__(self, template, slots=(), max_length=None):
+        """
+        Args:
+            template: Template text
+            slots: Slot definitions for placeholders that need a limit or priority
+            max_length: Maximum rendered length (None: unlimited)
+        
+        Raises:
+            ValueError: If a placeholder has a format spec or the literal text alone exceeds max_length
+        """
+        pieces = []
+        for literal, name, spec, conversion in string.Formatter().parse(template):
+            if literal:
+                pieces.append(literal)
+            if name is not None:
+                if not name or spec or conversion:
+                    raise ValueError(f"Unsupported placeholder {{{name}{'!' + conversion if conversion else ''}{':' + spec if spec else ''}}}")
+                pieces.append(Slot(name))
+        defined = {slot.name: slot for slot in slots}
+        self._init(pieces, defined, max_length)
+    
+    def _init(self, pieces, defined, max_length):
+        # Merge adjacent literals and attach the slot definitions
+        defined = dict(defined)
+        merged = []
+        for piece in pieces:
+            if isinstance(piece, Slot):
+                piece = defined.setdefault(piece.name, piece)
+            elif merged and isinstance(merged[-1], str):
+                merged[-1] += piece
+                continue
+            merged.append(piece)
+        self._pieces = merged
+        self._defined = defined
+        self.max_length = max_length
+        self.slots = []
+        self._uses = []
+        # render() copies the literal pieces and drops the slot values into their positions
+        self._parts = []
+        self._positions = []
+        slot_index = {}
+        self.fixed_length = 0
+        for position, piece in enumerate(merged):
+            if isinstance(piece, Slot):
+                if piece.name not in slot_index:
+                    slot_index[piece.name] = len(self.slots)
+                    self.slots.append(piece)
+                    self._uses.append(0)
+                index = slot_index[piece.name]
+                self._uses[index] += 1
+                self._positions.append((position, index))
+                self._parts.append('')
+            else:
+                self._parts.append(piece)
+                self.fixed_length += len(piece)
+        self.slot_names = tuple(slot.name for slot in self.slots)
+        self._limits = tuple((slot.name, slot.max_chars) for slot in self.slots)
+        self._single_use = all(uses == 1 for uses in self._uses)
+        if max_length is not None and self.fixed_length > max_length:
+            raise ValueError(f"Template text is {self.fixed_length} characters, over the {max_length} character budget")
+        # Shortening order for render(): lowest priority first, later slots first among equals
+        self._shorten_order = sorted(range(len(self.slots)), key=lambda index: (self.slots[index].priority, -index))
+    
+    def bind(self, **values):
+        """
+        Render some slots into the literal text.
+        
+        Args:
+            **values: Slot values that stay the same for every render (cut to the slot's max_chars)
+        
+        Returns:
+            PromptTemplate: A new template without those slots
+        """
+        unknown = set(values) - set(self.slot_names)
+        if unknown:
+            raise KeyError(f"Template has no slot {', '.join(sorted(unknown))}")
+        pieces = []
+        for piece in self._pieces:
+            if isinstance(piece, Slot) and piece.name in values:
+                value = '' if values[piece.name] is None else str(values[piece.name])
+                piece = value[:piece.max_chars] if piece.max_chars is not None else value
+            pieces.append(piece)
+        bound = PromptTemplate.__new__(PromptTemplate)
+        bound._init(pieces, self._defined, self.max_length)
+        return bound
+    
+    def render(self, **values):
+        """
+        Fill the slots and return the prompt.
+        
+        Args:
+            **values: A value for every slot (None renders as empty)
+        
+        Returns:
+            str: Prompt of at most max_length characters
+        """
+        filled = []
+        for name, max_chars in self._limits:
+            if name not in values:
+                raise KeyError(f"Missing prompt slot: {name}")
+            value = values[name]
+            if value is None:
+                value = ''
+            elif not isinstance(value, str):
+                value = str(value)
+            if max_chars is not None and len(value) > max_chars:
+                value = value[:max_chars]
+            filled.append(value)
+        
+        if self.max_length is not None:
+            if self._single_use:
+                over = self.fixed_length + sum(map(len, filled)) - self.max_length
+            else:
+                over = self.fixed_length + sum(len(value) * uses for value, uses in zip(filled, self._uses)) - self.max_length
+            for index in self._shorten_order:
+                if over <= 0:
+                    break
+                value = filled[index]
+                count = self._uses[index]
+                keep = max(0, len(value) - -(-over // count))
+                filled[index] = shorten(value, keep)
+                over -= (len(value) - len(filled[index])) * count
+        
+        parts = self._parts.copy()
+        for position, index in self._positions:
+            parts[position] = filled[index]
+        return ''.join(parts)
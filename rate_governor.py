@@ -0,0 +1,526 @@
+"""
+Rate limiting, retries and fair queueing for OpenAI API calls.
+
+Every OpenAI request (chat completions, DALL-E image generation, embeddings)
+goes through one RateGovernor. For each model it keeps two token buckets - one
+for requests per minute and one for tokens per minute - and a request only goes
+out once both have room. The budgets start from the configured limits and are
+then kept in line with the x-ratelimit-* headers OpenAI returns, so a worker
+also backs off when other workers sharing the API key use up the budget.
+
+Failed requests are retried with jittered exponential backoff: 429s (honouring
+Retry-After, and pausing the whole model until then), 5xx errors, timeouts and
+connection errors. Other errors (bad request, authentication, ...) are raised
+immediately.
+
+Requests waiting for a model's budget are served round-robin by book, so one
+book with 13 pages queued cannot starve a book that started later. A thread's
+book is set with enter_book(), e.g. as the initializer of a book's thread pool.
+
+Usage:
+    governor = RateGovernor(parse_rate_limits("gpt-4o=500:30000,dall-e-3=7"))
+    client = GovernedClient(OpenAI(api_key=key, max_retries=0), governor)
+    governor.enter_book(task_id)
+    client.chat.completions.create(model="gpt-4o", messages=[...])   # waits, retries
+    governor.stats()   # {'models': {'gpt-4o': {...}}, 'retries': ..., ...}
+"""
+
+import random
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Requests without a book (e.g. calls made outside a generation task) share this key
+DEFAULT_BOOK = '-'
+
+# Tokens assumed for an image in a chat request (a 1024x1024 high-detail image is 765)
+IMAGE_INPUT_TOKENS = 765
+# Completion tokens assumed when a chat request does not set max_tokens
+DEFAULT_COMPLETION_TOKENS = 1000
+
+# HTTP statuses worth retrying besides 429
+RETRYABLE_STATUS_CODES = {408, 409, 500, 502, 503, 504}
+
+
+def parse_rate_limits(spec):
+    """
+    Parse a rate limit specification such as "gpt-4o=500:30000,dall-e-3=7".
+    
+    Each entry is model=requests_per_minute[:tokens_per_minute]; 0 means no limit.
+    
+    Args:
+        spec: Comma-separated list of entries (may be None or empty)
+    
+    Returns:
+        dict: Mapping of model name to (requests_per_minute, tokens_per_minute)
+    """
+    limits = {}
+    if not spec:
+        return limits
+    for part in spec.split(','):
+        part = part.strip()
+        if not part or '=' not in part:
+            continue
+        model, value = part.split('=', 1)
+        rpm, _, tpm = value.partition(':')
+        try:
+            limits[model.strip()] = (int(rpm or 0), int(tpm or 0))
+        except ValueError:
+            print(f"⚠️  Warning: Ignoring invalid rate limit '{part}'")
+    return limits
+
+
+def parse_reset_duration(value):
+    """
+    Parse an x-ratelimit-reset-* header value such as "1s", "6m0s" or "59.6ms".
+    
+    Args:
+        value: Header value (may be None)
+    
+    Returns:
+        float: Seconds, or None if the value cannot be parsed
+    """
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    units = {'h': 3600.0, 'm': 60.0, 's': 1.0, 'ms': 0.001}
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ms|h|m|s)', value)
+    if not parts:
+        return None
+    return sum(float(amount) * units[unit] for amount, unit in parts)
+
+
+def estimate_tokens(kind, kwargs):
+    """
+    Estimate the tokens a request counts against the tokens-per-minute budget.
+    
+    OpenAI counts the prompt plus max_tokens when admitting a request; the
+    prompt is estimated at 4 characters per token.
+    
+    Args:
+        kind: 'chat', 'images' or 'embeddings'
+        kwargs: Keyword arguments of the API call
+    
+    Returns:
+        int: Estimated tokens (0 for image generation, which is limited by requests)
+    """
+    if kind == 'chat':
+        chars = 0
+        images = 0
+        for message in kwargs.get('messages') or []:
+            content = message.get('content') if isinstance(message, dict) else None
+            if isinstance(content, str):
+                chars += len(content)
+            elif isinstance(content, list):
+                for part in content:
+                    if part.get('type') == 'text':
+                        chars += len(part.get('text') or '')
+                    elif part.get('type') == 'image_url':
+                        images += 1
+        return chars // 4 + images * IMAGE_INPUT_TOKENS + (kwargs.get('max_tokens') or DEFAULT_COMPLETION_TOKENS)
+    if kind == 'embeddings':
+        items = kwargs.get('input')
+        if isinstance(items, str):
+            items = [items]
+        return sum(len(item) for item in items or [] if isinstance(item, str)) // 4 + 1
+    return 0
+
+
+class TokenBucket:
+    """Budget refilled continuously at a per-minute rate, allowing short bursts."""
+    
+    def __init__(self, per_minute, burst_seconds=10.0):
+        """
+        Args:
+            per_minute: Units (requests or tokens) allowed per minute
+            burst_seconds: Bucket capacity, in seconds of refill
+        """
+        self.burst_seconds = burst_seconds
+        self.set_rate(per_minute)
+        self.level = self.capacity
+        self._updated = time.monotonic()
+    
+    def set_rate(self, per_minute):
+        """Change the per-minute rate (e.g. to the limit reported by the API)."""
+        self.per_minute = per_minute
+        self.rate = per_minute / 60.0
+        self.capacity = max(1.0, self.rate * self.burst_seconds)
+        if hasattr(self, 'level'):
+            self.level = min(self.level, self.capacity)
+    
+    def _refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate)
+        self._updated = now
+    
+    def wait_time(self, amount, now):
+        """Seconds until `amount` can be taken (0 if it can be taken now)."""
+        self._refill(now)
+        # A request larger than the whole bucket goes out once the bucket is full
+        needed = min(amount, self.capacity)
+        if self.level >= needed:
+            return 0.0
+        return (needed - self.level) / self.rate
+    
+    def take(self, amount):
+        self.level -= amount
+    
+    def give_back(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+    
+    def cap(self, remaining):
+        """Lower the level to what the API reports as remaining."""
+        self.level = min(self.level, remaining)
+
+
+class _ModelLane:
+    """Budgets, waiting requests and counters for one model."""
+    
+    def __init__(self, model, requests_per_minute, tokens_per_minute, burst_seconds):
+        self.model = model
+        self.burst_seconds = burst_seconds
+        self.requests = TokenBucket(requests_per_minute, burst_seconds) if requests_per_minute else None
+        self.tokens = TokenBucket(tokens_per_minute, burst_seconds) if tokens_per_minute else None
+        self.waiting = OrderedDict()  # book -> deque of tickets, served round-robin
+        self.paused_until = 0.0
+        self.calls = 0
+        self.tokens_used = 0
+        self.rate_limited = 0
+        self.retries = 0
+        self.failures = 0
+        self.wait_seconds = 0.0
+        self.peak_waiting = 0
+    
+    def next_ticket(self):
+        for tickets in self.waiting.values():
+            return tickets[0]
+        return None
+    
+    def wait_time(self, tokens, now):
+        waits = [self.paused_until - now, 0.0]
+        if self.requests is not None:
+            waits.append(self.requests.wait_time(1, now))
+        if self.tokens is not None and tokens:
+            waits.append(self.tokens.wait_time(tokens, now))
+        return max(waits)
+    
+    def bucket(self, kind, limit):
+        """Return the requests/tokens bucket, creating or re-rating it for a reported limit."""
+        attr = 'requests' if kind == 'requests' else 'tokens'
+        bucket = getattr(self, attr)
+        if bucket is None:
+            bucket = TokenBucket(limit, self.burst_seconds)
+            setattr(self, attr, bucket)
+        elif bucket.per_minute != limit:
+            bucket.set_rate(limit)
+        return bucket
+
+
+class RateGovernor:
+    """Token-bucket rate limiting, retry with backoff and fair queueing per model."""
+    
+    def __init__(self, limits=None, max_retries=5, backoff_base=1.0, backoff_max=60.0, burst_seconds=10.0):
+        """
+        Args:
+            limits: Dict of model -> (requests_per_minute, tokens_per_minute); models not
+                    listed are only limited once the API reports their limits
+            max_retries: Retries after the first attempt
+            backoff_base: Delay before the first retry, doubled on every further retry
+            backoff_max: Longest delay between retries
+            burst_seconds: Bucket capacity in seconds of budget
+        """
+        self.limits = dict(limits or {})
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.burst_seconds = burst_seconds
+        self._cond = threading.Condition()
+        self._lanes = {}
+        self._local = threading.local()
+    
+    
+    def enter_book(self, book_id):
+        """Attribute this thread's requests to a book (usable as a thread pool initializer)."""
+        self._local.book = book_id
+    
+    def current_book(self):
+        """Return the book this thread's requests are attributed to (None if unset)."""
+        return getattr(self._local, 'book', None)
+    
+    
+    def _lane(self, model):
+        lane = self._lanes.get(model)
+        if lane is None:
+            rpm, tpm = self.limits.get(model, (0, 0))
+            lane = _ModelLane(model, rpm, tpm, self.burst_seconds)
+            self._lanes[model] = lane
+        return lane
+    
+    def _acquire(self, model, book, tokens):
+        """Wait for this book's turn and for the model's budget, then take it."""
+        ticket = object()
+        with self._cond:
+            lane = self._lane(model)
+            lane.waiting.setdefault(book, deque()).append(ticket)
+            lane.peak_waiting = max(lane.peak_waiting, sum(len(t) for t in lane.waiting.values()))
+            started = time.monotonic()
+            try:
+                while True:
+                    if lane.next_ticket() is ticket:
+                        now = time.monotonic()
+                        wait = lane.wait_time(tokens, now)
+                        if wait <= 0:
+                            break
+                        self._cond.wait(wait)
+                    else:
+                        self._cond.wait()
+                
+                if lane.requests is not None:
+                    lane.requests.take(1)
+                if lane.tokens is not None:
+                    lane.tokens.take(tokens)
+                lane.calls += 1
+                lane.wait_seconds += time.monotonic() - started
+            finally:
+                # Leave the queue; the book goes to the back of the round-robin order
+                tickets = lane.waiting[book]
+                tickets.remove(ticket)
+                del lane.waiting[book]
+                if tickets:
+                    lane.waiting[book] = tickets
+                self._cond.notify_all()
+    
+    def _observe(self, model, headers, estimated_tokens, used_tokens):
+        """Update a model's budget from the response headers and actual token usage."""
+        with self._cond:
+            lane = self._lane(model)
+            if used_tokens is not None:
+                lane.tokens_used += used_tokens
+                if lane.tokens is not None:
+                    # Give back what the estimate over-counted (or take what it missed)
+                    lane.tokens.give_back(estimated_tokens - used_tokens)
+            if headers is not None:
+                now = time.monotonic()
+                for kind in ('requests', 'tokens'):
+                    limit = _int_header(headers, f'x-ratelimit-limit-{kind}')
+                    remaining = _int_header(headers, f'x-ratelimit-remaining-{kind}')
+                    if not limit:
+                        continue
+                    bucket = lane.bucket(kind, limit)
+                    if remaining is not None:
+                        bucket.cap(remaining)
+                        if remaining <= 0:
+                            reset = parse_reset_duration(headers.get(f'x-ratelimit-reset-{kind}'))
+                            if reset:
+                                lane.paused_until = max(lane.paused_until, now + reset)
+            self._cond.notify_all()
+    
+    def _backoff(self, model, error, attempt, estimated_tokens):
+        """
+        Decide whether a failed request is retried.
+        
+        Returns:
+            float: Seconds to wait before the retry, or None to give up
+        """
+        status = getattr(error, 'status_code', None)
+        rate_limited = status == 429
+        retryable = rate_limited or status in RETRYABLE_STATUS_CODES or (status is None and _is_connection_error(error))
+        with self._cond:
+            lane = self._lane(model)
+            if rate_limited:
+                lane.rate_limited += 1
+            if not retryable or attempt >= self.max_retries:
+                lane.failures += 1
+                return None
+            lane.retries += 1
+            
+            # Full jitter: somewhere between half and all of the exponential delay
+            delay = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+            delay = random.uniform(delay / 2, delay)
+            if rate_limited:
+                retry_after = _retry_after(error)
+                if retry_after is not None:
+                    delay = max(delay, min(retry_after, self.backoff_max))
+                # The request was not counted by the API; pause every book's requests for this model
+                if lane.tokens is not None:
+                    lane.tokens.give_back(estimated_tokens)
+                lane.paused_until = max(lane.paused_until, time.monotonic() + delay)
+                self._cond.notify_all()
+            return delay
+    
+    
+    def call(self, kind, resource, method, kwargs, default_model=None):
+        """
+        Make one governed API call.
+        
+        Args:
+            kind: 'chat', 'images' or 'embeddings' (for token estimates)
+            resource: OpenAI resource object, e.g. client.chat.completions
+            method: Method name on the resource ('create' or 'generate')
+            kwargs: Keyword arguments of the call
+            default_model: Model used when the call does not name one
+        
+        Returns:
+            The parsed API response
+        """
+        model = kwargs.get('model') or default_model or kind
+        book = self.current_book() or DEFAULT_BOOK
+        estimated_tokens = estimate_tokens(kind, kwargs)
+        # with_raw_response exposes the rate limit headers
+        raw_resource = getattr(resource, 'with_raw_response', None)
+        
+        attempt = 0
+        while True:
+            self._acquire(model, book, estimated_tokens)
+            try:
+                if raw_resource is not None:
+                    raw = getattr(raw_resource, method)(**kwargs)
+                    headers = raw.headers
+                    result = raw.parse()
+                else:
+                    headers = None
+                    result = getattr(resource, method)(**kwargs)
+            except Exception as e:
+                delay = self._backoff(model, e, attempt, estimated_tokens)
+                if delay is None:
+                    raise
+                print(f"⚠️  OpenAI {model} request failed ({type(e).__name__}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+                attempt += 1
+                continue
+            
+            usage = getattr(result, 'usage', None)
+            used_tokens = getattr(usage, 'total_tokens', None) if usage is not None else None
+            self._observe(model, headers, estimated_tokens, used_tokens)
+            return result
+    
+    def stats(self):
+        """
+        Return per-model counters for monitoring.
+        
+        Returns:
+            dict: {'models': {model: {calls, tokens_used, rate_limited, retries, failures,
+                   wait_seconds, waiting, peak_waiting, requests_per_minute, tokens_per_minute}},
+                   'calls', 'retries', 'rate_limited', 'failures'}
+        """
+        with self._cond:
+            models = {}
+            for model, lane in self._lanes.items():
+                models[model] = {
+                    'calls': lane.calls,
+                    'tokens_used': lane.tokens_used,
+                    'rate_limited': lane.rate_limited,
+                    'retries': lane.retries,
+                    'failures': lane.failures,
+                    'wait_seconds': round(lane.wait_seconds, 3),
+                    'waiting': sum(len(t) for t in lane.waiting.values()),
+                    'peak_waiting': lane.peak_waiting,
+                    'requests_per_minute': lane.requests.per_minute if lane.requests else None,
+                    'tokens_per_minute': lane.tokens.per_minute if lane.tokens else None
+                }
+        return {
+            'models': models,
+            'calls': sum(m['calls'] for m in models.values()),
+            'retries': sum(m['retries'] for m in models.values()),
+            'rate_limited': sum(m['rate_limited'] for m in models.values()),
+            'failures': sum(m['failures'] for m in models.values())
+        }
+
+
+def _int_header(headers, name):
+    try:
+        value = headers.get(name)
+        return int(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def _retry_after(error):
+    """Seconds from the Retry-After / retry-after-ms headers of an API error, if any."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers is None:
+        return None
+    try:
+        if headers.get('retry-after-ms') is not None:
+            return float(headers['retry-after-ms']) / 1000.0
+        if headers.get('retry-after') is not None:
+            return float(headers['retry-after'])
+    except (TypeError, ValueError):
+        return None
+    return None
+
+
+def _is_connection_error(error):
+    # openai.APIConnectionError (and its APITimeoutError subclass) or a raw httpx transport error
+    names = {cls.__name__ for cls in type(error).__mro__}
+    return bool(names & {'APIConnectionError', 'APITimeoutError', 'TransportError'})
+
+
+
+class _GovernedResource:
+    """Proxy for an OpenAI resource whose create()/generate() go through the governor."""
+    
+    def __init__(self, governor, resource, kind, methods):
+        self._governor = governor
+        self._resource = resource
+        self._kind = kind
+        self._methods = methods
+    
+    def __getattr__(self, name):
+        if name in self._methods:
+            def governed(**kwargs):
+                return self._governor.call(self._kind, self._resource, name, kwargs)
+            return governed
+        return getattr(self._resource, name)
+
+
+class _GovernedChat:
+    def __init__(self, governor, chat):
+        self._chat = chat
+        self.completions = _GovernedResource(governor, chat.completions, 'chat', ('create',))
+    
+    def __getattr__(self, name):
+        return getattr(self._chat, name)
+
+
+class GovernedClient:
+    """
+    OpenAI client wrapper: chat.completions.create, images.generate and
+    embeddings.create are rate limited and retried; everything else is passed through.
+    """
+    
+    def __init__(self, client, governor):
+        """
+        Args:
+            client: OpenAI client, or a function returning one; it is then called on first use,
+                    so creating the wrapper does not import the openai package
+            governor: RateGovernor
+        """
+        self.governor = governor
+        self._client = None
+        self._factory = client if callable(client) else None
+        self._lock = threading.Lock()
+        if self._factory is None:
+            self._wrap(client)
+    
+    def _wrap(self, client):
+        self.chat = _GovernedChat(self.governor, client.chat)
+        self.images = _GovernedResource(self.governor, client.images, 'images', ('generate',))
+        self.embeddings = _GovernedResource(self.governor, client.embeddings, 'embeddings', ('create',))
+        self._client = client
+    
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._wrap(self._factory())
+        # chat, images and embeddings exist once the client has been created
+        if name in self.__dict__:
+            return self.__dict__[name]
+        return getattr(self._client, name)
@@ -0,0 +1,191 @@
+"""
+Process-wide catalogue of story templates (Storyline rows) held in memory.
+
+Storylines are static template data: they change only when stories are seeded or
+edited. The catalogue loads every storyline once, parses its pages_json once, and
+serves lookups by story ID and by gender from memory, so generating a book or
+listing stories never queries the database or parses JSON.
+
+Entries are immutable: a StoryTemplate is a namedtuple and its pages are a tuple
+of read-only mappings (types.MappingProxyType); copy a page with dict(page) to
+change it. A reload builds new entries and swaps them in whole, so readers never
+see a half-loaded catalogue and need no lock.
+
+The catalogue is reloaded when:
+    - invalidate() was called (load_stories.py does this after seeding); the next
+      lookup reloads
+    - the storylines fingerprint (row count and sum of Storyline.version, which
+      set_pages() increments) changed; a background thread checks it every
+      check_interval_seconds, so other worker processes pick up edits too
+
+Usage:
+    catalog = StoryCatalog(load_rows, fingerprint, check_interval_seconds=30)
+    catalog.start()
+    story = catalog.get('red')          # StoryTemplate or None
+    for page in story.pages: ...
+    catalog.by_gender('girl')           # tuple of StoryTemplate
+"""
+
+import json
+import threading
+import time
+from collections import namedtuple
+from collections.abc import Mapping
+from types import MappingProxyType
+
+StoryTemplate = namedtuple('StoryTemplate', ['story_id', 'name', 'gender', 'pages', 'version'])
+
+
+def freeze_pages(pages):
+    """
+    Convert parsed pages to an immutable tuple of read-only mappings.
+    
+    Args:
+        pages: List of page dictionaries, or the pages_json string
+    
+    Returns:
+        tuple: One MappingProxyType per page (entries that are not objects are skipped)
+    """
+    if isinstance(pages, (str, bytes)):
+        try:
+            pages = json.loads(pages)
+        except (json.JSONDecodeError, TypeError):
+            return ()
+    if not isinstance(pages, list):
+        return ()
+    return tuple(MappingProxyType(dict(page)) for page in pages if isinstance(page, Mapping))
+
+
+class StoryCatalog:
+    """In-memory storylines by story ID and gender, reloaded when the source changes."""
+    
+    def __init__(self, load_rows, fingerprint=None, check_interval_seconds=30):
+        """
+        Args:
+            load_rows: Callable returning the storylines as dicts with story_id, name, gender,
+                       pages (list or pages_json string) and version
+            fingerprint: Callable returning a value that changes whenever a storyline does
+                         (None: only invalidate() triggers a reload)
+            check_interval_seconds: Seconds between background fingerprint checks (0: no thread)
+        """
+        self.load_rows = load_rows
+        self.fingerprint = fingerprint
+        self.check_interval_seconds = check_interval_seconds
+        self._by_id = None
+        self._by_gender = {}
+        self._all = ()
+        self._fingerprint = None
+        self._stale = True
+        self._load_lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+        self.loads = 0
+        self.loaded_at = None
+    
+    def load(self):
+        """
+        Load every storyline and swap the new entries in.
+        
+        Returns:
+            int: Number of storylines loaded
+        """
+        with self._load_lock:
+            return self._load()
+    
+    def _load(self):
+        # Read the fingerprint first: a change while loading triggers another reload
+        fingerprint = self.fingerprint() if self.fingerprint else None
+        stories = tuple(
+            StoryTemplate(row['story_id'], row['name'], row['gender'], freeze_pages(row['pages']),
+                          row.get('version'))
+            for row in self.load_rows()
+        )
+        by_gender = {}
+        for story in stories:
+            by_gender.setdefault(story.gender, []).append(story)
+        self._by_gender = {gender: tuple(entries) for gender, entries in by_gender.items()}
+        self._all = stories
+        self._by_id = {story.story_id: story for story in stories}
+        self._fingerprint = fingerprint
+        self._stale = False
+        self.loads += 1
+        self.loaded_at = time.time()
+        return len(stories)
+    
+    def _ensure_loaded(self):
+        if self._stale or self._by_id is None:
+            with self._load_lock:
+                # Another thread may have reloaded while this one waited
+                if self._stale or self._by_id is None:
+                    self._load()
+    
+    def invalidate(self):
+        """Drop the loaded entries; the next lookup reloads them."""
+        self._stale = True
+    
+    def check(self):
+        """
+        Reload if the storylines fingerprint changed since the last load.
+        
+        Returns:
+            bool: Whether the catalogue was reloaded
+        """
+        if self.fingerprint is None:
+            return False
+        if self._by_id is not None and not self._stale and self.fingerprint() == self._fingerprint:
+            return False
+        self.load()
+        return True
+    
+    def get(self, story_id):
+        """
+        Return a story template.
+        
+        Returns:
+            StoryTemplate or None if there is no such story
+        """
+        self._ensure_loaded()
+        return self._by_id.get(story_id)
+    
+    def by_gender(self, gender):
+        """Return the story templates for a gender ('boy' or 'girl'), in load order."""
+        self._ensure_loaded()
+        return self._by_gender.get(gender, ())
+    
+    def all(self):
+        """Return every story template, in load order."""
+        self._ensure_loaded()
+        return self._all
+    
+    def start(self):
+        """Start the background fingerprint check (no-op without a fingerprint or interval)."""
+        with self._load_lock:
+            if self._thread is None and self.fingerprint and self.check_interval_seconds > 0:
+                self._thread = threading.Thread(target=self._run, name='story-catalog', daemon=True)
+                self._thread.start()
+    
+    def _run(self):
+        while not self._closed.wait(self.check_interval_seconds):
+            try:
+                if self.check():
+                    print(f"✓ Story catalogue reloaded: {len(self._all)} stories")
+            except Exception as e:
+                print(f"Error checking story catalogue: {str(e)}")
+    
+    def stats(self):
+        """
+        Return counters for monitoring.
+        
+        Returns:
+            dict: stories, loads, loaded_at, stale
+        """
+        return {
+            'stories': len(self._all),
+            'loads': self.loads,
+            'loaded_at': self.loaded_at,
+            'stale': self._stale
+        }
+    
+    def close(self):
+        """Stop the background check."""
+        self._closed.set()
@@ -0,0 +1,315 @@
+"""
+Dependency-graph task scheduler for storybook generation.
+
+A book is described as a set of named tasks, each with the tasks it depends on.
+Tasks whose dependencies are satisfied run concurrently on a shared thread pool,
+subject to per-stage concurrency limits (e.g. at most 2 DALL-E calls and 4 vision
+calls in flight for one book). After the run the graph reports wall time, the
+serial time the same work would have taken, and the critical path - the chain of
+dependent tasks that determined how long the book took.
+
+Usage:
+    graph = TaskGraph('book-123', max_workers=8, stage_limits={'dalle': 2})
+    graph.add('cover', lambda results: make_cover(), stage='dalle')
+    graph.add('style', lambda results: analyze(results['cover']), deps=['cover'], stage='vision')
+    results = graph.run()
+    print(graph.summary())
+"""
+
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+# Task states
+PENDING = 'pending'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+SKIPPED = 'skipped'
+
+
+def parse_stage_limits(spec):
+    """
+    Parse a stage concurrency specification such as "dalle=2,vision=4".
+    
+    Args:
+        spec: Comma-separated list of stage=limit pairs (may be None or empty)
+    
+    Returns:
+        dict: Mapping of stage name to maximum concurrent tasks
+    """
+    limits = {}
+    if not spec:
+        return limits
+    for part in spec.split(','):
+        part = part.strip()
+        if not part or '=' not in part:
+            continue
+        stage, value = part.split('=', 1)
+        try:
+            limit = int(value.strip())
+        except ValueError:
+            print(f"⚠️  Warning: Ignoring invalid stage limit '{part}'")
+            continue
+        if limit > 0:
+            limits[stage.strip()] = limit
+    return limits
+
+
+class _Task:
+    """Internal record for a single task in the graph."""
+    
+    def __init__(self, name, fn, deps, soft_deps, stage):
+        self.name = name
+        self.fn = fn
+        self.deps = list(deps)
+        self.soft_deps = list(soft_deps)
+        self.stage = stage
+        self.state = PENDING
+        self.result = None
+        self.error = None
+        self.started_at = None
+        self.finished_at = None
+    
+    @property
+    def duration(self):
+        if self.started_at is None or self.finished_at is None:
+            return 0.0
+        return self.finished_at - self.started_at
+
+
+class TaskGraph:
+    """
+    A per-book graph of tasks executed as soon as their dependencies allow.
+    
+    Each task function is called with a single argument: a dictionary of the
+    results of every task that has finished so far (failed or skipped tasks map
+    to None). A task only starts once all of its hard dependencies succeeded;
+    if any hard dependency fails, the task is skipped. Soft dependencies only
+    have to finish - their failure does not prevent the task from running.
+    """
+    
+    def __init__(self, name, max_workers=8, stage_limits=None, on_task_done=None, initializer=None, initargs=()):
+        """
+        Args:
+            name: Label used in log output (e.g. the task/book ID)
+            max_workers: Maximum number of tasks running at once across all stages
+            stage_limits: Optional dict of stage name -> maximum concurrent tasks
+            on_task_done: Optional callback(name, state, result) invoked after each task finishes
+            initializer: Optional callable run once in each pool thread (see ThreadPoolExecutor)
+            initargs: Arguments for initializer
+        """
+        self.name = name
+        self.max_workers = max(1, int(max_workers))
+        self.stage_limits = dict(stage_limits or {})
+        self.on_task_done = on_task_done
+        self.initializer = initializer
+        self.initargs = tuple(initargs)
+        self._tasks = {}
+        self._order = []
+        self._cond = threading.Condition()
+        self._running_by_stage = {}
+        self._running = 0
+        self._started_at = None
+        self._finished_at = None
+    
+    def add(self, name, fn, deps=(), soft_deps=(), stage=None):
+        """
+        Register a task.
+        
+        Args:
+            name: Unique task name
+            fn: Callable taking the results dictionary
+            deps: Names of tasks that must succeed before this task runs
+            soft_deps: Names of tasks that must finish (success or failure) first
+            stage: Optional stage name used for concurrency limits and reporting
+        """
+        if name in self._tasks:
+            raise ValueError(f"Duplicate task name: {name}")
+        self._tasks[name] = _Task(name, fn, deps, soft_deps, stage)
+        self._order.append(name)
+    
+    def _results_snapshot(self):
+        return {name: task.result for name, task in self._tasks.items()
+                if task.state in (SUCCEEDED, FAILED, SKIPPED)}
+    
+    def _stage_has_capacity(self, stage):
+        limit = self.stage_limits.get(stage)
+        if limit is None:
+            return True
+        return self._running_by_stage.get(stage, 0) < limit
+    
+    def _resolve(self, task):
+        """Return 'ready', 'wait' or 'skip' for a pending task."""
+        for dep in task.deps:
+            dep_task = self._tasks.get(dep)
+            if dep_task is None or dep_task.state in (FAILED, SKIPPED):
+                return 'skip'
+            if dep_task.state != SUCCEEDED:
+                return 'wait'
+        for dep in task.soft_deps:
+            dep_task = self._tasks.get(dep)
+            if dep_task is not None and dep_task.state in (PENDING, RUNNING):
+                return 'wait'
+        return 'ready'
+    
+    def _execute(self, task, results):
+        """Run one task on a pool thread and record its outcome."""
+        task.started_at = time.perf_counter()
+        try:
+            task.result = task.fn(results)
+            task.state = SUCCEEDED
+        except Exception as e:
+            task.error = e
+            task.result = None
+            task.state = FAILED
+            print(f"✗ Task '{task.name}' failed in graph {self.name}: {str(e)}")
+            traceback.print_exc()
+        finally:
+            task.finished_at = time.perf_counter()
+            with self._cond:
+                self._running -= 1
+                if task.stage is not None:
+                    self._running_by_stage[task.stage] -= 1
+                self._cond.notify_all()
+        self._notify_done(task)
+    
+    def _notify_done(self, task):
+        if self.on_task_done is None:
+            return
+        try:
+            self.on_task_done(task.name, task.state, task.result)
+        except Exception as e:
+            print(f"Warning: on_task_done callback failed for '{task.name}': {str(e)}")
+    
+    def run(self):
+        """
+        Execute every task, respecting dependencies and concurrency limits.
+        
+        Returns:
+            dict: Mapping of task name to result (None for failed or skipped tasks)
+        """
+        self._started_at = time.perf_counter()
+        pending = list(self._order)
+        
+        with ThreadPoolExecutor(max_workers=self.max_workers, initializer=self.initializer, initargs=self.initargs) as executor:
+            with self._cond:
+                while pending or self._running:
+                    launched = False
+                    for name in list(pending):
+                        task = self._tasks[name]
+                        status = self._resolve(task)
+                        if status == 'skip':
+                            task.state = SKIPPED
+                            pending.remove(name)
+                            self._cond.release()
+                            try:
+                                self._notify_done(task)
+                            finally:
+                                self._cond.acquire()
+                            launched = True
+                            continue
+                        if status != 'ready':
+                            continue
+                        if self._running >= self.max_workers or not self._stage_has_capacity(task.stage):
+                            continue
+                        task.state = RUNNING
+                        pending.remove(name)
+                        self._running += 1
+                        if task.stage is not None:
+                            self._running_by_stage[task.stage] = self._running_by_stage.get(task.stage, 0) + 1
+                        executor.submit(self._execute, task, self._results_snapshot())
+                        launched = True
+                    
+                    if launched:
+                        continue
+                    if not self._running:
+                        # Nothing running and nothing can start: unknown or cyclic dependencies
+                        for name in pending:
+                            self._tasks[name].state = SKIPPED
+                            print(f"✗ Task '{name}' in graph {self.name} has unsatisfiable dependencies")
+                        pending = []
+                        break
+                    self._cond.wait()
+        
+        self._finished_at = time.perf_counter()
+        return self._results_snapshot()
+    
+    def state(self, name):
+        """Return the state of a task ('pending', 'running', 'succeeded', 'failed' or 'skipped')."""
+        return self._tasks[name].state
+    
+    def error(self, name):
+        """Return the exception raised by a failed task, or None."""
+        return self._tasks[name].error
+    
+    def critical_path(self):
+        """
+        Compute the longest chain of dependent tasks by measured duration.
+        
+        Returns:
+            tuple: (critical_path_seconds, [task names along the path in execution order])
+        """
+        finish = {}
+        previous = {}
+        visiting = set()
+        
+        def longest(name):
+            if name in finish:
+                return finish[name]
+            visiting.add(name)
+            task = self._tasks[name]
+            best_dep, best_time = None, 0.0
+            for dep in task.deps + task.soft_deps:
+                # Unknown dependencies and edges that close a cycle (whose tasks run() skipped) add nothing
+                if dep not in self._tasks or dep in visiting:
+                    continue
+                dep_time = longest(dep)
+                if dep_time > best_time:
+                    best_dep, best_time = dep, dep_time
+            visiting.discard(name)
+            finish[name] = best_time + task.duration
+            previous[name] = best_dep
+            return finish[name]
+        
+        if not self._tasks:
+            return 0.0, []
+        end = max(self._order, key=longest)
+        path = []
+        node = end
+        while node is not None:
+            path.append(node)
+            node = previous[node]
+        path.reverse()
+        return finish[end], path
+    
+    def summary(self):
+        """
+        Summarise the run for logging.
+        
+        Returns:
+            dict: wall_seconds, serial_seconds, critical_path_seconds, critical_path,
+                  per-stage busy time, and counts of succeeded/failed/skipped tasks
+        """
+        wall = 0.0
+        if self._started_at is not None and self._finished_at is not None:
+            wall = self._finished_at - self._started_at
+        critical_seconds, critical_path = self.critical_path()
+        stage_seconds = {}
+        counts = {SUCCEEDED: 0, FAILED: 0, SKIPPED: 0}
+        for task in self._tasks.values():
+            stage = task.stage or 'default'
+            stage_seconds[stage] = round(stage_seconds.get(stage, 0.0) + task.duration, 3)
+            if task.state in counts:
+                counts[task.state] += 1
+        return {
+            'wall_seconds': round(wall, 3),
+            'serial_seconds': round(sum(t.duration for t in self._tasks.values()), 3),
+            'critical_path_seconds': round(critical_seconds, 3),
+            'critical_path': critical_path,
+            'stage_seconds': stage_seconds,
+            'succeeded': counts[SUCCEEDED],
+            'failed': counts[FAILED],
+            'skipped': counts[SKIPPED]
+        }
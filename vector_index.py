@@ -0,0 +1,186 @@
+"""
+In-memory vector index for the per-book RAG context store.
+
+Each finished page adds one row: its embedding plus the consistency information
+extracted from it. Rows are L2-normalised once when they are added and kept in a
+preallocated float32 matrix, so a query is one matrix-vector product followed by
+argpartition for the top k - no per-row array rebuilding or norm computation.
+The matrix doubles in capacity when it fills up.
+
+Without NumPy the same interface falls back to pure Python lists.
+
+Usage:
+    index = VectorIndex()
+    index.add(create_embedding(page_text), {'page_number': 2, 'consistency_info': info})
+    for score, metadata in index.search(create_embedding(query_text), top_k=3):
+        ...
+"""
+
+import base64
+import threading
+
+from lazy_import import lazy_module
+
+# numpy is optional and imported on first use (see lazy_import.py)
+np = lazy_module('numpy')
+NUMPY_AVAILABLE = np is not None
+
+
+def decode_embedding(embedding):
+    """
+    Convert an embedding from the API to a vector.
+    
+    Args:
+        embedding: List of floats, or a base64 string of little-endian float32 values
+                   (the API's encoding_format='base64')
+    
+    Returns:
+        float32 NumPy array (list of floats without NumPy), or None for an empty embedding
+    """
+    if embedding is None:
+        return None
+    if isinstance(embedding, str):
+        raw = base64.b64decode(embedding)
+        if NUMPY_AVAILABLE:
+            vector = np.frombuffer(raw, dtype='<f4').astype(np.float32)
+        else:
+            import array
+            values = array.array('f')
+            values.frombytes(raw)
+            vector = values.tolist()
+    elif NUMPY_AVAILABLE:
+        vector = np.asarray(embedding, dtype=np.float32)
+    else:
+        vector = [float(v) for v in embedding]
+    return vector if len(vector) else None
+
+
+def unit_vector(vector):
+    """
+    L2-normalise a vector.
+    
+    Returns:
+        The normalised vector (float32 array with NumPy), or None if it is empty or all zeros
+    """
+    if vector is None or not len(vector):
+        return None
+    if NUMPY_AVAILABLE:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm > 0 else None
+    norm = sum(v * v for v in vector) ** 0.5
+    return [v / norm for v in vector] if norm > 0 else None
+
+
+class VectorIndex:
+    """
+    Cosine-similarity top-k search over a growing set of rows with metadata.
+    
+    Rows added without a usable vector (e.g. the embedding request failed) keep
+    their metadata and position in items() but are never returned by search().
+    Safe to add and search from several threads.
+    """
+    
+    def __init__(self, dimensions=None, capacity=16):
+        """
+        Args:
+            dimensions: Vector length (taken from the first vector added if None)
+            capacity: Rows preallocated before the first resize
+        """
+        self.dimensions = dimensions
+        self._capacity = max(1, int(capacity))
+        self._matrix = None
+        self._searchable = []
+        self._metadata = []
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._metadata)
+    
+    def _allocate(self, rows):
+        if NUMPY_AVAILABLE:
+            matrix = np.zeros((rows, self.dimensions), dtype=np.float32)
+            if self._matrix is not None:
+                matrix[:len(self._metadata)] = self._matrix[:len(self._metadata)]
+            self._matrix = matrix
+        elif self._matrix is None:
+            # Rows added before the dimensions were known have no vector
+            self._matrix = [None] * len(self._metadata)
+    
+    def add(self, vector, metadata):
+        """
+        Append a row.
+        
+        Args:
+            vector: Embedding (list, array or base64 string; normalised here), or None
+            metadata: Object returned with the row by search() and items()
+        
+        Returns:
+            int: Row number
+        """
+        vector = unit_vector(decode_embedding(vector))
+        with self._lock:
+            if vector is not None and self.dimensions is None:
+                self.dimensions = len(vector)
+            if vector is not None and len(vector) != self.dimensions:
+                raise ValueError(f"Expected a vector of {self.dimensions} dimensions, got {len(vector)}")
+            row = len(self._metadata)
+            if self.dimensions is not None:
+                if self._matrix is None:
+                    self._allocate(max(self._capacity, row + 1))
+                elif NUMPY_AVAILABLE and row >= len(self._matrix):
+                    self._allocate(len(self._matrix) * 2)
+            if NUMPY_AVAILABLE:
+                if vector is not None:
+                    self._matrix[row] = vector
+            elif self._matrix is not None:
+                self._matrix.append(vector)
+            self._searchable.append(vector is not None)
+            self._metadata.append(metadata)
+            return row
+    
+    def search(self, query, top_k=3):
+        """
+        Find the rows most similar to a query vector.
+        
+        Args:
+            query: Query embedding (list, array or base64 string)
+            top_k: Maximum number of rows returned
+        
+        Returns:
+            list: (cosine similarity, metadata) tuples, most similar first
+        """
+        query = unit_vector(decode_embedding(query))
+        if query is None or top_k <= 0:
+            return []
+        with self._lock:
+            rows = len(self._metadata)
+            if self._matrix is None or not rows:
+                return []
+            if len(query) != self.dimensions:
+                raise ValueError(f"Expected a query of {self.dimensions} dimensions, got {len(query)}")
+            searchable = list(self._searchable)
+            metadata = list(self._metadata)
+            if NUMPY_AVAILABLE:
+                scores = self._matrix[:rows] @ query
+            else:
+                scores = [sum(a * b for a, b in zip(row, query)) if row is not None else 0.0
+                          for row in self._matrix[:rows]]
+        
+        if NUMPY_AVAILABLE:
+            if not all(searchable):
+                scores[~np.asarray(searchable)] = -np.inf
+            k = min(top_k, sum(searchable))
+            if k <= 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k] if k < rows else np.arange(rows)
+            top = top[np.argsort(-scores[top], kind='stable')]
+            return [(float(scores[i]), metadata[i]) for i in top if searchable[i]][:k]
+        
+        ranked = sorted((i for i in range(rows) if searchable[i]), key=lambda i: scores[i], reverse=True)
+        return [(scores[i], metadata[i]) for i in ranked[:top_k]]
+    
+    def items(self):
+        """Return the metadata of every row, in the order rows were added."""
+        with self._lock:
+            return list(self._metadata)
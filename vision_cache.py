@@ -0,0 +1,208 @@
+"""
+Content-addressed on-disk cache for GPT-4o vision responses.
+
+Vision helpers (child photo analysis, illustration style, master reference
+extraction, ...) send an image plus a prompt and get text back. The same image
+is often sent again with the same prompt - a retried job, or a parent uploading
+the same photo twice - so responses are cached on disk keyed by:
+
+    (image SHA-256, prompt template name + version, model, max_tokens, prompt digest)
+
+Bumping a template's version invalidates every cached response for it. The cache
+is bounded by total size: when it grows past max_bytes, the least recently used
+entries (by file modification time, refreshed on every hit) are evicted.
+
+Usage:
+    cache = VisionCache('/path/to/cache', max_bytes=256 * 1024 * 1024)
+    key = cache.make_key(image_sha, 'child_appearance', 1, 'gpt-4o', 400, prompt_sha)
+    content = cache.get(key)
+    if content is None:
+        content = call_the_api()
+        cache.put(key, content)
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+
+class VisionCache:
+    """
+    Size-bounded LRU cache of vision responses stored as small JSON files.
+    
+    Entries live under cache_dir/<first two hex chars>/<key>.json. Hit, miss and
+    eviction counters are kept in memory for the current process.
+    """
+    
+    def __init__(self, cache_dir, max_bytes=256 * 1024 * 1024, bypass=False):
+        """
+        Args:
+            cache_dir: Directory where cached responses are stored
+            max_bytes: Maximum total size of the cache before LRU eviction
+            bypass: If True, never read or write the cache (for debugging)
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.bypass = bypass
+        self._lock = threading.Lock()
+        self._total_bytes = None  # Computed lazily on first write
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bypassed = 0
+    
+    @staticmethod
+    def make_key(image_sha256, template, template_version, model, max_tokens, prompt_digest=''):
+        """
+        Build the cache key for a vision request.
+        
+        Args:
+            image_sha256: Hex SHA-256 of the raw image bytes
+            template: Prompt template name (e.g. 'child_appearance')
+            template_version: Version of the template; bump to invalidate old responses
+            model: Model name (e.g. 'gpt-4o')
+            max_tokens: max_tokens used for the request
+            prompt_digest: Digest of the rendered prompt, for templates with parameters
+        
+        Returns:
+            str: Hex SHA-256 cache key
+        """
+        raw = f"{image_sha256}|{template}|v{template_version}|{model}|{max_tokens}|{prompt_digest}"
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+    
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+    
+    def get(self, key):
+        """
+        Look up a cached response.
+        
+        Returns:
+            str or None: The cached response content, or None on a miss
+        """
+        if self.bypass:
+            with self._lock:
+                self.bypassed += 1
+            return None
+        
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            # Refresh the modification time so eviction is least-recently-used
+            os.utime(path, None)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        
+        with self._lock:
+            self.hits += 1
+        return entry.get('content')
+    
+    def put(self, key, content, **metadata):
+        """
+        Store a response in the cache, evicting old entries if the cache is full.
+        
+        Args:
+            key: Key from make_key()
+            content: Response text to cache
+            metadata: Optional extra fields stored alongside the content (for inspection)
+        """
+        if self.bypass or content is None:
+            return
+        
+        path = self._path(key)
+        entry = dict(metadata)
+        entry['content'] = content
+        entry['created_at'] = time.time()
+        data = json.dumps(entry, ensure_ascii=False).encode('utf-8')
+        
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write atomically so concurrent readers never see a partial file
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            previous_size = os.path.getsize(path) if os.path.exists(path) else 0
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Warning: Could not write vision cache entry: {str(e)}")
+            return
+        
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_size()
+            else:
+                self._total_bytes += len(data) - previous_size
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+    
+    def _entries(self):
+        """Yield (path, size, mtime) for every cache entry."""
+        if not os.path.isdir(self.cache_dir):
+            return
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.json'):
+                    try:
+                        stat = entry.stat()
+                    except OSError:
+                        continue
+                    yield entry.path, stat.st_size, stat.st_mtime
+    
+    def _scan_size(self):
+        return sum(size for _, size, _ in self._entries())
+    
+    def _evict(self):
+        """Delete least recently used entries until the cache is at 90% of max_bytes."""
+        target = int(self.max_bytes * 0.9)
+        entries = sorted(self._entries(), key=lambda item: item[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                self.evictions += 1
+            except OSError:
+                continue
+        self._total_bytes = total
+    
+    def clear(self):
+        """Remove every cached entry."""
+        with self._lock:
+            for path, _, _ in list(self._entries()):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            self._total_bytes = 0
+    
+    def stats(self):
+        """
+        Return cache counters for monitoring.
+        
+        Returns:
+            dict: hits, misses, hit_rate, evictions, bypassed, bypass flag and current size in bytes
+        """
+        with self._lock:
+            if self._total_bytes is None:
+                self._total_bytes = self._scan_size()
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'evictions': self.evictions,
+                'bypassed': self.bypassed,
+                'bypass': self.bypass,
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes
+            }